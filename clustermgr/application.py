@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
 import re
+import time
 
 from flask import Flask
 from flask import url_for
@@ -10,6 +11,9 @@ from clustermgr.extensions import db, csrf, migrate, wlogger, \
     login_manager, mailer
 from .core.license import license_manager
 from clustermgr.models import AppConfiguration
+from clustermgr.core import log_archive
+from clustermgr.core.clustermgr_installer import close_shells
+from clustermgr.core.clustermgr_logging import sys_logger as logger
 from clustermgr.version import __version__
 
 
@@ -22,7 +26,24 @@ def init_celery(app, celery):
 
         def __call__(self, *args, **kwargs):
             with app.app_context():
-                return TaskBase.__call__(self, *args, **kwargs)
+                start = time.time()
+                status = 'FAILURE'
+                try:
+                    result = TaskBase.__call__(self, *args, **kwargs)
+                    status = 'SUCCESS'
+                    return result
+                finally:
+                    close_shells()
+                    # buffered logs are written and archived before the task
+                    # state, so the final state is never seen without all
+                    # messages
+                    wlogger.flush()
+                    if self.request.id:
+                        try:
+                            log_archive.archive(self.request.id, status, start)
+                        except Exception as e:
+                            logger.error("Log of task %s could not be "
+                                         "archived: %s", self.request.id, e)
 
     celery.Task = ContextTask
 
@@ -89,6 +89,80 @@ class Config(object):
     MAIL_DEFAULT_RECIPIENT_ADDRESS = ["admin@localhost"]
 
     INFLUXDB_LOGGING_DB = "gluu_logs"
+    LOG_COLLECT_BATCH = 5000
+
+    # InfluxDB writes, see core/influx_writer.py
+    INFLUX_BATCH_SIZE = 5000
+    INFLUX_WRITE_RETRIES = 3
+    INFLUX_RETRY_BACKOFF = 1
+
+    # SSH connection pool shared by RemoteClient instances
+    SSH_POOL_MAX_PER_HOST = 4
+    SSH_POOL_MAX_IDLE = 300
+    SSH_POOL_KEEPALIVE = 30
+    SSH_POOL_LEASE_TIMEOUT = 30
+    SSH_CONNECT_TIMEOUT = 10
+    SSH_CONNECT_RACE_DELAY = 0.25
+    # default deadline of commands run by RemoteClient, 0 waits until they end
+    SSH_COMMAND_TIMEOUT = 120
+    SSH_STREAM_MAX_LINE = 65536
+    SSH_STREAM_MAX_STDERR = 65536
+    INSTALLER_LOG_BATCH = 50
+    INSTALLER_LOG_TAIL = 200
+    INSTALLER_SHELL_SESSION = True
+    # installation steps may run for long, 0 waits until they end
+    INSTALLER_COMMAND_TIMEOUT = 0
+    SHELL_SESSION_START_TIMEOUT = 30
+
+    # Node agent answering status requests over a single SSH channel
+    AGENT_REMOTE_PATH = '/var/monitoring/scripts/node_agent.py'
+    AGENT_START_TIMEOUT = 10
+    AGENT_CALL_TIMEOUT = 30
+
+    # Large file transfers, e.g. offline Gluu archives
+    SFTP_CHUNK_SIZE = 8 * 1024 * 1024
+    SFTP_STREAMS = 4
+    SFTP_WINDOW_SIZE = 16 * 1024 * 1024
+    RELAY_TIMEOUT = 1800
+
+    # Buffered writes of task logs, see weblogger.py
+    WEBLOGGER_BATCH_SIZE = 100
+    WEBLOGGER_FLUSH_INTERVAL = 1
+    WEBLOGGER_TTL = 86400
+    WEBLOGGER_MAX_MESSAGE_BYTES = 65536
+    WEBLOGGER_SPILL_DIR = os.path.join(LOGS_DIR, 'weblogger')
+    TASK_LOG_ARCHIVE_DIR = os.path.join(LOGS_DIR, 'tasks')
+    TASK_LOG_ARCHIVE_CACHE_TTL = 86400
+    TASK_LOG_ARCHIVE_SCAN = 5000
+    # 'stream' or 'list', see weblogger.StreamStore
+    WEBLOGGER_STORE = 'stream'
+    WEBLOGGER_STREAM_MAXLEN = 50000
+    WEBLOGGER_MEMORY_BUDGET = 64 * 1024 * 1024
+
+    # Preflight port probes, see core/preflight.py
+    PREFLIGHT_TIMEOUT = 10
+    PREFLIGHT_PROBE_TIMEOUT = 2
+
+    # Cached facts of servers, see core/host_facts.py
+    HOST_FACTS_TTL = 3600
+
+    # Cluster fan-out of remote commands
+    SSH_MAX_SESSIONS = 8
+    FANOUT_MAX_WORKERS = 16
+    FANOUT_HOST_DEADLINE = 30
+    MONITORING_HOST_DEADLINE = 240
+    # per host collection of monitoring data, see tasks/get_remote_stats.py
+    MONITORING_MAX_WORKERS = 8
+    MONITORING_STAGGER = 60
+    MONITORING_LOCK_TTL = 900
+    # seconds between samples of the collector service on nodes
+    MONITORING_SAMPLE_INTERVAL = 15
+    # seconds rows are kept in the sqlite store of nodes, older periods are
+    # served from 1 minute and 1 hour rollups
+    MONITORING_RAW_RETENTION = 7 * 86400
+    MONITORING_1M_RETENTION = 30 * 86400
+    MONITORING_1H_RETENTION = 400 * 86400
+
     SUPPORTED_OS = ['CentOS 8','CentOS 7', 'RHEL 7', 'RHEL 8', 'Ubuntu 18', 'Ubuntu 20']
 
 class ProductionConfig(Config):
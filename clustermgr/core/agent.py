@@ -0,0 +1,322 @@
+"""agent.py - client of the node agent running on cluster servers.
+
+Status checks used to start a Python interpreter on the node for every probe
+(port checks, HTTP health checks, get_data.py queries). The node agent
+(monitoring_scripts/node_agent.py) is started once per SSH connection and
+answers typed requests as json lines over a single channel. If the agent
+can't be started, e.g. python3 is missing on the node, the typed methods
+fall back to plain shell commands.
+"""
+
+import os
+import json
+import time
+import shlex
+import base64
+import select
+
+from clustermgr.config import Config
+from clustermgr.core.clustermgr_logging import remote_logger as logger
+
+
+AGENT_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                            'monitoring_scripts', 'node_agent.py')
+
+
+class AgentError(Exception):
+    """Raised when the agent fails to answer a request."""
+    pass
+
+
+class NodeAgent(object):
+    """Typed RPC to the node agent of a server.
+
+    Args:
+        conn (:class:`clustermgr.core.remote.RemoteClient`): started client
+            of the server
+
+    Attributes:
+        available (bool): False if the agent could not be started and shell
+            commands are used instead, None if not tried yet
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.channel = None
+        self.available = None
+        self.counter = 0
+        self._buffer = b''
+
+    @property
+    def active(self):
+        return self.channel is not None and not self.channel.closed
+
+    def _start_command(self):
+        with open(AGENT_SCRIPT, 'rb') as f:
+            source = base64.b64encode(f.read()).decode()
+        path = Config.AGENT_REMOTE_PATH
+        return (
+            "if [ -f {0} ]; then exec python3 -u {0}; else exec python3 -u -c "
+            "\"import base64;exec(base64.b64decode('{1}'))\"; fi"
+        ).format(path, source)
+
+    def start(self):
+        """Starts the agent, the deployed script is used if present.
+
+        Returns:
+            True if the agent answers, False otherwise
+        """
+        self.close()
+        try:
+            transport = self.conn.client.get_transport()
+            self.channel = transport.open_session(
+                                        timeout=Config.AGENT_START_TIMEOUT)
+            self.channel.exec_command(self._start_command())
+            self.available = self.call(
+                        'ping', timeout=Config.AGENT_START_TIMEOUT) == 'pong'
+        except Exception as e:
+            logger.warning("[%s] Node agent could not be started: %s",
+                            self.conn.host, e)
+            self.available = False
+
+        if not self.available:
+            self.close()
+        return self.available
+
+    def _ensure_started(self):
+        if self.available is False:
+            return False
+        if not self.active:
+            return self.start()
+        return True
+
+    def _readline(self, deadline):
+        channel = self.channel
+        while b'\n' not in self._buffer:
+            while channel.recv_stderr_ready():
+                data = channel.recv_stderr(32768)
+                if not data:
+                    break
+                logger.debug("[%s] Node agent: %s", self.conn.host, data)
+            if channel.recv_ready():
+                data = channel.recv(32768)
+                if not data:
+                    raise AgentError("Node agent exited")
+                self._buffer += data
+                continue
+            if channel.closed or channel.exit_status_ready():
+                raise AgentError("Node agent exited")
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise AgentError("Node agent did not answer in time")
+            select.select([channel], [], [], min(remaining, 0.5))
+
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line
+
+    def call(self, op, params=None, timeout=None):
+        """Sends a request to the agent and waits for its response.
+
+        Args:
+            op (string): name of the operation
+            params (dict, optional): parameters of the operation
+            timeout (float, optional): seconds to wait for the response,
+                defaults to Config.AGENT_CALL_TIMEOUT
+
+        Returns:
+            result of the operation
+
+        Raises:
+            AgentError: if the agent is not running, the operation failed or
+                did not answer in time. The agent is stopped in the latter
+                case, since its output can't be matched to requests anymore.
+        """
+        if not self.active:
+            raise AgentError("Node agent is not running")
+
+        self.counter += 1
+        request_id = self.counter
+        request = {'id': request_id, 'op': op, 'params': params or {}}
+        deadline = time.time() + (timeout or Config.AGENT_CALL_TIMEOUT)
+
+        try:
+            self.channel.sendall((json.dumps(request) + '\n').encode())
+            while True:
+                response = json.loads(self._readline(deadline).decode())
+                if response.get('id') == request_id:
+                    break
+        except Exception as e:
+            self.close()
+            if isinstance(e, AgentError):
+                raise
+            raise AgentError(str(e))
+
+        if not response.get('ok'):
+            raise AgentError(response.get('error'))
+
+        return response.get('result')
+
+    def _shell(self, cmd):
+        return self.conn.run(cmd)[1].strip()
+
+    def call_many(self, requests, timeout=None):
+        """Sends several requests to the agent in one round trip, the agent
+        runs them concurrently.
+
+        Args:
+            requests (list): tuples of operation name and parameters dict
+            timeout (float, optional): seconds to wait for all responses
+
+        Returns:
+            list of response dicts having ok, and result or error keys
+        """
+        return self.call('batch', {'requests': [
+                            {'op': op, 'params': params or {}}
+                            for op, params in requests]}, timeout=timeout)
+
+    @staticmethod
+    def _port_cmd(host, port, timeout):
+        return ("timeout {0} bash -c '</dev/tcp/{1}/{2}' >/dev/null 2>&1 "
+                "&& echo 0 || echo 1".format(int(timeout) or 1, host, port))
+
+    @staticmethod
+    def _http_cmd(url, timeout):
+        return "curl -sk -m {0} -w '\n%{{http_code}}' '{1}'".format(
+                                                        int(timeout), url)
+
+    @staticmethod
+    def _http_result(output):
+        body, _, status = output.rpartition('\n')
+        if not status.isdigit() or status == '000':
+            return None, body
+        return int(status), body
+
+    def port_open(self, host, port, timeout=2.0):
+        """Returns whether a TCP connection to host:port can be made from the
+        server."""
+        if self._ensure_started():
+            try:
+                return self.call('port', {'host': host, 'port': port,
+                                          'timeout': timeout}) == 0
+            except AgentError as e:
+                # a failure of the agent doesn't mean the port is closed
+                logger.warning("[%s] Node agent could not check port, "
+                               "checking with shell: %s", self.conn.host, e)
+
+        return self._shell(self._port_cmd(host, port, timeout)) == '0'
+
+    def ports_open(self, targets, timeout=2.0):
+        """Same as port_open() for a list of (host, port) tuples, checked
+        concurrently in one round trip.
+
+        Returns:
+            list of booleans in the same order as targets
+        """
+        if not targets:
+            return []
+
+        if self._ensure_started():
+            try:
+                responses = self.call_many(
+                    [('port', {'host': host, 'port': port, 'timeout': timeout})
+                     for host, port in targets], timeout=timeout + 5)
+                return [r['ok'] and r['result'] == 0 for r in responses]
+            except AgentError as e:
+                logger.warning("[%s] Node agent could not check ports, "
+                               "checking with shell: %s", self.conn.host, e)
+
+        results = self.conn.run_batch(
+                    [self._port_cmd(host, port, timeout)
+                     for host, port in targets], parallel=True)
+        return [r.stdout.strip() == '0' for r in results]
+
+    def http_get(self, url, timeout=10.0):
+        """Makes an HTTP GET request on the server, certificates are not
+        verified.
+
+        Returns:
+            tuple: status code (None if the request failed) and body
+        """
+        if self._ensure_started():
+            try:
+                result = self.call('http', {'url': url, 'timeout': timeout},
+                                   timeout=timeout + 5)
+            except AgentError as e:
+                return None, str(e)
+            return result['status'], result['body']
+
+        return self._http_result(self.conn.run(self._http_cmd(url, timeout))[1])
+
+    def http_get_many(self, urls, timeout=10.0):
+        """Same as http_get() for a list of urls, requested concurrently in
+        one round trip.
+
+        Returns:
+            list of (status, body) tuples in the same order as urls
+        """
+        if not urls:
+            return []
+
+        if self._ensure_started():
+            responses = self.call_many(
+                    [('http', {'url': url, 'timeout': timeout}) for url in urls],
+                    timeout=timeout + 5)
+            return [(r['result']['status'], r['result']['body']) if r['ok']
+                    else (None, r['error']) for r in responses]
+
+        results = self.conn.run_batch(
+                    [self._http_cmd(url, timeout) for url in urls],
+                    parallel=True)
+        return [self._http_result(r.stdout) for r in results]
+
+    def stat(self, paths):
+        """Returns dict of path to a dict of exists, size, mtime, mode and
+        isdir for each of paths."""
+        if self._ensure_started():
+            return self.call('stat', {'paths': list(paths)})
+
+        result = {}
+        for path, st in self.conn.stat_many(paths).items():
+            result[path] = {'exists': False}
+            if st:
+                result[path] = dict(st, exists=True)
+        return result
+
+    def file_hash(self, path):
+        """Returns sha256 hex digest of a file on the server."""
+        if self._ensure_started():
+            return self.call('hash', {'path': path})
+        return self._shell(
+                    'sha256sum {}'.format(shlex.quote(path))).split(' ')[0]
+
+    def metrics(self, measurement, start=0):
+        """Returns dict of fields and data of a measurement collected by the
+        monitoring scripts after start."""
+        if self._ensure_started():
+            return self.call('metrics', {'measurement': measurement,
+                                         'start': start})
+        output = self._shell(
+            'python3 /var/monitoring/scripts/get_data.py stats {} {}'.format(
+                                                        measurement, start))
+        return json.loads(output)['data']
+
+    def uptime(self):
+        """Returns uptime of the server in seconds."""
+        if self._ensure_started():
+            return self.call('uptime')
+        return int(float(self._shell('cat /proc/uptime').split()[0]))
+
+    def service_status(self, name):
+        """Returns the output of systemctl is-active for the service."""
+        if self._ensure_started():
+            return self.call('service', {'name': name})
+        return self._shell('systemctl is-active {}'.format(name))
+
+    def close(self):
+        if getattr(self, 'channel', None) is not None:
+            try:
+                self.channel.close()
+            except Exception:
+                pass
+            self.channel = None
+            self._buffer = b''
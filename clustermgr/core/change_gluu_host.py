@@ -5,6 +5,8 @@ import argparse
 
 from clustermgr.core.remote import RemoteClient
 from clustermgr.core.clustermgr_installer import Installer
+from clustermgr.core import desired_config
+from clustermgr.core.desired_config import ConfigFile
 
 
 from ldap3 import Server, Connection, SUBTREE, BASE, LEVEL, \
@@ -152,12 +154,10 @@ class ChangeGluuHostname:
             https_gluu = os.path.join(self.container, 'etc/apache2/sites-available/https_gluu.conf')
             conf_files = [https_gluu]
 
-        for conf_file in conf_files:
-            result, fileObj = self.c.get_file(conf_file)
-            if result:
-                config_text = fileObj.read()
-                config_text = config_text.replace(self.old_host, self.new_host)
-                self.c.put_file(conf_file, config_text)
+        replace_host = lambda config_text: config_text.replace(self.old_host, self.new_host)
+        desired_config.apply(self.installer, [
+                ConfigFile(conf_file, edit=replace_host) for conf_file in conf_files
+                ])
 
 
     def create_new_certs(self):
@@ -203,11 +203,14 @@ class ChangeGluuHostname:
     def modify_etc_hosts(self):
         print("Modifying /etc/hosts")
         hosts_file = os.path.join(self.container, 'etc/hosts')
-        r = self.c.get_file(hosts_file)
-        if r[0]:
-            old_hosts = r[1]
-            news_hosts = modify_etc_hosts([(self.new_host, self.ip_address)], old_hosts, self.old_host)
-            print(self.c.put_file(hosts_file, news_hosts)) 
+        # lines are parsed while the file is read
+        try:
+            news_hosts = modify_etc_hosts([(self.new_host, self.ip_address)],
+                                    self.c.iter_file(hosts_file), self.old_host)
+        except Exception as e:
+            print("Can't read {}: {}".format(hosts_file, e))
+        else:
+            print(self.c.put_file(hosts_file, news_hosts))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
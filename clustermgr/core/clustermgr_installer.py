@@ -1,11 +1,33 @@
 import sys
 import os
 import re
+import codecs
 import select
 import time
+import shlex
+import weakref
 
+from collections import deque
+
+from clustermgr.config import Config
 from clustermgr.extensions import wlogger
-from clustermgr.core.remote import RemoteClient
+from clustermgr.core.remote import RemoteClient, CommandResult, file_sums
+from clustermgr.core.shell_session import ShellSession, ShellSessionError, \
+    ShellSessionExited
+from clustermgr.core import host_facts
+
+# installers having an open shell session, they are closed when the task
+# using them ends, see close_shells()
+_shell_installers = weakref.WeakSet()
+
+
+def close_shells():
+    """Closes shell sessions opened by installers of the current task, so
+    that their channels are not left open on pooled connections.
+    """
+    for installer in list(_shell_installers):
+        installer.close_shell()
+
 
 class Installer:
     def __init__(self, conn, gluu_version, server_os=None, logger_task_id=None, server_id=None, ssh_port=22):
@@ -18,6 +40,8 @@ class Installer:
         self.ssh_port = ssh_port
         self.clone_type = None
         self.hostname = ''
+        self.shell = None
+        self.use_shell_session = Config.INSTALLER_SHELL_SESSION
 
         if conn.__class__.__name__ != "RemoteClient" and conn.__class__.__name__ != 'FakeRemote':
             self.server_os = conn.os
@@ -63,13 +87,28 @@ class Installer:
                     )
         
         if self.conn and not self.server_os:
-            self.get_os_type()
+            if isinstance(self.conn, RemoteClient):
+                self.server_os = self.facts['os']
+            else:
+                self.get_os_type()
     
         self.settings()
     
     @property
     def os_version(self):
         return self.server_os.split()[1]
+
+    @property
+    def facts(self):
+        """Cached facts of the server, see :mod:`clustermgr.core.host_facts`.
+        They are gathered in one round trip if not cached."""
+        return host_facts.get(self.conn, self.facts_container)
+
+    @property
+    def facts_container(self):
+        if self.gluu_version and self.gluu_version.startswith('nochroot'):
+            return '/'
+        return host_facts.GLUU_CONTAINER
     
     def settings(self):
         self.init_command = '/sbin/gluu-serverd {0}'
@@ -108,7 +147,11 @@ class Installer:
     def get_os_type(self):
         # 2. Linux Distribution of the server
         print("Installer> Determining OS type")
-        self.server_os = self.conn.get_os_type()
+        if isinstance(self.conn, RemoteClient):
+            self.server_os = host_facts.get(self.conn, self.facts_container,
+                                            refresh=True)['os']
+        else:
+            self.server_os = self.conn.get_os_type()
         print("Installer> OS type was determined as " + self.server_os)
         return self.server_os
 
@@ -150,21 +193,235 @@ class Installer:
 
         print("Installer> executing: {}".format(cmd))
         self.log_command(run_cmd)
-        result = self.conn.run(run_cmd)
+
+        result = None
+        if inside and run_cmd != cmd:
+            result = self.run_in_shell(cmd)
+        if result is None:
+            result = self.conn.run(run_cmd,
+                                   timeout=Config.INSTALLER_COMMAND_TIMEOUT)
+
         if not nolog:
             self.log(result, error_exception)
 
         return result
 
-    def run_channel_command(self, cmd, re_list=[]):
+    def run_in_shell(self, cmd):
+        """Runs cmd in the container through a shell session kept open for
+        this installer, which saves the nested SSH handshake of each command.
+
+        Returns:
+            result of the command, or None if the session can't be used and
+            cmd should be run with the nested ssh command. If the shell exited
+            while cmd was running, the result has exit_status None.
+        """
+        if not (self.use_shell_session and isinstance(self.conn, RemoteClient)):
+            return None
+
+        if not (self.shell and self.shell.active):
+            try:
+                self.shell = ShellSession(self.conn, self.run_command.format('bash'))
+                _shell_installers.add(self)
+                self.shell.start()
+            except Exception as e:
+                # don't retry a session for each command if it can't be started
+                print("Installer> Shell session can't be used: {}".format(e))
+                self.close_shell()
+                self.use_shell_session = False
+                return None
+
+        try:
+            return self.shell.run(cmd,
+                                  timeout=Config.INSTALLER_COMMAND_TIMEOUT)
+        except ShellSessionExited as e:
+            # cmd was sent and may have run partly or completely, so it is
+            # not run again
+            print("Installer> Shell session exited while running command: {}".format(e))
+            self.close_shell()
+            return CommandResult(e.stdout, str(e), None)
+        except ShellSessionError as e:
+            # the session is dropped and cmd is run with the nested ssh
+            # command, a new session is started for the next command
+            print("Installer> Shell session failed: {}".format(e))
+            self.close_shell()
+            return None
+
+    def close_shell(self):
+        if self.shell:
+            self.shell.close()
+            self.shell = None
+        _shell_installers.discard(self)
+
+    def __del__(self):
+        if getattr(self, 'shell', None):
+            self.close_shell()
+
+    def run_script(self, script, inside=True, error_exception=None, nolog=False,
+                   secrets=None):
+        """Runs a shell script in a single command, the script is sent to
+        bash over stdin. Unlike writing the script to a file and running it,
+        this takes one round trip.
+
+        Arguments of the commands in the script are visible in the process
+        list while they run, so passwords should be given with secrets and
+        passed to commands as password files.
+
+        Args:
+            script (string): commands to be run by bash
+            inside (bool): run in the container
+            error_exception: see log()
+            nolog (bool): don't send output to web logger
+            secrets (dict, optional): shell variable name to secret. Each
+                secret is written by the shell builtin printf to a file
+                readable by root only, the variable is set to the path of
+                the file. Files are removed when the script exits.
+
+        Returns:
+            :class:`CommandResult` of the script
+        """
+        if self.gluu_version and self.gluu_version.startswith('nochroot'):
+            inside = False
+
+        # bash parses the whole group before running it, so commands reading
+        # stdin get /dev/null instead of the rest of the script
+        script = '{\n' + script + '\n} </dev/null\n'
+
+        if secrets:
+            prelude = [
+                'umask 077',
+                '__cm_secrets=$(mktemp -d) || exit 1',
+                'trap \'rm -rf "$__cm_secrets"\' EXIT',
+                ]
+            for name, secret in secrets.items():
+                prelude.append(
+                    'printf %s {1} >"$__cm_secrets/{0}"; '
+                    '{0}="$__cm_secrets/{0}"'.format(name, shlex.quote(secret)))
+            script = '\n'.join(prelude) + '\n' + script
+        run_cmd = self.run_command.format('bash -s') if inside else 'bash -s'
+
+        if self.conn.__class__.__name__ == 'FakeRemote':
+            run_cmd = 'sudo bash -s'
+
+        print("Installer> executing script through stdin")
+        self.log_command(run_cmd)
+
+        result = self.conn.run(run_cmd, timeout=Config.INSTALLER_COMMAND_TIMEOUT,
+                               input=script)
+
+        if not nolog:
+            self.log(result, error_exception)
+
+        return result
+
+    def run_stream(self, cmd, inside=True, error_exception=None):
+        """Runs cmd like run(), but stdout is sent to web logger while it
+        arrives instead of being held in memory. Lines are logged in batches
+        of Config.INSTALLER_LOG_BATCH lines or once a second.
+
+        Returns:
+            :class:`CommandResult` whose stdout is the last
+            Config.INSTALLER_LOG_TAIL lines of output
+        """
+        if not hasattr(self.conn, 'run_stream'):
+            return self.run(cmd, inside=inside, error_exception=error_exception)
+
+        if self.gluu_version and self.gluu_version.startswith('nochroot'):
+            inside = False
+
+        run_cmd = self.run_command.format(cmd) if inside else cmd
+
+        print("Installer> executing: {}".format(cmd))
+        self.log_command(run_cmd)
+
+        tail = deque(maxlen=Config.INSTALLER_LOG_TAIL)
+        batch = []
+        last_flush = time.time()
+
+        with self.conn.run_stream(
+                run_cmd, timeout=Config.INSTALLER_COMMAND_TIMEOUT) as stream:
+            for line in stream:
+                tail.append(line)
+                if line.strip():
+                    batch.append(line)
+                if batch and (len(batch) >= Config.INSTALLER_LOG_BATCH
+                              or time.time() - last_flush >= 1):
+                    self.log(('', '\n'.join(batch), ''))
+                    batch = []
+                    last_flush = time.time()
+
+        if batch:
+            self.log(('', '\n'.join(batch), ''))
+
+        self.log(('', '', stream.stderr), error_exception)
+
+        return CommandResult('\n'.join(tail), stream.stderr, stream.exit_status)
+
+    def run_channel_command(self, cmd, re_list=[], watch=[]):
+        """Runs cmd on a pty channel and sends its output to web logger while
+        it arrives. Lines matching one of re_list are progress lines; only the
+        latest of consecutive progress lines is kept and shown in place of
+        the previous one. Other lines are sent in batches of
+        Config.INSTALLER_LOG_BATCH lines or once a second.
+
+        Args:
+            cmd (string): command to run
+            re_list (list): compiled regular expressions of progress lines
+            watch (list): strings to be looked for in output
+
+        Returns:
+            tuple: last Config.INSTALLER_LOG_TAIL lines of output, the last
+                log id, and set of strings in watch seen in the output
+        """
 
         print("Installer> executing channel command: {}".format(cmd))
         wlogger.log(self.logger_task_id, "Running "+cmd, "debug", server_id=self.server_id)
 
-        last_debug = False
-        log_id = 0
-
-        all_cout = []
+        state = {
+                'log_id': 0,
+                'progress': None,
+                'progress_sent': None,
+                'last_flush': time.time(),
+                }
+        batch = []
+        tail = deque(maxlen=Config.INSTALLER_LOG_TAIL)
+        seen = set()
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        pending = ''
+
+        def flush():
+            if batch:
+                wlogger.log(self.logger_task_id, '\n'.join(batch), "debug", server_id=self.server_id)
+                del batch[:]
+            if state['progress'] is not None and state['progress'] != state['progress_sent']:
+                wlogger.log(self.logger_task_id, state['progress'], "debugc", log_id="logc-{}".format(state['log_id']), server_id=self.server_id)
+                state['progress_sent'] = state['progress']
+            state['last_flush'] = time.time()
+
+        def process(line):
+            line = line.strip('\r')
+            tail.append(line)
+            for w in watch:
+                if w in line:
+                    seen.add(w)
+
+            if not line.strip():
+                return
+
+            for reg in re_list:
+                if reg.search(line):
+                    if state['progress'] is None:
+                        flush()
+                        wlogger.log(self.logger_task_id, "...", "debug", log_id="logc-{}".format(state['log_id']), new_log_id=True,  server_id=self.server_id)
+                    state['progress'] = line.strip()
+                    return
+
+            if state['progress'] is not None:
+                flush()
+                state['progress'] = None
+                state['progress_sent'] = None
+                state['log_id'] += 1
+
+            batch.append(line)
 
         channel = self.conn.client.get_transport().open_session()
         channel.get_pty()
@@ -172,38 +429,29 @@ class Installer:
 
         print("Installer> Starting channel loop")
         while True:
-            if channel.exit_status_ready():
+            if channel.recv_ready():
+                pending += decoder.decode(channel.recv(32768))
+                lines = pending.split('\n')
+                pending = lines.pop()
+                for line in lines:
+                    process(line)
+            elif channel.exit_status_ready() or channel.closed:
                 print("Installer> Stopping channel loop")
                 break
-            rl = ''
-            try:
-                rl, wl, xl = select.select([channel], [], [], 0.0)
-            except:
-                pass
-            if len(rl) > 0:
-                coutt = channel.recv(1024)
-                print("COUT", coutt)
-                if coutt:
-                    for cout in coutt.decode().split('\n'):
-                        all_cout.append(cout)
-                        if cout.strip():
-                            repeated_line = False
-                            for reg in re_list:
-                                if reg.search(cout):
-                                    repeated_line = True
-                                    break
-                            if repeated_line:
-                                if not last_debug:
-                                    cout = cout.strip()
-                                    wlogger.log(self.logger_task_id, "...", "debug", log_id="logc-{}".format(log_id), new_log_id=True,  server_id=self.server_id)
-                                    last_debug = True
-                                wlogger.log(self.logger_task_id, cout, "debugc", log_id="logc-{}".format(log_id),  server_id=self.server_id)
-                            else:
-                                log_id += 1
-                                last_debug = False
-                                wlogger.log(self.logger_task_id, cout, "debug",  server_id=self.server_id)
-
-        return '\n'.join(all_cout), log_id
+            else:
+                # blocks until output arrives, exit status is polled
+                select.select([channel], [], [], 0.5)
+
+            if len(batch) >= Config.INSTALLER_LOG_BATCH or time.time() - state['last_flush'] >= 1:
+                flush()
+
+        pending += decoder.decode(b'', True)
+        if pending:
+            process(pending)
+        flush()
+        channel.close()
+
+        return '\n'.join(tail), state['log_id'], seen
 
 
     def epel_release(self, inside=False):
@@ -226,6 +474,57 @@ class Installer:
 
         return True
 
+    def upload_large_file(self, local, remote, relay_from=None):
+        """Uploads a large file with RemoteClient.upload_large(). If
+        relay_from is given and has the same file at remote, it is sent from
+        that server instead of the manager.
+
+        Args:
+            local (string): path of the local file
+            remote (string): location on remote server to put the file
+            relay_from (:class:`Installer`, optional): installer of a server
+                that already has the file
+        """
+        if relay_from is not None and relay_from.conn:
+            print("Installer> Relaying {} from {}".format(remote, relay_from.hostname))
+            wlogger.log(self.logger_task_id, "Relaying file {0} from {1}".format(remote, relay_from.hostname), "debug", server_id=self.server_id)
+            digest = file_sums(local, Config.SFTP_CHUNK_SIZE)[1]
+            result = relay_from.conn.relay_to(self.conn, remote, digest)
+            if result[0]:
+                wlogger.log(self.logger_task_id, "File {0} was relayed from {1}.".format(remote, relay_from.hostname), "success", server_id=self.server_id)
+                return True
+            wlogger.log(self.logger_task_id, "Can't relay. {0} Uploading from cluster manager.".format(result[1]), "debug", server_id=self.server_id)
+
+        print("Installer> Uploading local {} to remote {}".format(local, remote))
+        wlogger.log(self.logger_task_id, "Uploading local file {0} to remote server as {1}".format(local, remote), "debug", server_id=self.server_id)
+        result = self.conn.upload_large(local, remote)
+
+        if not result[0]:
+            wlogger.log(self.logger_task_id, "Can't upload. {0}".format(result[1]), "error", server_id=self.server_id)
+            wlogger.log(self.logger_task_id, "Ending up current process.", "error", server_id=self.server_id)
+            return False
+
+        wlogger.log(self.logger_task_id, "File {0} was uploaded as {1}.".format(local, remote), "success", server_id=self.server_id)
+
+        return True
+
+    def sync_tree(self, local, remote, include=None, exclude=None):
+        print("Installer> Synchronizing local {} to remote {}".format(local, remote))
+        wlogger.log(self.logger_task_id, "Synchronizing local directory {0} to remote directory {1}".format(local, remote), "debug", server_id=self.server_id)
+        result = self.conn.sync_tree(local, remote, include=include, exclude=exclude)
+
+        if not result[0]:
+            wlogger.log(self.logger_task_id, "Can't synchronize. {0}".format(result[1]), "error", server_id=self.server_id)
+            wlogger.log(self.logger_task_id, "Ending up current process.", "error", server_id=self.server_id)
+            return False
+
+        if result[1]:
+            wlogger.log(self.logger_task_id, "{0} changed file(s) were uploaded to {1}: {2}".format(len(result[1]), remote, ', '.join(result[1])), "success", server_id=self.server_id)
+        else:
+            wlogger.log(self.logger_task_id, "Files in {0} are up to date.".format(remote), "success", server_id=self.server_id)
+
+        return True
+
     def download_file(self, remote, local):
         print("Installer> Downloading from {} remote {} to local {}".format(self.hostname, remote,local))
         wlogger.log(self.logger_task_id, "Downloading remote file {0} to local {1}".format(remote, local), "debug", server_id=self.server_id)
@@ -289,22 +588,29 @@ class Installer:
         self.run(cmd, inside=inside, error_exception='Redirecting to /bin/systemctl')
 
 
+    gluu_installed_markers = host_facts.GLUU_INSTALLED_MARKERS
+
     def is_gluu_installed(self):
-        
-        check_file = ('/opt/gluu-server/install/community-edition-setup/'
-                  'setup.properties.last')
 
-        check_file_enc = ('/opt/gluu-server/install/community-edition-setup/'
-                    'setup.properties.last.enc')
+        print("Installer> Checking existence of file {} for gluu installation".format(self.gluu_installed_markers[0]))
 
-        print("Installer> Checking existence of file {} for gluu installation".format(check_file))
+        if isinstance(self.conn, RemoteClient):
+            return self.facts['gluu_installed']
 
-        return self.conn.exists(check_file) or self.conn.exists(check_file_enc)
+        return any(self.conn.exists(marker) for marker in self.gluu_installed_markers)
 
     def get_gluu_version(self, installed=False):
         gluu_version = None
         
         print("Installer> Determining gluu version by using oxauth.war")
+
+        if isinstance(self.conn, RemoteClient):
+            facts = self.facts
+            gluu_version = facts['gluu_version']
+            if installed and not gluu_version:
+                gluu_version = facts['dist_gluu_version']
+            print("Installer> Gluu version was determined as {0}".format(gluu_version))
+            return gluu_version
         
         oxauth_path = '/opt/gluu/jetty/oxauth/webapps/oxauth.war'
         
@@ -361,8 +667,7 @@ class Installer:
         wlogger.log(self.logger_task_id, "Installing package {0} with command: {1}".format(package, cmd), "debug", server_id=self.server_id)
         
         
-        result = self.run(cmd, inside=False, error_exception=error_exception)
-        self.log(result)
+        result = self.run_stream(cmd, inside=False, error_exception=error_exception)
         
         return result
 
@@ -377,7 +682,7 @@ class Installer:
 
         print("Installer> executing: {}".format(run_cmd))
         self.log_command(run_cmd)
-        result = self.conn.run(run_cmd)
+        result = self.conn.run(run_cmd, timeout=Config.INSTALLER_COMMAND_TIMEOUT)
         self.log(result)
         
         return result
@@ -386,7 +691,7 @@ class Installer:
         cmd = self.init_command.format(cmd)
         print("Installer> executing: {}".format(cmd))
         self.log_command(cmd)
-        result = self.conn.run(cmd)
+        result = self.conn.run(cmd, timeout=Config.INSTALLER_COMMAND_TIMEOUT)
         self.log(result)
         return result
         
@@ -0,0 +1,266 @@
+"""connection_pool.py - process wide pool of authenticated SSH connections.
+
+Every status view and every Installer used to build a brand new SSHClient,
+which means a TCP and SSH handshake, host key loading and an SFTP subsystem
+open for each request. The pool keeps authenticated connections per
+(host, ip, port, user) key and leases them to RemoteClient instances, so
+subsequent requests only pay for opening channels.
+
+The pool is safe to use from threads (Gunicorn threaded workers) and from
+forked processes (Gunicorn / Celery prefork workers): connections inherited
+from a parent process are dropped, never shared.
+"""
+
+import os
+import time
+import threading
+
+from clustermgr.config import Config
+from clustermgr.core.clustermgr_logging import remote_logger as logger
+
+
+class PoolExhaustedException(Exception):
+    """Exception raised when no connection could be leased for a host
+    within the lease timeout because the per host cap was reached."""
+    pass
+
+
+class PooledConnection(object):
+    """An authenticated SSH connection owned by the pool.
+
+    Args:
+        key (tuple): the pool key (host, ip, port, user)
+        client (:class:`paramiko.client.SSHClient`): connected client
+        sftpclient (:class:`paramiko.sftp_client.SFTPClient`): SFTP client
+            opened over the connection
+
+    Attributes:
+        created (float): unix time the connection was established
+        last_used (float): unix time the connection was last released
+        leases (int): how many times the connection was leased
+        agent (:class:`clustermgr.core.agent.NodeAgent`): node agent started
+            over the connection, if any
+    """
+
+    def __init__(self, key, client, sftpclient=None):
+        self.key = key
+        self.client = client
+        self.sftpclient = sftpclient
+        self.created = time.time()
+        self.last_used = self.created
+        self.leases = 0
+        self.agent = None
+
+    def is_alive(self):
+        """Health check of the underlying transport. Sends an SSH ignore
+        message so that half-open TCP connections are detected.
+
+        Returns:
+            True if the transport can be used, False otherwise
+        """
+        try:
+            transport = self.client.get_transport()
+            if not transport or not transport.is_active():
+                return False
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def close(self):
+        if self.agent:
+            self.agent.close()
+        try:
+            if self.sftpclient:
+                self.sftpclient.close()
+        except Exception:
+            pass
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+    def __repr__(self):
+        return "PooledConnection({0}, leases={1})".format(self.key, self.leases)
+
+
+class ConnectionPool(object):
+    """Pool of SSH connections keyed by (host, ip, port, user).
+
+    Args:
+        max_per_host (int): maximum number of open connections per key
+        max_idle (int): seconds after which an idle connection is closed
+        keepalive (int): SSH keepalive interval set on pooled transports
+        lease_timeout (int): seconds to wait for a free connection when
+            the per host cap was reached
+    """
+
+    def __init__(self, max_per_host=4, max_idle=300, keepalive=30,
+                 lease_timeout=30):
+        self.max_per_host = max_per_host
+        self.max_idle = max_idle
+        self.keepalive = keepalive
+        self.lease_timeout = lease_timeout
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = {}
+        self._counts = {}
+
+    def _check_fork(self):
+        # Sockets inherited from the parent process must not be used by the
+        # child, forget about them without closing (parent still owns them)
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _expired(self, now):
+        """Removes idle connections exceeding max_idle. Must be called with
+        the lock held; returns the connections to be closed."""
+        expired = []
+        for key in list(self._idle):
+            keep = []
+            for conn in self._idle[key]:
+                if now - conn.last_used > self.max_idle:
+                    expired.append(conn)
+                    self._counts[key] -= 1
+                else:
+                    keep.append(conn)
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        if expired:
+            self._cond.notify_all()
+        return expired
+
+    def _close(self, connections):
+        for conn in connections:
+            logger.debug("Closing pooled connection %s", conn)
+            conn.close()
+
+    def lease(self, key, connect):
+        """Leases a connection for key. An idle healthy connection is
+        returned if there is one, otherwise a new one is made by calling
+        connect() as long as the per host cap allows.
+
+        Args:
+            key (tuple): the pool key (host, ip, port, user)
+            connect (callable): returns a tuple (client, sftpclient) of a
+                freshly authenticated connection
+
+        Returns:
+            :class:`PooledConnection` which must be given back with release()
+        """
+        self._check_fork()
+        deadline = time.time() + self.lease_timeout
+
+        while True:
+            with self._cond:
+                expired = self._expired(time.time())
+                idle = self._idle.get(key)
+                conn = idle.pop() if idle else None
+                if conn is None:
+                    if self._counts.get(key, 0) < self.max_per_host:
+                        self._counts[key] = self._counts.get(key, 0) + 1
+                        break
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._close(expired)
+                        raise PoolExhaustedException(
+                            "No free SSH connection to {0} within {1} "
+                            "seconds".format(key[0], self.lease_timeout))
+                    self._cond.wait(remaining)
+            self._close(expired)
+
+            if conn is not None:
+                if conn.is_alive():
+                    conn.leases += 1
+                    logger.debug("Reusing pooled connection %s", conn)
+                    return conn
+                self.discard(conn)
+
+        self._close(expired)
+
+        try:
+            client, sftpclient = connect()
+        except Exception:
+            with self._cond:
+                self._counts[key] -= 1
+                self._cond.notify()
+            raise
+
+        conn = PooledConnection(key, client, sftpclient)
+        conn.leases += 1
+
+        transport = client.get_transport()
+        if transport and self.keepalive:
+            transport.set_keepalive(self.keepalive)
+
+        logger.debug("New pooled connection %s", conn)
+        return conn
+
+    def release(self, conn):
+        """Gives a leased connection back to the pool. Connections whose
+        transport died are closed instead of being kept.
+
+        Args:
+            conn (:class:`PooledConnection`): the leased connection
+        """
+        if self._pid != os.getpid():
+            return
+
+        if not conn.is_alive():
+            self.discard(conn)
+            return
+
+        conn.last_used = time.time()
+        with self._cond:
+            self._idle.setdefault(conn.key, []).append(conn)
+            self._cond.notify()
+
+    def discard(self, conn):
+        """Closes a leased connection and frees its slot."""
+        conn.close()
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            if self._counts.get(conn.key):
+                self._counts[conn.key] -= 1
+            self._cond.notify()
+
+    def prune(self):
+        """Closes the connections which were idle more than max_idle."""
+        self._check_fork()
+        with self._cond:
+            expired = self._expired(time.time())
+        self._close(expired)
+
+    def close_all(self):
+        """Closes all idle connections, leased ones are closed on release."""
+        self._check_fork()
+        with self._cond:
+            idle = [conn for conns in self._idle.values() for conn in conns]
+            for conn in idle:
+                self._counts[conn.key] -= 1
+            self._idle = {}
+            self._cond.notify_all()
+        self._close(idle)
+
+    def stats(self):
+        """Returns a dict of key -> (open connections, idle connections)"""
+        self._check_fork()
+        with self._cond:
+            return dict(
+                (key, (count, len(self._idle.get(key, []))))
+                for key, count in self._counts.items()
+            )
+
+
+ssh_pool = ConnectionPool(
+                max_per_host=Config.SSH_POOL_MAX_PER_HOST,
+                max_idle=Config.SSH_POOL_MAX_IDLE,
+                keepalive=Config.SSH_POOL_KEEPALIVE,
+                lease_timeout=Config.SSH_POOL_LEASE_TIMEOUT,
+            )
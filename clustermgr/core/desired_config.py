@@ -0,0 +1,180 @@
+"""desired_config.py - applies configuration files to servers only when they
+differ from the desired content.
+
+Tasks used to download a config file, edit it and upload it back, then
+restart its service, each time they ran. Here the desired content of every
+file is rendered locally and compared with the state on the server, which
+is fetched for all files of a server in one round trip: SHA-256 sums for
+files whose content is fully known, the current content for files that are
+edited. Only files that differ are written and only services of changed
+files are restarted, so applying the same configuration again, or scanning
+the cluster for drift with scan(), costs one command per server.
+"""
+
+import hashlib
+import shlex
+
+from clustermgr.core.fanout import run_on_all
+
+
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+MISSING = 'missing'
+FAILED = 'failed'
+
+
+def sha256(content):
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class ConfigFile(object):
+    """Desired state of a configuration file.
+
+    Args:
+        path (string): path of the file on the server, including the
+            container path if the file is in the container
+        content (string, optional): desired content of the file
+        edit (callable, optional): called with the current content of the
+            file and returns the desired content. Used instead of content
+            when the desired file depends on the current one, the file is
+            not created if it does not exist.
+        services (list, optional): services restarted when the file changes
+        inside (bool): whether services are run in the container
+        mode (string, optional): mode set with chmod when the file is written
+    """
+
+    def __init__(self, path, content=None, edit=None, services=(),
+                 inside=False, mode=None):
+        if (content is None) == (edit is None):
+            raise ValueError("Either content or edit is required")
+        self.path = path
+        self.content = content
+        self.edit = edit
+        self.services = list(services)
+        self.inside = inside
+        self.mode = mode
+
+    def __repr__(self):
+        return "ConfigFile({0})".format(self.path)
+
+
+def fetch_state(conn, files):
+    """Fetches state of files on a server in one round trip.
+
+    Returns:
+        dict of path to sha256 of the file for files with content, or to
+        current content for files with edit. The value is None if the file
+        does not exist.
+    """
+    commands = []
+    for config_file in files:
+        path = shlex.quote(config_file.path)
+        if config_file.edit is None:
+            # no pipe, so the exit status is that of sha256sum and a
+            # missing or unreadable file is not taken for an empty digest
+            commands.append(
+                's=$(sha256sum < {0}) && echo "${{s%% *}}"'.format(path))
+        else:
+            commands.append('cat {}'.format(path))
+
+    state = {}
+    for config_file, result in zip(files, conn.run_batch(commands)):
+        if result.exit_status != 0:
+            state[config_file.path] = None
+        elif config_file.edit is None:
+            state[config_file.path] = result.stdout.strip()
+        else:
+            state[config_file.path] = result.stdout
+    return state
+
+
+def plan(conn, files):
+    """Renders desired content of files and compares it with the server.
+
+    Returns:
+        list of (ConfigFile, status, desired content) tuples, content is
+        None unless status is CHANGED
+    """
+    state = fetch_state(conn, files)
+    actions = []
+
+    for config_file in files:
+        current = state[config_file.path]
+        if config_file.edit is None:
+            desired = config_file.content
+            changed = current != sha256(desired)
+        elif current is None:
+            actions.append((config_file, MISSING, None))
+            continue
+        else:
+            desired = config_file.edit(current)
+            changed = desired != current
+
+        if changed:
+            actions.append((config_file, CHANGED, desired))
+        else:
+            actions.append((config_file, UNCHANGED, None))
+
+    return actions
+
+
+def apply(installer, files, restart=True):
+    """Writes files that differ from the desired content and restarts
+    services of the changed files, each service once.
+
+    Args:
+        installer (:class:`clustermgr.core.clustermgr_installer.Installer`):
+            installer of the server
+        files (list): :class:`ConfigFile` objects
+        restart (bool): restart services of changed files
+
+    Returns:
+        dict of path to CHANGED, UNCHANGED, MISSING or FAILED
+    """
+    status = {}
+    services = []
+
+    for config_file, file_status, desired in plan(installer.conn, files):
+        if file_status == CHANGED:
+            if not installer.put_file(config_file.path, desired):
+                file_status = FAILED
+            else:
+                if config_file.mode:
+                    installer.run('chmod {0} {1}'.format(
+                                    config_file.mode,
+                                    shlex.quote(config_file.path)),
+                                  inside=False)
+                for service in config_file.services:
+                    if (service, config_file.inside) not in services:
+                        services.append((service, config_file.inside))
+        status[config_file.path] = file_status
+
+    if restart:
+        for service, inside in services:
+            installer.restart_service(service, inside=inside)
+
+    return status
+
+
+def scan(servers, files_for, deadline=None):
+    """Checks configuration drift of servers concurrently, nothing is
+    written. The state of the files of each server is fetched in one round
+    trip, so periodic scans are cheap.
+
+    Args:
+        servers (list): server objects
+        files_for (callable): returns list of :class:`ConfigFile` objects
+            for a server
+        deadline (float, optional): see
+            :func:`clustermgr.core.fanout.run_on_all`
+
+    Returns:
+        dict of server id to list of paths that differ, None if the server
+        could not be checked
+    """
+    def drifted(server, conn):
+        return [config_file.path for config_file, file_status, desired
+                in plan(conn, files_for(server)) if file_status == CHANGED]
+
+    return dict((result.server.id, result.value if result.ok else None)
+                for result in run_on_all(servers, drifted, deadline=deadline))
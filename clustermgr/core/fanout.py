@@ -0,0 +1,189 @@
+"""fanout.py - runs remote work on all servers of the cluster concurrently.
+
+Status views and tasks used to loop over Server.get_all() and run commands
+host by host, so wall time grew linearly with the number of nodes and one
+hung host blocked all the others. run_on_all() executes a command or a
+callable for each server on a bounded thread pool, limits the number of
+concurrent SSH channels per host and returns partial results when some
+hosts do not answer within their deadline.
+"""
+
+import time
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from flask import current_app, has_app_context
+
+from clustermgr.config import Config
+from clustermgr.core.remote import RemoteClient
+from clustermgr.core.clustermgr_logging import remote_logger as logger
+
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def host_semaphore(hostname):
+    """Returns the semaphore limiting concurrent SSH channels to hostname.
+    sshd refuses new sessions when MaxSessions (default 10) is exceeded, so
+    every fan-out unit acquires it before talking to the host.
+    """
+    with _host_semaphores_lock:
+        if hostname not in _host_semaphores:
+            _host_semaphores[hostname] = threading.BoundedSemaphore(
+                                                    Config.SSH_MAX_SESSIONS)
+        return _host_semaphores[hostname]
+
+
+class HostResult(object):
+    """Result of a fan-out unit for a single server.
+
+    Attributes:
+        server: the server object the unit was run for
+        value: return value of the callable, or (stdin, stdout, stderr)
+            tuple when a command was run
+        error (Exception): exception raised by the unit, if any
+        timed_out (bool): True if the unit did not finish within deadline
+        elapsed (float): seconds spent for the unit
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.value = None
+        self.error = None
+        self.timed_out = False
+        self.elapsed = 0.0
+        self.started = None
+        self.conn = None
+
+    @property
+    def ok(self):
+        return not (self.error or self.timed_out)
+
+    def __repr__(self):
+        return "HostResult({0}, ok={1}, timed_out={2}, elapsed={3:.2f})".format(
+            getattr(self.server, 'hostname', self.server), self.ok,
+            self.timed_out, self.elapsed)
+
+
+def _abort(result):
+    """Closes the transport used by a timed out unit, so that the blocked
+    channel returns and the pooled connection is discarded on release."""
+    conn = result.conn
+    if conn is None or conn.client is None:
+        return
+    try:
+        conn.client.get_transport().close()
+    except Exception:
+        pass
+
+
+def _run_unit(app, result, cmd_or_callable, connect, deadline):
+    server = result.server
+    if app is not None:
+        ctx = app.app_context()
+        ctx.push()
+
+    try:
+        with host_semaphore(server.hostname):
+            result.started = time.time()
+            if connect:
+                result.conn = RemoteClient(server.hostname, ip=server.ip,
+                                           ssh_port=server.ssh_port)
+                # 0 lifts the default deadline of the client's commands
+                result.conn.command_timeout = deadline
+                result.conn.startup()
+                if callable(cmd_or_callable):
+                    result.value = cmd_or_callable(server, result.conn)
+                else:
+                    result.value = result.conn.run(cmd_or_callable)
+            else:
+                result.value = cmd_or_callable(server)
+    except Exception as e:
+        logger.error("Fan-out unit for %s failed: %s", server.hostname, e)
+        result.error = e
+    finally:
+        if result.started:
+            result.elapsed = time.time() - result.started
+        if result.conn is not None:
+            result.conn.close()
+        if app is not None:
+            ctx.pop()
+
+    return result
+
+
+def run_on_all(servers, cmd_or_callable, deadline=None, max_workers=None,
+               connect=True):
+    """Runs a command or a callable for each server concurrently.
+
+    Args:
+        servers (list): server objects having hostname, ip and ssh_port
+        cmd_or_callable: a command string to be run on each server, or a
+            callable. If connect is True, the callable is called as
+            func(server, conn) with a started RemoteClient, otherwise as
+            func(server)
+        deadline (float, optional): seconds each host is given once its
+            unit started. Defaults to Config.FANOUT_HOST_DEADLINE, pass 0
+            to wait without a deadline (e.g. for installations)
+        max_workers (int, optional): size of the thread pool, defaults to
+            Config.FANOUT_MAX_WORKERS
+        connect (bool): whether to make the SSH connection for the callable
+
+    Returns:
+        list of :class:`HostResult` in the same order as servers. Results of
+        hosts that did not finish in time have timed_out set.
+    """
+    if deadline is None:
+        deadline = Config.FANOUT_HOST_DEADLINE
+
+    results = [HostResult(server) for server in servers]
+    if not results:
+        return results
+
+    if not max_workers:
+        max_workers = Config.FANOUT_MAX_WORKERS
+    max_workers = min(max_workers, len(results))
+
+    app = current_app._get_current_object() if has_app_context() else None
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = dict(
+        (executor.submit(_run_unit, app, result, cmd_or_callable, connect,
+                         deadline),
+         result)
+        for result in results
+    )
+
+    while pending:
+        timeout = None
+        if deadline:
+            now = time.time()
+            expiries = [r.started + deadline for r in pending.values()
+                        if r.started]
+            timeout = max(min(expiries) - now, 0) if expiries else deadline
+
+        done, _ = wait(list(pending), timeout=timeout,
+                       return_when=FIRST_COMPLETED)
+        for future in done:
+            del pending[future]
+
+        if deadline:
+            now = time.time()
+            for future, result in list(pending.items()):
+                if result.started and now - result.started >= deadline:
+                    logger.warning("Fan-out unit for %s exceeded deadline "
+                                   "of %s seconds", result.server.hostname,
+                                   deadline)
+                    result.timed_out = True
+                    result.elapsed = now - result.started
+                    _abort(result)
+                    future.cancel()
+                    del pending[future]
+
+    # Don't wait for units we have given up on, their threads exit as soon
+    # as their aborted channels return
+    executor.shutdown(wait=False)
+
+    return results
@@ -0,0 +1,174 @@
+"""host_facts.py - cached facts about cluster servers.
+
+OS type, Gluu installation, Gluu version and installed components of a
+server used to be discovered with separate remote commands by each task
+that needed them. gather() collects all of them in one round trip and get()
+caches the result in Redis for Config.HOST_FACTS_TTL seconds, so that
+constructing an Installer or rendering a view does not run discovery
+commands. Tasks changing what is installed on a server call invalidate().
+"""
+
+import os
+import json
+import shlex
+import time
+
+from clustermgr.config import Config
+from clustermgr.core.remote import os_type_from_release
+
+
+GLUU_CONTAINER = '/opt/gluu-server'
+
+GLUU_INSTALLED_MARKERS = (
+    '/opt/gluu-server/install/community-edition-setup/setup.properties.last',
+    '/opt/gluu-server/install/community-edition-setup/setup.properties.last.enc',
+    )
+
+# paths relative to the container
+COMPONENTS = {
+    'oxAuth': 'opt/gluu/jetty/oxauth',
+    'oxTrust': 'opt/gluu/jetty/identity',
+    'Shibboleth': 'opt/shibboleth-idp',
+    'oxAuthRP': 'opt/gluu/jetty/oxauth-rp',
+    #'Asimba': 'opt/gluu/jetty/asimba',
+    'Passport': 'opt/gluu/node/passport',
+}
+
+OXAUTH_WAR = 'opt/gluu/jetty/oxauth/webapps/oxauth.war'
+OXAUTH_DIST_WAR = 'opt/dist/gluu/oxauth.war'
+
+MANIFEST_CMD = (
+    "unzip -p {0} META-INF/MANIFEST.MF 2>/dev/null || "
+    "python3 -c \"import sys,zipfile;sys.stdout.write(zipfile.ZipFile("
+    "sys.argv[1]).read('META-INF/MANIFEST.MF').decode())\" {0}"
+    )
+
+
+def _key(host):
+    return 'clustermgr:facts:{}'.format(host)
+
+
+def _redis():
+    return getattr(Config, 'CLUSTERMGR_REDIS', None)
+
+
+def _version_from_manifest(manifest):
+    for l in manifest.splitlines():
+        ls = l.strip()
+        if 'Implementation-Version:' in ls:
+            version = ls.split(':')[1].strip()
+            return '.'.join(version.split('.')[:3])
+
+
+def _run_all(conn, commands):
+    if hasattr(conn, 'run_batch'):
+        return conn.run_batch(commands)
+
+    results = []
+    for cmd in commands:
+        results.append(conn.run(cmd))
+    return results
+
+
+def gather(conn, container=GLUU_CONTAINER):
+    """Collects facts of the server in one round trip.
+
+    Args:
+        conn (:class:`clustermgr.core.remote.RemoteClient`): started client
+            of the server
+        container (string): root of the Gluu Server, / for nochroot versions
+
+    Returns:
+        dict having os, gluu_installed, components, gluu_version,
+        dist_gluu_version, container, time and complete keys, complete is
+        False if a command failed to run or timed out
+    """
+    component_markers = dict(
+        (component, os.path.join(container, marker))
+        for component, marker in COMPONENTS.items()
+        )
+    markers = list(GLUU_INSTALLED_MARKERS) + list(component_markers.values())
+
+    commands = [
+        'f=$(ls /etc/*release | head -n 1); echo "$f"; cat "$f"',
+        MANIFEST_CMD.format(shlex.quote(os.path.join(container, OXAUTH_WAR))),
+        MANIFEST_CMD.format(shlex.quote(
+                                os.path.join(container, OXAUTH_DIST_WAR))),
+        ] + ['test -e {} && echo 1'.format(shlex.quote(marker))
+             for marker in markers]
+
+    results = _run_all(conn, commands)
+    # results of a batch that failed or timed out have no exit status
+    complete = not any(getattr(result, 'timed_out', False) or
+                       getattr(result, 'exit_status', 0) is None
+                       for result in results)
+    release, webapps_manifest, dist_manifest = results[:3]
+    exists = dict((marker, result[1].strip() == '1')
+                  for marker, result in zip(markers, results[3:]))
+
+    release_file, _, release_content = release[1].partition('\n')
+    gluu_installed = any(exists[marker] for marker in GLUU_INSTALLED_MARKERS)
+
+    components = []
+    if gluu_installed:
+        components = sorted(component for component, marker
+                            in component_markers.items() if exists[marker])
+
+    return {
+        'os': os_type_from_release(release_file.strip(), release_content),
+        'gluu_installed': gluu_installed,
+        'components': components,
+        'gluu_version': _version_from_manifest(webapps_manifest[1]),
+        'dist_gluu_version': _version_from_manifest(dist_manifest[1]),
+        'container': container,
+        'time': time.time(),
+        'complete': complete,
+        }
+
+
+def get(conn, container=GLUU_CONTAINER, refresh=False):
+    """Returns facts of the server from the cache, they are gathered if not
+    cached or refresh is True.
+
+    Args:
+        conn (:class:`clustermgr.core.remote.RemoteClient`): client of the
+            server, it is used only if facts are gathered
+        container (string): root of the Gluu Server
+        refresh (bool): gather facts even if they are cached
+    """
+    redis = _redis()
+    key = _key(conn.host)
+
+    if redis is not None and not refresh:
+        cached = redis.hget(key, container)
+        if cached:
+            return json.loads(cached)
+
+    facts = gather(conn, container)
+
+    # facts of a failed gather are not cached, so that they are not used
+    # to pick commands of the server until they expire
+    if redis is not None and facts['complete'] and facts['os'] is not None:
+        redis.hset(key, container, json.dumps(facts))
+        redis.expire(key, Config.HOST_FACTS_TTL)
+
+    return facts
+
+
+def peek(host, container=GLUU_CONTAINER):
+    """Returns cached facts of the server without connecting to it, None if
+    they are not cached."""
+    redis = _redis()
+    if redis is None:
+        return None
+    cached = redis.hget(_key(host), container)
+    if cached:
+        return json.loads(cached)
+
+
+def invalidate(host):
+    """Drops cached facts of the server, they are gathered again on next
+    use."""
+    redis = _redis()
+    if redis is not None:
+        redis.delete(_key(host))
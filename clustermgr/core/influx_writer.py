@@ -0,0 +1,192 @@
+"""influx_writer.py - batched writes of points to InfluxDB.
+
+Monitoring data and logs used to be written by building a dict for every
+point and sending everything collected in one write_points() call, which
+InfluxDB received as a single, possibly huge, JSON converted body.
+InfluxWriter encodes points to line protocol as they are added, keeps only
+the last point of a series at a time, and writes gzipped batches of
+Config.INFLUX_BATCH_SIZE points, retrying failed batches with exponential
+backoff.
+"""
+
+import time
+import datetime
+import calendar
+
+from dateutil import parser as date_parser
+from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError
+
+from clustermgr.config import Config
+from clustermgr.core.clustermgr_logging import sys_logger as logger
+
+
+# nanoseconds in a unit of the precision
+PRECISIONS = {'n': 1, 'u': 10 ** 3, 'ms': 10 ** 6, 's': 10 ** 9,
+              'm': 60 * 10 ** 9, 'h': 3600 * 10 ** 9}
+
+
+def _escape_key(key):
+    return str(key).replace('\\', '\\\\').replace(' ', '\\ ').replace(
+                    ',', '\\,').replace('=', '\\=').replace('\n', '\\n')
+
+
+def _escape_measurement(measurement):
+    return str(measurement).replace('\\', '\\\\').replace(' ', '\\ ').replace(
+                    ',', '\\,').replace('\n', '\\n')
+
+
+def _field_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return '{0}i'.format(value)
+    if isinstance(value, float):
+        return repr(value)
+    return '"{0}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def _timestamp(value, precision):
+    """Converts a time to an integer in the given precision. Numbers are
+    assumed to be in that precision already."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not isinstance(value, datetime.datetime):
+        value = date_parser.parse(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    ns = calendar.timegm(value.timetuple()) * 10 ** 9 + \
+        value.microsecond * 1000
+    return ns // PRECISIONS[precision]
+
+
+class InfluxWriter(object):
+    """Collects points and writes them to an InfluxDB database in batches.
+
+    Args:
+        database (string): name of the database
+        precision (string): precision of the times of points, one of n, u,
+            ms, s, m, h
+        batch_size (int, optional): points written in a request, defaults
+            to Config.INFLUX_BATCH_SIZE
+        client (:class:`influxdb.InfluxDBClient`, optional): client to be
+            used, by default a client compressing requests is created
+
+    Usage::
+
+        writer = InfluxWriter('gluu_monitoring')
+        writer.add('cpu_percent', {'cpu_percent': 1.5}, time=1600000000)
+        written = writer.close()
+    """
+
+    def __init__(self, database, precision='s', batch_size=None, client=None):
+        self.database = database
+        self.precision = precision
+        self.batch_size = batch_size or Config.INFLUX_BATCH_SIZE
+        self.client = client or InfluxDBClient(database=database, gzip=True)
+        # series and time of a point to its line, a later point of the same
+        # series and time replaces the earlier one as InfluxDB would
+        self._pending = {}
+        self.points = 0
+        self.failed = 0
+        self.elapsed = 0.0
+
+    def add(self, measurement, fields, tags=None, time=None):
+        """Adds a point, the pending points are written when batch size is
+        reached. Fields having None values are omitted.
+        """
+        fields = ','.join('{0}={1}'.format(_escape_key(k), _field_value(v))
+                          for k, v in sorted(fields.items()) if v is not None)
+        if not fields:
+            return
+
+        series = _escape_measurement(measurement)
+        if tags:
+            series += ''.join(',{0}={1}'.format(_escape_key(k), _escape_key(v))
+                              for k, v in sorted(tags.items())
+                              if v is not None and v != '')
+
+        line = series + ' ' + fields
+        timestamp = None
+        if time is not None:
+            timestamp = _timestamp(time, self.precision)
+            line += ' {0}'.format(timestamp)
+
+        # points without time are stamped by the server, none is a duplicate
+        key = (series, timestamp) if timestamp is not None else object()
+        self._pending[key] = line
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def add_point(self, point):
+        """Adds a point given as a dict in the format of
+        InfluxDBClient.write_points()"""
+        self.add(point['measurement'], point['fields'], point.get('tags'),
+                 point.get('time'))
+
+    def _write(self, lines):
+        delay = Config.INFLUX_RETRY_BACKOFF
+        for attempt in range(Config.INFLUX_WRITE_RETRIES + 1):
+            try:
+                self.client.write(lines, params={'db': self.database,
+                                                 'precision': self.precision},
+                                  protocol='line')
+                return True
+            except InfluxDBClientError as e:
+                # points are rejected, writing them again would not help
+                if e.code is not None and 400 <= e.code < 500:
+                    logger.error("InfluxDB rejected %s points: %s",
+                                 len(lines), e)
+                    return False
+                error = e
+            except Exception as e:
+                error = e
+            if attempt < Config.INFLUX_WRITE_RETRIES:
+                logger.warning("Writing %s points to InfluxDB failed, "
+                               "retrying in %s seconds: %s",
+                               len(lines), delay, error)
+                time.sleep(delay)
+                delay *= 2
+
+        logger.error("Writing %s points to InfluxDB failed: %s",
+                     len(lines), error)
+        return False
+
+    def flush(self):
+        """Writes pending points.
+
+        Returns:
+            bool: whether all pending points were written
+        """
+        if not self._pending:
+            return True
+        lines = list(self._pending.values())
+        self._pending = {}
+
+        started = time.time()
+        written = self._write(lines)
+        self.elapsed += time.time() - started
+        if written:
+            self.points += len(lines)
+        else:
+            self.failed += len(lines)
+        return written
+
+    @property
+    def rate(self):
+        """Points written per second of writing"""
+        return self.points / self.elapsed if self.elapsed else 0.0
+
+    def close(self):
+        """Writes pending points and reports the rate.
+
+        Returns:
+            bool: whether all points added were written
+        """
+        self.flush()
+        if self.points or self.failed:
+            logger.info("Wrote %s points to %s in %.2f seconds "
+                        "(%.0f points/s), %s points failed",
+                        self.points, self.database, self.elapsed, self.rate,
+                        self.failed)
+        return not self.failed
@@ -0,0 +1,229 @@
+"""log_archive.py - compressed archive of the logs of finished tasks.
+
+Logs of tasks used to stay in Redis until the browser polling them saw the
+task finish, or for a day if nobody did. When a task ends its log is now
+appended to a gzip archive under Config.TASK_LOG_ARCHIVE_DIR and removed
+from Redis, so that Redis holds the logs of running tasks only.
+
+Each log is written as a separate gzip member of a monthly archive file,
+the archive stays a valid gzip file and a log is read back by seeking to
+its offset and decompressing its bytes only. The location of every log is
+appended to index.jsonl next to the archives, together with servers the
+task logged for, start and end times and the final state. Entries of
+recently archived logs are also cached in Redis for
+Config.TASK_LOG_ARCHIVE_CACHE_TTL, so that finding them does not read the
+index. Other logs are searched among the last Config.TASK_LOG_ARCHIVE_SCAN
+entries of the index, read from its end.
+"""
+
+import os
+import json
+import time
+import zlib
+import fcntl
+
+from clustermgr.config import Config
+from clustermgr.extensions import wlogger
+from clustermgr.core.clustermgr_logging import sys_logger as logger
+
+
+INDEX_FILE = 'index.jsonl'
+# index entry of an archived log cached in redis
+INDEX_KEY = 'weblogger-archive:index:{0}'
+# set when a task was not found in the index, so that polling the log of a
+# running task does not read the index on every request
+MISS_KEY = 'weblogger-archive:miss:{0}'
+MISS_TTL = 300
+
+
+def _redis():
+    return Config.CLUSTERMGR_REDIS
+
+
+def _archive_dir():
+    if not os.path.isdir(Config.TASK_LOG_ARCHIVE_DIR):
+        os.makedirs(Config.TASK_LOG_ARCHIVE_DIR)
+    return Config.TASK_LOG_ARCHIVE_DIR
+
+
+def _compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def archive(task_id, status, start=None):
+    """Moves the log of a finished task from Redis to the archive.
+
+    Args:
+        task_id (string): id the task logged with
+        status (string): final state of the task, SUCCESS or FAILURE
+        start (float, optional): time the task started
+
+    Returns:
+        index entry of the log, None if the task logged nothing
+    """
+    entries = wlogger.read(task_id)
+    if not entries:
+        return None
+
+    servers = set()
+    errors = 0
+    for cursor, msg in entries:
+        if msg.get('server_id') is not None:
+            servers.add(str(msg['server_id']))
+        if msg.get('level') in ('error', 'fail'):
+            errors += 1
+
+    data = _compress(''.join(json.dumps([cursor, msg]) + '\n'
+                             for cursor, msg in entries).encode('utf-8'))
+
+    end = time.time()
+    archive_file = 'tasks-{0}.gz'.format(time.strftime('%Y%m',
+                                                       time.gmtime(end)))
+    entry = {
+        'task_id': task_id,
+        'servers': sorted(servers),
+        'start': start,
+        'end': end,
+        'status': status,
+        'messages': len(entries),
+        'errors': errors,
+        'file': archive_file,
+        }
+
+    directory = _archive_dir()
+    with open(os.path.join(directory, archive_file), 'ab') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0, os.SEEK_END)
+            entry['offset'] = f.tell()
+            entry['length'] = len(data)
+            f.write(data)
+            f.flush()
+            # index is written under the same lock, so entries of the
+            # index are in the order of the logs
+            with open(os.path.join(directory, INDEX_FILE), 'a') as index:
+                index.write(json.dumps(entry) + '\n')
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+    _cache(entry)
+    wlogger.clean(task_id)
+    return entry
+
+
+def _cache(entry):
+    _redis().set(INDEX_KEY.format(entry['task_id']), json.dumps(entry),
+                 ex=Config.TASK_LOG_ARCHIVE_CACHE_TTL)
+
+
+def recent_entries(limit=None):
+    """Yields entries of the index newest first, reading the index backwards
+    from its end.
+
+    Args:
+        limit (int, optional): number of entries read at most, defaults to
+            Config.TASK_LOG_ARCHIVE_SCAN
+    """
+    limit = limit or Config.TASK_LOG_ARCHIVE_SCAN
+    path = os.path.join(Config.TASK_LOG_ARCHIVE_DIR, INDEX_FILE)
+    if not os.path.exists(path):
+        return
+
+    count = 0
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        rest = b''
+        while count < limit:
+            if position == 0:
+                lines, rest = [rest], b''
+            else:
+                size = min(65536, position)
+                position -= size
+                f.seek(position)
+                # first line of the block may continue in the previous one
+                lines = (f.read(size) + rest).split(b'\n')
+                rest = lines.pop(0)
+            for line in reversed(lines):
+                try:
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # an empty line or a line being written
+                    continue
+                yield entry
+                count += 1
+                if count >= limit:
+                    return
+            if position == 0 and not rest:
+                return
+
+
+def find(task_id):
+    """Returns index entry of the archived log of a task, None if the log of
+    the task is not archived.
+    """
+    redis = _redis()
+    entry = redis.get(INDEX_KEY.format(task_id))
+    if entry:
+        return json.loads(entry)
+    if redis.get(MISS_KEY.format(task_id)):
+        return None
+
+    for entry in recent_entries():
+        if entry['task_id'] == task_id:
+            _cache(entry)
+            return entry
+
+    # cached entry set by archive() is found first even if this is stale
+    redis.set(MISS_KEY.format(task_id), 1, ex=MISS_TTL)
+
+
+def tasks(server_id=None, limit=50):
+    """Returns index entries of the latest archived logs, newest first.
+
+    Args:
+        server_id (int, optional): only tasks that logged for this server
+        limit (int): number of entries returned at most
+    """
+    result = []
+    for entry in recent_entries():
+        if server_id is None or str(server_id) in entry['servers']:
+            result.append(entry)
+            if len(result) >= limit:
+                break
+    return result
+
+
+def read(task_id, cursor=None, entry=None):
+    """Reads the archived log of a task.
+
+    Args:
+        task_id (string): id of the task
+        cursor (string, optional): cursor of the last message read, see
+            :meth:`clustermgr.weblogger.WebLogger.read`
+        entry (dict, optional): index entry of the log if already found
+
+    Returns:
+        list of (cursor, message) tuples after the cursor, None if the log
+        of the task is not archived
+    """
+    entry = entry or find(task_id)
+    if not entry:
+        return None
+
+    path = os.path.join(Config.TASK_LOG_ARCHIVE_DIR, entry['file'])
+    try:
+        with open(path, 'rb') as f:
+            f.seek(entry['offset'])
+            data = zlib.decompress(f.read(entry['length']), 31)
+    except (IOError, OSError, zlib.error) as e:
+        logger.error("Archived log of task %s could not be read: %s",
+                     task_id, e)
+        return None
+
+    entries = [tuple(json.loads(line))
+               for line in data.decode('utf-8').splitlines()]
+    cursors = [c for c, msg in entries]
+    if cursor in cursors:
+        return entries[cursors.index(cursor) + 1:]
+    return entries
@@ -0,0 +1,126 @@
+"""monitoring_state.py - state of the periodic collection of monitoring data
+shared by collector runs and the dashboard.
+
+Collection of each host runs as a separate unit. A unit holds a lock of its
+host in Redis while it runs, so that when a host overruns the collection
+interval its next cycle is skipped instead of piling up. Outcome of the
+last unit of every host is kept in a hash, the dashboard shows how fresh
+data of each host is from it.
+
+The time of the last point written to InfluxDB for each measurement of a
+host is also kept, so that collection does not query InfluxDB to find
+where the previous cycle stopped.
+"""
+
+import time
+import uuid
+
+from clustermgr.config import Config
+
+
+LOCK_KEY = 'monitoring:collect:lock:{0}'
+FRESHNESS_KEY = 'monitoring:collect:freshness:{0}'
+WATERMARKS_KEY = 'monitoring:collect:watermarks:{0}'
+
+# deletes the lock only if it is still held by the given token
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _redis():
+    return Config.CLUSTERMGR_REDIS
+
+
+def acquire(hostname):
+    """Takes the collection lock of a host.
+
+    Returns:
+        token to release the lock with, None if the lock is held by a
+        previous collection of the host
+    """
+    token = uuid.uuid4().hex
+    if _redis().set(LOCK_KEY.format(hostname), token, nx=True,
+                    ex=Config.MONITORING_LOCK_TTL):
+        return token
+
+
+def release(hostname, token):
+    _redis().eval(RELEASE_SCRIPT, 1, LOCK_KEY.format(hostname), token)
+
+
+def record(hostname, started, error=None):
+    """Records the outcome of a collection of a host.
+
+    Args:
+        hostname (string): hostname of the server
+        started (float): time collection started
+        error (string, optional): error the collection failed with
+    """
+    state = {'last_attempt': started,
+             'elapsed': time.time() - started,
+             'error': error or ''}
+    if not error:
+        state['last_success'] = time.time()
+        state['skipped'] = 0
+    _redis().hset(FRESHNESS_KEY.format(hostname), mapping=state)
+
+
+def record_skipped(hostname):
+    """Counts a cycle skipped since a previous collection still runs."""
+    _redis().hincrby(FRESHNESS_KEY.format(hostname), 'skipped', 1)
+
+
+def freshness(hostnames):
+    """Returns state of the last collection of hosts.
+
+    Returns:
+        dict of hostname to dict having last_attempt, last_success, elapsed,
+        error, skipped and age, which is seconds since last success. Values
+        are None for hosts never collected.
+    """
+    pipe = _redis().pipeline(transaction=False)
+    for hostname in hostnames:
+        pipe.hgetall(FRESHNESS_KEY.format(hostname))
+
+    now = time.time()
+    result = {}
+    for hostname, state in zip(hostnames, pipe.execute()):
+        state = dict((k.decode() if isinstance(k, bytes) else k,
+                      v.decode() if isinstance(v, bytes) else v)
+                     for k, v in state.items())
+        for key in ('last_attempt', 'last_success', 'elapsed'):
+            state[key] = float(state[key]) if state.get(key) else None
+        state['skipped'] = int(state.get('skipped') or 0)
+        state['error'] = state.get('error') or None
+        state['age'] = now - state['last_success'] \
+            if state['last_success'] else None
+        result[hostname] = state
+    return result
+
+
+def get_watermarks(hostname, measurements):
+    """Returns time of the last points written for measurements of a host.
+
+    Returns:
+        dict of measurement to unix time stamp, None if not known
+    """
+    if not measurements:
+        return {}
+    values = _redis().hmget(WATERMARKS_KEY.format(hostname), measurements)
+    return dict((measurement, float(value) if value is not None else None)
+                for measurement, value in zip(measurements, values))
+
+
+def set_watermark(hostname, measurement, timestamp):
+    """Stores time of the last point written for a measurement of a host,
+    should be called after the points were written successfully.
+    """
+    _redis().hset(WATERMARKS_KEY.format(hostname), measurement, timestamp)
+
+
+def clear_watermarks(hostname):
+    _redis().delete(WATERMARKS_KEY.format(hostname))
@@ -0,0 +1,212 @@
+"""preflight.py - checks network reachability of Gluu Server ports between
+hosts before installation.
+
+dry_run used to check ports one by one, and for each port nothing listened
+on, it started a Python listener on the server and polled it from the peer,
+spawning an interpreter for every poll. probe_matrix() checks the whole
+(source host x destination host x port) matrix concurrently: each
+destination opens temporary listeners for all of its free ports with a
+single process, then every source probes all destinations and ports in one
+node agent round trip. The result is ready within Config.PREFLIGHT_TIMEOUT
+seconds regardless of the number of hosts and ports.
+"""
+
+import time
+import base64
+import select
+
+from concurrent.futures import ThreadPoolExecutor
+
+from clustermgr.config import Config
+from clustermgr.core.clustermgr_logging import remote_logger as logger
+
+
+# binds all ports given as arguments, accepts and closes connections until
+# stdin is closed or lifetime passes
+LISTENER_SCRIPT = '''
+import sys, time, socket, select
+lifetime, ip, ports = float(sys.argv[1]), sys.argv[2], sys.argv[3:]
+socks = []
+for port in ports:
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        s.bind((ip, int(port)))
+        s.listen(16)
+        socks.append(s)
+        print('BOUND ' + port)
+    except Exception:
+        s.close()
+        print('FAILED ' + port)
+print('READY')
+sys.stdout.flush()
+deadline = time.time() + lifetime
+while time.time() < deadline:
+    readable = select.select(socks + [sys.stdin], [], [], 0.5)[0]
+    if sys.stdin in readable and not sys.stdin.readline():
+        break
+    for s in readable:
+        if s is not sys.stdin:
+            s.accept()[0].close()
+'''
+
+
+class PortListener(object):
+    """Temporary listeners for a set of ports on a host, run by a single
+    process over one channel.
+
+    Args:
+        conn (:class:`clustermgr.core.remote.RemoteClient`): started client
+            of the host
+        ip (string): address to bind
+        ports (list): ports to listen on
+    """
+
+    def __init__(self, conn, ip, ports):
+        self.conn = conn
+        self.ip = ip
+        self.ports = list(ports)
+        self.channel = None
+
+    def _command(self, lifetime):
+        source = base64.b64encode(LISTENER_SCRIPT.encode()).decode()
+        code = "import base64;exec(base64.b64decode('{}'))".format(source)
+        args = ' '.join([str(int(lifetime) + 1), self.ip] +
+                        [str(p) for p in self.ports])
+        return ('if command -v python3 >/dev/null; then py=python3; '
+                'else py=python; fi; exec $py -u -c "{0}" {1}'.format(
+                                                                code, args))
+
+    def start(self, deadline):
+        """Starts listeners and waits until they are bound.
+
+        Args:
+            deadline (float): time listeners live until at most
+
+        Returns:
+            dict of port to True if it could be bound
+        """
+        bound = dict((port, False) for port in self.ports)
+        if not self.ports:
+            return bound
+
+        transport = self.conn.client.get_transport()
+        self.channel = transport.open_session()
+        self.channel.exec_command(self._command(deadline - time.time()))
+
+        output = b''
+        while b'READY' not in output:
+            if self.channel.recv_ready():
+                data = self.channel.recv(4096)
+                if not data:
+                    break
+                output += data
+                continue
+            if self.channel.exit_status_ready() or time.time() > deadline:
+                break
+            select.select([self.channel], [], [], 0.5)
+
+        for line in output.decode().splitlines():
+            if line.startswith('BOUND '):
+                bound[int(line.split()[1])] = True
+
+        return bound
+
+    def close(self):
+        if self.channel is not None:
+            try:
+                self.channel.shutdown_write()
+                self.channel.close()
+            except Exception:
+                pass
+            self.channel = None
+
+
+def probe_matrix(sources, destinations, ports, timeout=None):
+    """Checks which ports of destinations are reachable from sources.
+
+    Ports nothing listens on are bound by temporary listeners during the
+    probe, so that firewalls are tested before Gluu Server is installed.
+
+    Args:
+        sources (list): (name, client) tuples of hosts probing
+        destinations (list): (name, client, ip) tuples of hosts probed
+        ports (list): ports to be checked on each destination
+        timeout (float, optional): seconds the whole check may take,
+            defaults to Config.PREFLIGHT_TIMEOUT
+
+    Returns:
+        dict having keys
+            listening: {destination: {port: True if a process listens on
+                it already}}
+            bound: {destination: {port: True if a temporary listener
+                could be started on it}}
+            reachable: {source: {destination: {port: True if it can be
+                connected from source}}}
+        Values of a host that could not be checked are None.
+    """
+    timeout = timeout or Config.PREFLIGHT_TIMEOUT
+    deadline = time.time() + timeout
+    probe_timeout = Config.PREFLIGHT_PROBE_TIMEOUT
+
+    result = {'listening': {}, 'bound': {}, 'reachable': {}}
+    if not destinations:
+        return result
+
+    workers = min(Config.FANOUT_MAX_WORKERS,
+                  max(len(sources), len(destinations)))
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def check_listening(destination):
+        name, conn, ip = destination
+        try:
+            status = conn.agent.ports_open([(ip, p) for p in ports],
+                                           timeout=probe_timeout)
+            return dict(zip(ports, status))
+        except Exception as e:
+            logger.error("[%s] Preflight port check failed: %s", name, e)
+
+    def start_listener(listener):
+        try:
+            return listener.start(deadline)
+        except Exception as e:
+            logger.error("[%s] Preflight listeners failed: %s",
+                            listener.conn.host, e)
+
+    targets = [(name, ip, p) for name, conn, ip in destinations for p in ports]
+
+    def probe(source):
+        name, conn = source
+        try:
+            status = conn.agent.ports_open([(ip, p) for _, ip, p in targets],
+                                           timeout=probe_timeout)
+        except Exception as e:
+            logger.error("[%s] Preflight probe failed: %s", name, e)
+            return None
+        reachable = dict((dest, {}) for dest, _, _ in destinations)
+        for (dest, ip, p), is_open in zip(targets, status):
+            reachable[dest][p] = is_open
+        return reachable
+
+    listeners = []
+    try:
+        for (name, conn, ip), listening in zip(
+                destinations, executor.map(check_listening, destinations)):
+            result['listening'][name] = listening
+            free_ports = [p for p in ports if listening and not listening[p]]
+            listeners.append((name, PortListener(conn, ip, free_ports)))
+
+        for (name, listener), bound in zip(
+                listeners, executor.map(start_listener,
+                                        [l for _, l in listeners])):
+            result['bound'][name] = bound
+
+        for (name, conn), reachable in zip(sources,
+                                           executor.map(probe, sources)):
+            result['reachable'][name] = reachable
+    finally:
+        for name, listener in listeners:
+            listener.close()
+        executor.shutdown(wait=False)
+
+    return result
@@ -1,23 +1,39 @@
 import io
-import socket
+import codecs
 import os
+import stat
+import time
+import fnmatch
+import hashlib
+import tarfile
+import uuid
+import shlex
+import queue
 import base64
+import select
 import logging
+import threading
 import subprocess
 
 from logging.handlers import RotatingFileHandler
 from paramiko import SSHException
 from paramiko.client import SSHClient, AutoAddPolicy
+from paramiko.sftp_client import SFTPClient
 from paramiko.ssh_exception import PasswordRequiredException 
 from flask import current_app
 
 from clustermgr.extensions import wlogger
 from clustermgr.config import Config
 from clustermgr.core.clustermgr_logging import remote_logger as logger
+from clustermgr.core.connection_pool import ssh_pool, PoolExhaustedException
+from clustermgr.core.agent import NodeAgent
 
 from paramiko.util import log_to_file
 log_to_file(os.path.join(os.path.expanduser("~"), ".clustermgr4", "logs", "paramiko.log"), level = "DEBUG")
 
+# name the host key of the peer is given with in RemoteClient.relay_to()
+RELAY_HOST_KEY_ALIAS = 'clustermgr-relay-peer'
+
 def decode(key, enc):
     dec = []
     enc = base64.urlsafe_b64decode(enc)
@@ -28,43 +44,221 @@ def decode(key, enc):
     return "".join(dec)
 
 
-def get_os_type(self):
+def os_type_from_release(release_file, content):
+    """Returns OS type of a server from its /etc/*release file name and
+    content, None if it is not known."""
+    os_type = None
 
-    cin, cout, cerr = self.run("ls /etc/*release")
-    files = cout.split()
-    
-    if files[0] == '/etc/alpine-release':
+    if release_file == '/etc/alpine-release':
         os_type = 'Alpine'
 
-    cin, cout, cerr = self.run("cat "+files[0])
-
-    if "Ubuntu" in cout and "18.04" in cout:
+    if "Ubuntu" in content and "18.04" in content:
         os_type = "Ubuntu 18"
-    if "Ubuntu" in cout and "20.04" in cout:
+    if "Ubuntu" in content and "20.04" in content:
         os_type = "Ubuntu 20"
-    if "CentOS" in cout and "release 7." in cout:
+    if "CentOS" in content and "release 7." in content:
         os_type = "CentOS 7"
-    if "CentOS" in cout and "release 8" in cout:
+    if "CentOS" in content and "release 8" in content:
         os_type = "CentOS 8"
-    if 'Red Hat Enterprise Linux' in cout and '7.' in cout:
+    if 'Red Hat Enterprise Linux' in content and '7.' in content:
         os_type = 'RHEL 7'
-    if 'Red Hat Enterprise Linux' in cout and '8.' in cout:
+    if 'Red Hat Enterprise Linux' in content and '8.' in content:
         os_type = 'RHEL 8'
-    if 'Debian' in cout and "(stretch)" in cout:
+    if 'Debian' in content and "(stretch)" in content:
         os_type = 'Debian 9'
-    if 'Debian' in cout and "(buster)" in cout:
+    if 'Debian' in content and "(buster)" in content:
         os_type = 'Debian 10'
 
-    self.server_os = os_type
+    return os_type
+
+
+def get_os_type(self):
+
+    cin, cout, cerr = self.run("ls /etc/*release")
+    files = cout.split()
+
+    cin, cout, cerr = self.run("cat "+files[0])
+
+    self.server_os = os_type_from_release(files[0], cout)
     
     return self.server_os
 
 
+def file_sums(path, chunk_size):
+    """Returns SHA-256 hex digests of each chunk_size bytes long chunk of a
+    local file and of the whole file."""
+    chunk_sums = []
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            chunk_sums.append(hashlib.sha256(chunk).hexdigest())
+            digest.update(chunk)
+    return chunk_sums, digest.hexdigest()
+
+
 class ClientNotSetupException(Exception):
     """Exception raised when the client is not initialized because
     of connection failures."""
     pass
 
+class CommandResult(tuple):
+    """Result of :meth:`RemoteClient.run`. It unpacks like the
+    (stdin, stdout, stderr) tuple returned by the client so far, and carries
+    the exit status of the command.
+
+    Attributes:
+        stdout (string): standard output of the command
+        stderr (string): standard error of the command
+        exit_status (int): exit status of the command, None if unknown
+        timed_out (bool): True if the command was cancelled at its deadline
+    """
+
+    timed_out = False
+
+    def __new__(cls, stdout='', stderr='', exit_status=None):
+        result = super(CommandResult, cls).__new__(cls, ('', stdout, stderr))
+        result.exit_status = exit_status
+        return result
+
+    @property
+    def stdout(self):
+        return self[1]
+
+    @property
+    def stderr(self):
+        return self[2]
+
+
+class CommandTimeout(CommandResult):
+    """Result of a command that did not finish within its deadline. stdout
+    and stderr contain the output received until the channel was closed."""
+
+    timed_out = True
+
+
+class CommandStream(object):
+    """Output of a command started by :meth:`RemoteClient.run_stream`.
+    Iterating over it yields decoded lines of stdout as they arrive, lines
+    longer than Config.SSH_STREAM_MAX_LINE are yielded in pieces. The channel
+    is read only when the next line is requested, so a slow consumer makes
+    the server wait instead of output piling up in memory. stderr is read
+    along to keep the channel window open.
+
+    Attributes:
+        command (string): the command that is run
+        stderr (string): stderr received so far
+        exit_status (int): exit status of the command, None until it exits
+        timed_out (bool): True if the command was cancelled at its deadline
+    """
+
+    chunk_size = 32768
+
+    def __init__(self, channel, command, host='', timeout=None,
+                 max_stderr=None):
+        self.channel = channel
+        self.command = command
+        self.host = host
+        self.timeout = timeout
+        self.max_stderr = max_stderr
+        self.deadline = time.time() + timeout if timeout else None
+        self.exit_status = None
+        self.timed_out = False
+        self._stderr = []
+        self._stderr_size = 0
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self._stderr_decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    @property
+    def stderr(self):
+        return ''.join(self._stderr)
+
+    def _read_stderr(self):
+        while self.channel.recv_stderr_ready():
+            data = self._stderr_decoder.decode(
+                                self.channel.recv_stderr(self.chunk_size))
+            self._stderr.append(data)
+            self._stderr_size += len(data)
+            if self.max_stderr is not None:
+                while self._stderr_size > self.max_stderr and len(self._stderr) > 1:
+                    self._stderr_size -= len(self._stderr.pop(0))
+
+    def chunks(self):
+        """Yields decoded chunks of stdout until the command exits or the
+        deadline passes. Waits on the channel's file descriptor, which gets
+        readable when data arrives on either stream or the channel closes.
+        """
+        channel = self.channel
+
+        while True:
+            wait = 0.5
+            if self.deadline:
+                remaining = self.deadline - time.time()
+                if remaining <= 0:
+                    logger.warning("[%s] Command exceeded deadline of %s "
+                                    "seconds: %s", self.host, self.timeout,
+                                    self.command)
+                    self.timed_out = True
+                    channel.close()
+                    return
+                wait = min(wait, remaining)
+
+            self._read_stderr()
+            if channel.recv_ready():
+                data = self._decoder.decode(channel.recv(self.chunk_size))
+                if data:
+                    yield data
+                continue
+
+            if channel.closed or (channel.eof_received
+                                    and channel.exit_status_ready()):
+                self._read_stderr()
+                if channel.recv_ready():
+                    continue
+                break
+
+            # exit status alone does not wake select, so it is polled
+            select.select([channel], [], [], wait)
+
+        data = self._decoder.decode(b'', True)
+        if data:
+            yield data
+
+        if channel.exit_status_ready():
+            self.exit_status = channel.recv_exit_status()
+
+    def __iter__(self):
+        max_line = Config.SSH_STREAM_MAX_LINE
+        pending = ''
+        for chunk in self.chunks():
+            lines = (pending + chunk).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                while len(line) > max_line:
+                    yield line[:max_line]
+                    line = line[max_line:]
+                yield line
+            while len(pending) > max_line:
+                yield pending[:max_line]
+                pending = pending[max_line:]
+        if pending:
+            yield pending
+
+    def wait(self):
+        """Discards the remaining output and returns the exit status."""
+        for chunk in self.chunks():
+            pass
+        return self.exit_status
+
+    def close(self):
+        self.channel.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 class mySSHClient(SSHClient):
     def __init__(self):
         super(mySSHClient, self).__init__()
@@ -88,71 +282,172 @@ class RemoteClient(object):
             for all the communications with the remote server.
         sftpclient (:class:`paramiko.sftp_client.SFTPClient`): The SFTP object
             for all the file transfer operations over the SSH.
+        command_timeout (float): default deadline in seconds for run(),
+            Config.SSH_COMMAND_TIMEOUT unless set, 0 waits for commands to
+            finish
     """
 
-    def __init__(self, host, ip=None, user='root', passphrase=None, ssh_port=22):
+    def __init__(self, host, ip=None, user='root', passphrase=None, ssh_port=22,
+                 pooled=True):
         self.host = host
         self.ip = ip
         self.user = user
         self.ssh_port = ssh_port
-                
-        if not passphrase:
+        self.pooled = pooled
+        self.passphrase = passphrase
+        self.client = None
+        self.sftpclient = None
+        self._lease = None
+        self.command_timeout = Config.SSH_COMMAND_TIMEOUT
+        self._agent = None
+        logger.debug("RemoteClient created for host: %s", host)
+
+    @property
+    def pool_key(self):
+        return (self.host, self.ip, self.ssh_port, self.user)
+
+    @property
+    def agent(self):
+        """The node agent of the server, see :class:`NodeAgent`. It is started
+        on first use and lives as long as the SSH connection, so pooled
+        connections share it between RemoteClient instances.
+        """
+        if not self.client:
+            raise ClientNotSetupException(
+                'Cannot run procedure. Client not initialized')
+
+        holder = self._lease
+        if holder is None:
+            if self._agent is None:
+                self._agent = NodeAgent(self)
+            agent = self._agent
+        else:
+            if holder.agent is None:
+                holder.agent = NodeAgent(self)
+            agent = holder.agent
+
+        agent.conn = self
+        return agent
+
+    def _get_passphrase(self):
+        """Returns the passphrase of the pubkey. If it was not supplied, it is
+        read from DATA_DIR/.pw only when a new connection is made.
+        """
+        if not self.passphrase:
             pw_file = os.path.join(current_app.config['DATA_DIR'], '.pw')
             if os.path.exists(pw_file):
                 encoded_passphrase = open(pw_file).read()
             
-                passphrase = decode(
+                self.passphrase = decode(
                                 os.getenv('NEW_UUID'), 
                                 encoded_passphrase
                                 )
-        self.passphrase = passphrase
-        self.client = mySSHClient()
-        self.sftpclient = None
-        self.client.set_missing_host_key_policy(AutoAddPolicy())
-        self.client.load_system_host_keys()
-        logger.debug("RemoteClient created for host: %s", host)
+        return self.passphrase
 
     def startup(self):
-        """Function that starts SSH connection and makes client available for
-        carrying out the functions. It tries with the hostname, if it fails
-        it tries with the IP address if supplied
+        """Function that makes client available for carrying out the functions.
+        An authenticated connection is leased from the process wide SSH pool,
+        a new one is made only if there is no idle connection for this host.
         """
+        if not self.pooled:
+            self.client, self.sftpclient = self._connect()
+            return
+
         try:
-            logger.debug("Trying to connect to remote server %s:%s", self.host, self.ssh_port)
-            self.client.connect(self.host, port=self.ssh_port, username=self.user, 
-                                    passphrase=self.passphrase)
-            self.sftpclient = self.client.open_sftp()
-        except PasswordRequiredException:
-            raise ClientNotSetupException('Pubkey is encrypted.')
-        
-        except SSHException as e:
-            raise ClientNotSetupException(e)
-        
-        except:
-            if self.ip:
-                logger.warning("Connection with hostname failed. Retrying "
-                                "with IP")
-                self._try_with_ip()
+            self._lease = ssh_pool.lease(self.pool_key, self._connect)
+        except PoolExhaustedException as e:
+            raise ClientNotSetupException(str(e))
+
+        self.client = self._lease.client
+        self.sftpclient = self._lease.sftpclient
+
+    def _connect(self):
+        """Starts SSH connection. Hostname and IP address (if supplied) are
+        raced: the connection to the IP is started when the hostname did not
+        connect within Config.SSH_CONNECT_RACE_DELAY seconds or failed, and
+        the first authenticated connection wins.
+
+        Returns:
+            tuple: connected SSHClient and SFTPClient
+        """
+        passphrase = self._get_passphrase()
+        addresses = [self.host]
+        if self.ip and self.ip != self.host:
+            addresses.append(self.ip)
+
+        attempts = queue.Queue()
+        state = {'winner': None}
+        lock = threading.Lock()
+
+        def attempt(address):
+            client = mySSHClient()
+            client.set_missing_host_key_policy(AutoAddPolicy())
+            client.load_system_host_keys()
+            try:
+                logger.debug("Trying to connect to remote server %s:%s",
+                                address, self.ssh_port)
+                client.connect(address, port=self.ssh_port,
+                                username=self.user, passphrase=passphrase,
+                                timeout=Config.SSH_CONNECT_TIMEOUT,
+                                banner_timeout=Config.SSH_CONNECT_TIMEOUT,
+                                auth_timeout=Config.SSH_CONNECT_TIMEOUT)
+                sftpclient = client.open_sftp()
+            except Exception as e:
+                client.close()
+                attempts.put((address, None, e))
+                return
+
+            with lock:
+                won = state['winner'] is None
+                if won:
+                    state['winner'] = address
+            if won:
+                attempts.put((address, (client, sftpclient), None))
             else:
-                logger.error("Connection to %s failed.", self.host)
-                raise ClientNotSetupException('Could not connect to the host.')
+                # the other address was faster, close late connection
+                logger.debug("Closing late connection to %s", address)
+                client.close()
+
+        def start(address):
+            thread = threading.Thread(target=attempt, args=(address,))
+            thread.daemon = True
+            thread.start()
+
+        start(addresses[0])
+        started = 1
+        errors = []
+
+        while len(errors) < len(addresses):
+            wait = None
+            if started < len(addresses):
+                wait = Config.SSH_CONNECT_RACE_DELAY
+            try:
+                address, connection, error = attempts.get(timeout=wait)
+            except queue.Empty:
+                logger.warning("Connection with hostname is slow. Racing "
+                                "with IP")
+                start(addresses[started])
+                started += 1
+                continue
 
+            if connection:
+                return connection
 
-    def _try_with_ip(self):
-        try:
-            logger.debug("Connecting to IP:%s User:%s" % (self.ip, self.user))
-            self.client.connect(self.ip, port=22, username=self.user,
-                                passphrase=self.passphrase)
-            self.sftpclient = self.client.open_sftp()
-        except PasswordRequiredException:
-            raise ClientNotSetupException('Pubkey is encrypted.')
+            errors.append(error)
+            if isinstance(error, PasswordRequiredException):
+                raise ClientNotSetupException('Pubkey is encrypted.')
 
-        except SSHException as e:
-            raise ClientNotSetupException(e)
+            if started < len(addresses):
+                logger.warning("Connection with hostname failed. Retrying "
+                                "with IP")
+                start(addresses[started])
+                started += 1
 
-        except socket.error:
-            logger.error("Connection with IP (%s) failed.", self.ip)
-            raise ClientNotSetupException('Could not connect to the host.')
+        logger.error("Connection to %s failed.", self.host)
+        for error in errors:
+            if isinstance(error, SSHException):
+                raise ClientNotSetupException(error)
+        raise ClientNotSetupException('Could not connect to the host.')
 
     def rename(self, oldpath, newpath):
         """Rename a file or folder from oldpath to newpath.
@@ -216,6 +511,181 @@ class RemoteClient(object):
             logger.debug("[%s] ERROR %s", self.host, IOError)
             return False, "Error: Remote location %s doesn't exist." % remote
 
+    def upload_large(self, local, remote, chunk_size=None, streams=None):
+        """Uploads a large file in chunks sent concurrently over several SFTP
+        channels with pipelined writes, so the transfer is not limited by the
+        round trip time of each write. Data is written to remote.part, chunks
+        already there with the right checksum are not sent again, so an
+        interrupted upload resumes where it stopped. The file is moved into
+        place only after its SHA-256 matches the local one.
+
+        Args:
+            local (string): path of the local file to upload
+            remote (string): location on remote server to put the file
+            chunk_size (int, optional): defaults to Config.SFTP_CHUNK_SIZE
+            streams (int, optional): number of concurrent SFTP channels,
+                defaults to Config.SFTP_STREAMS
+
+        Returns:
+            tuple: True/False, remote path / error
+        """
+        if not self.client:
+            raise ClientNotSetupException(
+                'Cannot upload file. Client not initialized')
+
+        chunk_size = chunk_size or Config.SFTP_CHUNK_SIZE
+        streams = streams or Config.SFTP_STREAMS
+
+        try:
+            size = os.path.getsize(local)
+            chunk_sums, digest = file_sums(local, chunk_size)
+        except (OSError, IOError):
+            return False, "Error: Local file %s doesn't exist." % local
+
+        partial = shlex.quote(remote + '.part')
+        logger.debug("[%s] Uploading large file %s", self.host, remote)
+
+        # sums of chunks of a previous attempt, a fresh file is not read
+        result = self.run(
+            'if [ -s {0} ]; then i=0; while [ $i -lt {1} ]; do '
+            'dd if={0} bs={2} skip=$i count=1 2>/dev/null | sha256sum; '
+            'i=$((i+1)); done; fi; touch {0} && truncate -s {3} {0}'.format(
+                            partial, len(chunk_sums), chunk_size, size))
+        if result.exit_status != 0:
+            return False, "Error: Remote location %s doesn't exist." % remote
+
+        remote_sums = [line.split(' ')[0] for line in result.stdout.splitlines()]
+        pending = queue.Queue()
+        for i, chunk_sum in enumerate(chunk_sums):
+            if i >= len(remote_sums) or remote_sums[i] != chunk_sum:
+                pending.put(i)
+
+        logger.debug("[%s] Sending %d of %d chunks of %s", self.host,
+                        pending.qsize(), len(chunk_sums), remote)
+
+        errors = []
+        transport = self.client.get_transport()
+
+        def send_chunks():
+            try:
+                sftp = SFTPClient.from_transport(
+                            transport, window_size=Config.SFTP_WINDOW_SIZE)
+                try:
+                    with open(local, 'rb') as src, \
+                            sftp.open(remote + '.part', 'r+b') as dst:
+                        dst.set_pipelined(True)
+                        while not errors:
+                            try:
+                                i = pending.get_nowait()
+                            except queue.Empty:
+                                break
+                            src.seek(i * chunk_size)
+                            dst.seek(i * chunk_size)
+                            dst.write(src.read(chunk_size))
+                finally:
+                    sftp.close()
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=send_chunks)
+                   for _ in range(min(streams, pending.qsize()))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if errors:
+            logger.error("[%s] Uploading %s failed: %s", self.host, remote,
+                            errors[0])
+            return False, "Error: {}".format(errors[0])
+
+        return self._finish_transfer(remote, digest)
+
+    def _finish_transfer(self, remote, digest):
+        """Moves remote.part to remote if its SHA-256 is digest."""
+        partial = shlex.quote(remote + '.part')
+        result = self.run(
+            '[ "$(sha256sum {0} | cut -d" " -f1)" = {1} ] && mv -f {0} {2}'.format(
+                            partial, digest, shlex.quote(remote)))
+        if result.exit_status != 0:
+            logger.error("[%s] Checksum of %s does not match", self.host,
+                            remote)
+            return False, "Error: Checksum of %s does not match." % remote
+
+        return True, remote
+
+    def sha256(self, remote):
+        """Returns SHA-256 hex digest of a remote file, None if it can't be
+        read."""
+        result = self.run('sha256sum {}'.format(shlex.quote(remote)))
+        if result.exit_status != 0:
+            return None
+        return result.stdout.split(' ')[0]
+
+    def relay_to(self, peer, remote, digest=None):
+        """Sends a file of this server to the same location on a peer server
+        over SSH between the two servers, so the data does not pass through
+        the manager. This server must be able to log in to the peer with its
+        own key, manager's SSH agent is not forwarded. The peer is accepted
+        only if it presents the host key the manager's connection to it
+        has, which is given to ssh in a temporary known hosts file.
+
+        Args:
+            peer (:class:`RemoteClient`): started client of the peer server
+            remote (string): location of the file on both servers
+            digest (string, optional): expected SHA-256 of the file, the file
+                is not sent if the one on this server has a different sum
+
+        Returns:
+            tuple: True/False, remote path / error
+        """
+        if not self.client or not peer.client:
+            raise ClientNotSetupException(
+                'Cannot relay file. Client not initialized')
+
+        source_digest = self.sha256(remote)
+        if not source_digest or (digest and source_digest != digest):
+            return False, "Error: %s on %s is missing or differs." % (
+                                                            remote, self.host)
+
+        host_key = peer.client.get_transport().get_remote_server_key()
+        known_host = '{0} {1} {2}'.format(RELAY_HOST_KEY_ALIAS,
+                                          host_key.get_name(),
+                                          host_key.get_base64())
+
+        receive = 'cat > {}'.format(shlex.quote(remote + '.part'))
+        command = (
+            'command -v ssh >/dev/null || '
+            '{{ echo "ssh client is not installed" >&2; exit 127; }}; '
+            'kh=$(mktemp) || exit 1; '
+            'printf "%s\\n" {0} > "$kh"; '
+            'ssh -a -o BatchMode=yes -o StrictHostKeyChecking=yes '
+            '-o UserKnownHostsFile="$kh" -o HostKeyAlias={1} '
+            '-o ConnectTimeout={2} -p {3} {4}@{5} {6} < {7}; '
+            'rc=$?; rm -f "$kh"; exit $rc'.format(
+                    shlex.quote(known_host), RELAY_HOST_KEY_ALIAS,
+                    Config.SSH_CONNECT_TIMEOUT, peer.ssh_port, peer.user,
+                    shlex.quote(peer.ip or peer.host),
+                    shlex.quote(receive), shlex.quote(remote)))
+
+        logger.debug("[%s] Relaying %s to %s", self.host, remote, peer.host)
+        channel = self.client.get_transport().open_session()
+        try:
+            channel.exec_command(command)
+            stream = CommandStream(channel, command, self.host,
+                                   Config.RELAY_TIMEOUT)
+            exit_status = stream.wait()
+        except Exception as e:
+            return False, "Error: {}".format(e)
+        finally:
+            channel.close()
+
+        if exit_status != 0:
+            return False, "Error: {}".format(stream.stderr.strip()
+                                            or 'relay was not completed')
+
+        return peer._finish_transfer(remote, source_digest)
+
     def exists(self, filepath):
         """Returns whether a file exists or not in the remote server.
 
@@ -236,32 +706,257 @@ class RemoteClient(object):
         except:
             return False
 
-    def run(self, command):
+    def run(self, command, timeout=None, input=None):
         """Run a command in the remote server.
 
         Args:
             command (string): the command to be run on the remote server
+            timeout (float, optional): deadline in seconds for the command.
+                Defaults to command_timeout attribute, 0 waits until the
+                command ends. When it passes, the channel is closed, which
+                cancels the command on the server.
+            input (string, optional): data to be sent to stdin of the command
+
+        Returns:
+            :class:`CommandResult` unpacking to three strings containing text
+            from stdin, stdout and stderr, or :class:`CommandTimeout` if the
+            command did not finish within the deadline
+        """
+        stream = self.run_stream(command, timeout, max_stderr=None, input=input)
+        try:
+            stdout = ''.join(stream.chunks())
+        finally:
+            stream.close()
+
+        if stream.timed_out:
+            return CommandTimeout(stdout, stream.stderr)
+
+        return CommandResult(stdout, stream.stderr, stream.exit_status)
+
+    def run_batch(self, commands, timeout=None, parallel=False):
+        """Runs several commands in the remote server with a single exec.
+        Each command is run in its own subshell, its output is collected in
+        a temporary directory on the server and sent back base64 encoded.
+
+        Args:
+            commands (list): commands to be run
+            timeout (float, optional): deadline in seconds for all commands,
+                defaults to command_timeout attribute
+            parallel (bool): run the commands concurrently instead of one
+                after the other
+
+        Returns:
+            list of :class:`CommandResult` in the same order as commands,
+            :class:`CommandTimeout` for commands without result when the
+            deadline passed
+        """
+        if not commands:
+            return []
+
+        token = '__CMB_{}__'.format(uuid.uuid4().hex)
+        script = ['__cm_d=$(mktemp -d) || exit 1']
+        for i, command in enumerate(commands):
+            encoded = base64.b64encode(command.encode()).decode()
+            script.append(
+                "{{ ( eval \"$(printf %s '{1}' | base64 -d)\" ) </dev/null "
+                ">$__cm_d/{0}.out 2>$__cm_d/{0}.err; echo $? >$__cm_d/{0}.rc; "
+                "}}{2}".format(i, encoded, ' &' if parallel else ''))
+        script += [
+            'wait',
+            'for i in $(seq 0 {}); do'.format(len(commands) - 1),
+            '  printf "{} %s %s %s %s\\n" $i "$(cat $__cm_d/$i.rc)" '
+            '"$(base64 -w0 <$__cm_d/$i.out)" "$(base64 -w0 <$__cm_d/$i.err)"'.format(token),
+            'done',
+            'rm -rf $__cm_d',
+        ]
+
+        result = self.run('\n'.join(script), timeout)
+
+        results = [None] * len(commands)
+        for line in result.stdout.splitlines():
+            fields = line.split(' ')
+            if len(fields) != 5 or fields[0] != token:
+                continue
+            i = int(fields[1])
+            results[i] = CommandResult(
+                base64.b64decode(fields[3]).decode('utf-8', 'replace'),
+                base64.b64decode(fields[4]).decode('utf-8', 'replace'),
+                int(fields[2]) if fields[2].isdigit() else None,
+                )
+
+        for i, item in enumerate(results):
+            if item is None:
+                results[i] = CommandTimeout('', result.stderr) \
+                    if result.timed_out else CommandResult('', result.stderr)
+
+        return results
+
+    def stat_many(self, paths):
+        """Stats several paths in the remote server with a single exec.
+
+        Args:
+            paths (list): paths to be checked
+
+        Returns:
+            dict of path to a dict having size, mtime, mode and isdir, or None
+            if the path does not exist
+        """
+        paths = list(paths)
+        results = self.run_batch(
+                        ["stat -L -c '%s %Y %f' {}".format(shlex.quote(path))
+                         for path in paths])
+
+        stats = {}
+        for path, result in zip(paths, results):
+            stats[path] = None
+            if result.exit_status == 0 and result.stdout.strip():
+                size, mtime, mode = result.stdout.split()
+                mode = int(mode, 16)
+                stats[path] = {
+                    'size': int(size),
+                    'mtime': int(mtime),
+                    'mode': mode,
+                    'isdir': stat.S_ISDIR(mode),
+                    }
+        return stats
+
+    def run_stream(self, command, timeout=None,
+                   max_stderr=Config.SSH_STREAM_MAX_STDERR, input=None):
+        """Starts a command in the remote server and returns its output as a
+        stream instead of buffering it, so large outputs are processed with
+        constant memory.
+
+        Args:
+            command (string): the command to be run on the remote server
+            timeout (float, optional): deadline in seconds for the command,
+                defaults to command_timeout attribute
+            max_stderr (int, optional): number of bytes of stderr to keep,
+                the first bytes are dropped when exceeded. None keeps all.
+            input (string, optional): data to be sent to stdin of the command,
+                stdin is closed after it
 
         Returns:
-            tuple of three strings containing text from stdin, stdout an stderr
+            :class:`CommandStream` iterating over the lines of stdout
         """
         if not self.client:
             raise ClientNotSetupException(
                 'Cannot run procedure. Client not initialized')
 
+        if timeout is None:
+            timeout = self.command_timeout
 
         logger.debug("[%s] Running command %s", self.host, command)
 
-        #buffers = self.client.exec_command(command, timeout=30)
-        buffers = self.client.exec_command(command)
-        output = []
-        for buf in buffers:
-            try:
-                output.append(buf.read().decode())
-            except IOError:
-                output.append('')
+        channel = self.client.get_transport().open_session(
+                                                    timeout=timeout or None)
+        try:
+            channel.exec_command(command)
+            if input is not None:
+                if not isinstance(input, bytes):
+                    input = input.encode()
+                channel.sendall(input)
+                channel.shutdown_write()
+        except:
+            channel.close()
+            raise
+
+        return CommandStream(channel, command, self.host, timeout, max_stderr)
+
+    def sync_tree(self, local_dir, remote_dir, include=None, exclude=None):
+        """Makes remote_dir contain the files of local_dir. SHA-256 sums of
+        the remote files are compared with the local ones and only changed
+        files are sent, as a single tar stream over one channel. The tar is
+        extracted to a staging directory in remote_dir and each file is
+        renamed into place, so a file is either the old or the new one.
+        Remote files not present in local_dir are left untouched.
+
+        Args:
+            local_dir (string): local directory to be sent
+            remote_dir (string): directory on the remote server
+            include (list, optional): fnmatch patterns of relative paths to
+                be sent, all files are sent if not given
+            exclude (list, optional): fnmatch patterns of relative paths or
+                names of files not to be sent
+
+        Returns:
+            tuple: True/False, list of relative paths of the sent files / error
+        """
+        if not self.client:
+            raise ClientNotSetupException(
+                'Cannot upload files. Client not initialized')
+
+        local_sums = {}
+        for root, dirs, names in os.walk(local_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, local_dir)
+                if include and not any(fnmatch.fnmatch(rel, p) for p in include):
+                    continue
+                if exclude and any(fnmatch.fnmatch(rel, p) or fnmatch.fnmatch(name, p)
+                                   for p in exclude):
+                    continue
+                digest = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1048576), b''):
+                        digest.update(chunk)
+                local_sums[rel] = digest.hexdigest()
+
+        if not local_sums:
+            return True, []
+
+        logger.debug("[%s] Synchronizing %s to %s", self.host, local_dir,
+                        remote_dir)
+
+        result = self.run('cd {} 2>/dev/null && xargs -0 sha256sum 2>/dev/null'.format(
+                                                        shlex.quote(remote_dir)),
+                          input='\0'.join(local_sums))
+        remote_sums = {}
+        for line in result.stdout.splitlines():
+            digest, _, rel = line.partition('  ')
+            remote_sums[rel] = digest
+
+        changed = sorted(rel for rel, digest in local_sums.items()
+                         if remote_sums.get(rel) != digest)
+        if not changed:
+            return True, []
+
+        extract_cmd = '\n'.join([
+            'set -e',
+            'dest={}'.format(shlex.quote(remote_dir)),
+            'mkdir -p "$dest"',
+            'stage=$(mktemp -d "$dest/.cm-sync.XXXXXX")',
+            'trap \'rm -rf "$stage"\' EXIT',
+            'tar -xzf - --no-same-owner -C "$stage"',
+            'cd "$stage"',
+            'find . -type f | while IFS= read -r f; do',
+            '  mkdir -p "$dest/${f%/*}"',
+            '  mv -f "$f" "$dest/$f"',
+            'done',
+            ])
+
+        channel = self.client.get_transport().open_session()
+        try:
+            channel.exec_command(extract_cmd)
+            stdin = channel.makefile('wb')
+            with tarfile.open(fileobj=stdin, mode='w|gz') as tar:
+                for rel in changed:
+                    tar.add(os.path.join(local_dir, rel), arcname=rel)
+            stdin.close()
+            channel.shutdown_write()
+
+            stream = CommandStream(channel, extract_cmd, self.host)
+            exit_status = stream.wait()
+        except Exception as err:
+            logger.error("[%s] Synchronizing %s failed: %s", self.host,
+                            remote_dir, err)
+            return False, err
+        finally:
+            channel.close()
+
+        if exit_status != 0:
+            return False, stream.stderr.strip()
 
-        return tuple(output)
+        return True, changed
 
     def get_file(self, filename):
         """Reads content of filename on remote server
@@ -275,18 +970,128 @@ class RemoteClient(object):
 
         logger.debug("[%s] Getting file %s", self.host, filename)
 
-        file_obj = io.BytesIO()
         try:
-            result = self.sftpclient.getfo(filename, file_obj)
-            file_obj.seek(0)
+            # decoded chunk by chunk, the content is held once in ret_io
             ret_io = io.StringIO()
-            ret_io.write(file_obj.read().decode())
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            for chunk in self.iter_file(filename, lines=False):
+                ret_io.write(decoder.decode(chunk))
+            ret_io.write(decoder.decode(b'', True))
             ret_io.seek(0)
-            return result, ret_io
+            return True, ret_io
         except Exception as err:
             logger.error("Failed to get file %s: %s", self.host, str(err))
             return False, err
 
+    def open_file(self, filename, prefetch=True):
+        """Opens a file on remote server for reading in binary mode. With
+        prefetch, read requests for the whole file are sent at once instead
+        of waiting for each block, which is faster for sequential reads.
+
+        Args:
+            filename (string): name of file on remote server
+            prefetch (bool): prefetch the file
+
+        Returns:
+            :class:`paramiko.sftp_file.SFTPFile`, usable as context manager
+        """
+        if not self.sftpclient:
+            raise ClientNotSetupException(
+                'Cannot read file. Client not initialized')
+
+        f = self.sftpclient.open(filename, 'rb')
+        if prefetch:
+            f.prefetch()
+        return f
+
+    def iter_file(self, filename, lines=True, chunk_size=32768):
+        """Reads a file on remote server piece by piece, so memory use does
+        not depend on its size. Stopping the iteration closes the file.
+
+        Args:
+            filename (string): name of file on remote server
+            lines (bool): yield decoded lines with line endings, otherwise
+                chunks of bytes
+            chunk_size (int): size of chunks read from the file
+
+        Yields:
+            lines or chunks of the file
+
+        Raises:
+            IOError: if the file can't be opened
+        """
+        logger.debug("[%s] Reading file %s", self.host, filename)
+
+        with self.open_file(filename) as f:
+            if not lines:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    yield chunk
+                return
+
+            decoder = codecs.getincrementaldecoder('utf-8')('replace')
+            pending = ''
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                pending += decoder.decode(chunk)
+                parts = pending.splitlines(True)
+                pending = ''
+                if parts and not parts[-1].endswith(('\n', '\r')):
+                    pending = parts.pop()
+                for line in parts:
+                    yield line
+            pending += decoder.decode(b'', True)
+            if pending:
+                yield pending
+
+    def read_range(self, filename, offset, length):
+        """Reads length bytes starting at offset of a file on remote server,
+        only these bytes are transferred.
+
+        Args:
+            filename (string): name of file on remote server
+            offset (int): position to start reading from
+            length (int): number of bytes to read
+
+        Returns:
+            tuple: True/False, bytes read (less than length at end of file) /
+            error
+        """
+        logger.debug("[%s] Reading %d bytes at %d of %s", self.host, length,
+                        offset, filename)
+        try:
+            with self.open_file(filename, prefetch=False) as f:
+                f.seek(offset)
+                return True, f.read(length)
+        except Exception as err:
+            logger.error("Failed to read file %s: %s", self.host, str(err))
+            return False, err
+
+    def tail(self, filename, n_bytes=65536):
+        """Reads the end of a file on remote server, e.g. a log file.
+
+        Args:
+            filename (string): name of file on remote server
+            n_bytes (int): maximum number of bytes to read, a line cut by it
+                is dropped
+
+        Returns:
+            tuple: True/False, text of the last lines / error
+        """
+        logger.debug("[%s] Reading last %d bytes of %s", self.host, n_bytes,
+                        filename)
+        try:
+            with self.open_file(filename, prefetch=False) as f:
+                offset = max(0, f.stat().st_size - n_bytes)
+                f.seek(offset)
+                data = f.read(n_bytes)
+        except Exception as err:
+            logger.error("Failed to read file %s: %s", self.host, str(err))
+            return False, err
+
+        if offset:
+            data = data.partition(b'\n')[2]
+
+        return True, data.decode('utf-8', 'replace')
+
     def put_file(self,  filename, filecontent):
         """Puts content to a file on remote server
 
@@ -354,9 +1159,24 @@ class RemoteClient(object):
 
 
     def close(self):
-        """Close the SSH Connection
+        """Close the SSH Connection. Pooled connections are given back to the
+        pool to be reused by the next RemoteClient for the same host.
         """
-        self.client.close()
+        if self._lease:
+            lease, self._lease = self._lease, None
+            ssh_pool.release(lease)
+        elif self.client:
+            if self._agent:
+                self._agent.close()
+                self._agent = None
+            self.client.close()
+
+        self.client = None
+        self.sftpclient = None
+
+    def __del__(self):
+        if getattr(self, '_lease', None):
+            self.close()
 
     def __repr__(self):
         return "RemoteClient({0}, ip={1}, user={2}, port={3})".format(self.host, self.ip,
@@ -386,20 +1206,22 @@ class FakeRemote:
     """Provides fake remote class with the same run() function.
     """
 
-    def run(self, cmd):
+    def run(self, cmd, timeout=None, input=None):
         
         """This method executes cmd as a sub-process.
 
         Args:
             cmd (string): commands to run locally
+            timeout (float, optional): not used, commands run until they end
+            input (string, optional): data to be sent to stdin of cmd
         
         Returns:
             Standard input, output and error of command
         
         """
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
         
-        cout, cerr = p.communicate()
+        cout, cerr = p.communicate(input.encode() if input is not None else None)
 
         return '', cout.decode(), cerr.decode()
 
@@ -414,5 +1236,14 @@ class FakeRemote:
     def get_file(self, filename):
         return True, open(filename)
 
+    def iter_file(self, filename, lines=True, chunk_size=32768):
+        with open(filename, 'r' if lines else 'rb') as f:
+            if lines:
+                for line in f:
+                    yield line
+            else:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    yield chunk
+
     def get_os_type(self):
         return get_os_type(self)
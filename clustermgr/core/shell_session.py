@@ -0,0 +1,210 @@
+"""shell_session.py - long lived shell on a remote server.
+
+Commands to be run inside the Gluu container are wrapped in a nested ssh
+command by the Installer, so each of them pays a second SSH handshake on the
+server. ShellSession starts the nested ssh (or any other shell command) once
+and feeds commands to its shell through stdin. The end of the output of each
+command is marked with a sentinel line on stdout, which also carries the exit
+status, and on stderr, so that both streams are returned separately.
+"""
+
+import re
+import time
+import socket
+import uuid
+import base64
+import select
+
+from clustermgr.config import Config
+from clustermgr.core.remote import CommandResult, CommandTimeout
+from clustermgr.core.clustermgr_logging import remote_logger as logger
+
+
+class ShellSessionError(Exception):
+    """Raised when the shell of the session can't be used anymore, the
+    command was not sent to it."""
+    pass
+
+
+class ShellSessionExited(ShellSessionError):
+    """Raised when the shell exited after the command was sent to it, so
+    the command may have run partly or completely.
+
+    Attributes:
+        stdout (string): standard output received before the shell exited
+        stderr (string): standard error received before the shell exited
+    """
+
+    def __init__(self, message, stdout='', stderr=''):
+        super(ShellSessionExited, self).__init__(message)
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class ShellSession(object):
+    """Runs commands in a single shell started on the remote server.
+
+    Every command is run in a subshell with stdin from /dev/null, so working
+    directory, variables and input of one command don't leak into the next
+    one. The command text is processed the same way as it is when passed in
+    double quotes to the nested ssh command.
+
+    Args:
+        conn (:class:`clustermgr.core.remote.RemoteClient`): started client
+        shell_command (string): command starting the shell, e.g. the nested
+            ssh command running bash in the container
+    """
+
+    def __init__(self, conn, shell_command):
+        self.conn = conn
+        self.shell_command = shell_command
+        self.channel = None
+        self.token = uuid.uuid4().hex
+        self.counter = 0
+
+    @property
+    def active(self):
+        return self.channel is not None and not self.channel.closed
+
+    def start(self):
+        """Starts the shell and waits until it answers a first command.
+
+        Raises:
+            ShellSessionError: if the shell does not answer
+        """
+        logger.debug("[%s] Starting shell session: %s", self.conn.host,
+                        self.shell_command)
+        transport = self.conn.client.get_transport()
+        self.channel = transport.open_session(
+                                    timeout=Config.SHELL_SESSION_START_TIMEOUT)
+        self.channel.exec_command(self.shell_command)
+
+        result = self.run('true', timeout=Config.SHELL_SESSION_START_TIMEOUT)
+        if result.timed_out or result.exit_status != 0:
+            self.close()
+            raise ShellSessionError("Shell session did not start: {}".format(
+                                                            result.stderr))
+
+    def _frame(self, command, marker):
+        encoded = base64.b64encode(command.encode()).decode()
+        return (
+            "__cm_c=$(printf %s '{0}' | base64 -d) && "
+            "eval \"__cm_w=\\\"$__cm_c\\\"\" && "
+            "( eval \"$__cm_w\" ) </dev/null; "
+            "__cm_rc=$?; "
+            "printf '\\n{1}%d\\n' $__cm_rc; "
+            "printf '\\n{1}\\n' >&2\n"
+        ).format(encoded, marker)
+
+    def run(self, command, timeout=None):
+        """Runs command in the shell.
+
+        Args:
+            command (string): the command, as it would be written in double
+                quotes of the nested ssh command
+            timeout (float, optional): deadline in seconds, defaults to
+                command_timeout of the client. The session is closed when it
+                passes, since the shell is still busy with the command.
+
+        Returns:
+            :class:`clustermgr.core.remote.CommandResult`, or
+            :class:`clustermgr.core.remote.CommandTimeout`
+
+        Raises:
+            ShellSessionError: if the command could not be sent to the shell
+            ShellSessionExited: if the shell exited before the command ended
+        """
+        if not self.active:
+            raise ShellSessionError("Shell session is not active")
+
+        if timeout is None:
+            timeout = self.conn.command_timeout
+
+        self.counter += 1
+        marker = '__CM_{0}_{1}__'.format(self.token, self.counter)
+        stdout_end = re.compile(
+                    b'\n' + marker.encode() + b'(\\d+)\n')
+        stderr_end = b'\n' + marker.encode() + b'\n'
+
+        logger.debug("[%s] Running command in shell session %s",
+                        self.conn.host, command)
+        try:
+            self.channel.sendall(self._frame(command, marker).encode())
+        except (socket.error, EOFError) as e:
+            self.close()
+            raise ShellSessionError("Command could not be sent: {}".format(e))
+
+        deadline = time.time() + timeout if timeout else None
+        stdout = b''
+        stderr = b''
+        exit_status = None
+        stderr_done = False
+        scanned = 0
+        channel = self.channel
+
+        while exit_status is None or not stderr_done:
+            got = False
+            # nothing is received once the shell exited
+            while channel.recv_ready():
+                data = channel.recv(32768)
+                if not data:
+                    break
+                stdout += data
+                got = True
+            while channel.recv_stderr_ready():
+                data = channel.recv_stderr(32768)
+                if not data:
+                    break
+                stderr += data
+                got = True
+
+            if exit_status is None:
+                # only the end of stdout can contain a new sentinel
+                match = stdout_end.search(stdout, max(0, scanned - len(marker) - 32))
+                scanned = len(stdout)
+                if match:
+                    exit_status = int(match.group(1))
+                    stdout = stdout[:match.start()]
+            if not stderr_done and stderr_end in stderr:
+                stderr = stderr[:stderr.index(stderr_end)]
+                stderr_done = True
+
+            if got or (exit_status is not None and stderr_done):
+                continue
+
+            if channel.closed or channel.exit_status_ready():
+                self.close()
+                stderr = stderr.decode('utf-8', 'replace')
+                raise ShellSessionExited(
+                                "Shell session exited: {}".format(stderr),
+                                stdout.decode('utf-8', 'replace'), stderr)
+
+            wait = 0.5
+            if deadline:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logger.warning("[%s] Command in shell session exceeded "
+                                    "deadline of %s seconds: %s",
+                                    self.conn.host, timeout, command)
+                    self.close()
+                    return CommandTimeout(
+                                    stdout.decode('utf-8', 'replace'),
+                                    stderr.decode('utf-8', 'replace'))
+                wait = min(wait, remaining)
+
+            select.select([channel], [], [], wait)
+
+        return CommandResult(stdout.decode('utf-8', 'replace'),
+                             stderr.decode('utf-8', 'replace'),
+                             exit_status)
+
+    def close(self):
+        if getattr(self, 'channel', None) is not None:
+            try:
+                self.channel.close()
+            except Exception:
+                pass
+            self.channel = None
+
+    def __del__(self):
+        self.close()
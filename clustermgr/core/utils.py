@@ -274,15 +274,12 @@ def get_opendj_replication_status():
     #This command queries server for replication status
     cmd = ( 'OPENDJ_JAVA_HOME=/opt/jre '
             '/opt/opendj/bin/dsreplication status -n -X -h {} '
-            '-p 4444 -I admin -w $\'{}\'').format(
-                    primary_server.ip,
-                    app_conf.replication_pw)
+            '-p 4444 -I admin --adminPasswordFile "$admin_pw"').format(
+                    primary_server.ip)
 
-    print("Uploading cmd")
-    cmd_fn = os.path.join(installer.container, 'root/.cmd')
-    installer.put_file(cmd_fn, cmd)
-    stdin, stdout, stderr = installer.run('bash /root/.cmd')
-    installer.run('rm -f /root/.cmd')
+    print("Querying replication status")
+    stdin, stdout, stderr = installer.run_script(
+                        cmd, secrets={'admin_pw': app_conf.replication_pw})
 
     return True, stdout
 
@@ -304,7 +301,11 @@ def modify_etc_hosts(host_ip, old_hosts):
             'ipv6':{'::1':['ip6-localhost', 'ip6-loopback']},
             }
 
-    for l in old_hosts.split('\n'):
+    # old_hosts is either the content or an iterator of lines of the file
+    if isinstance(old_hosts, str):
+        old_hosts = old_hosts.split('\n')
+
+    for l in old_hosts:
         ls=l.strip()
         if ls:
             if not ls[0]=='#':
@@ -3,6 +3,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_mail import Mail
 from celery import Celery
+from celery.signals import task_prerun
 from flask_login import LoginManager
 
 
@@ -28,5 +29,11 @@ celery = Celery('clustermgr.application', backend=Config.CELERY_BROKER_URL,
                 broker=Config.CELERY_BROKER_URL
                 )
 
+
+@task_prerun.connect
+def buffer_task_logs(**kwargs):
+    wlogger.enable_buffering()
+
+
 login_manager = LoginManager()
 mailer = Mail()
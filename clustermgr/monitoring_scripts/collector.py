@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+# This script runs as gluu-monitoring service. It samples system and LDAP
+# statistics every few seconds and writes them to the local sqlite database
+# read by get_data.py, rollups and retention of the database are maintained
+# while it runs. Per second rates of counters are computed from consecutive
+# samples and written to rate tables next to the cumulative counters.
+
+import os
+import sys
+import time
+import base64
+import signal
+import sqlite3
+
+import psutil
+from ldap3 import Server, Connection, BASE
+from pyDes import triple_des, PAD_PKCS5
+
+from sqlite_monitoring_tables import data_dir, table_columns, \
+    create_tables, update_rollups, expire, load_settings, \
+    monitoring_tables, rate_tables
+
+
+attr_list = ["addRequests", "modifyRequests", "deleteRequests", "searchRequests"]
+
+sql_db_file = os.path.join(data_dir, 'gluu_monitoring.sqlite3')
+
+# old rows are deleted once in this many seconds
+expire_interval = 3600
+
+# seconds to wait before connecting to ldap again after it failed
+ldap_retry_interval = 60
+
+
+def get_ldap_admin_password():
+
+    """Retreives ldap directory manager password from gluu installation
+
+    Returns:
+        string: ldap directory manager password
+    """
+
+    salt_file = open('/opt/gluu-server/etc/gluu/conf/salt').read()
+    salt = salt_file.split('=')[1].strip()
+    ox_ldap_properties_file = '/opt/gluu-server/etc/gluu/conf/gluu-ldap.properties'
+    for l in open(ox_ldap_properties_file):
+        if l.startswith('bindPassword'):
+            s = l.split(':')[1].strip()
+            cipher = triple_des(salt)
+            decrypted = cipher.decrypt(base64.b64decode(s), padmode=PAD_PKCS5)
+            return decrypted
+
+
+class Collector(object):
+    """Samples statistics and writes a row of each table in one transaction
+    per tick.
+
+    Args:
+        con (:class:`sqlite3.Connection`): connection to the database
+        settings (dict): settings returned by load_settings()
+    """
+
+    def __init__(self, con, settings):
+        self.con = con
+        self.settings = settings
+        self.ldap_conn = None
+        self.ldap_retry_at = 0
+        self.last_expire = 0
+
+        # time and values of counters of the previous tick, by table
+        self.last_counters = {}
+
+        # partitions and interfaces are columns of the tables, which were
+        # created when monitoring was installed
+        self.columns = {}
+        for t in monitoring_tables:
+            self.columns[t] = [ c for c, f_type in table_columns(con, t) ]
+
+        # cpu usage is computed from the cpu times of the previous call,
+        # instead of blocking to measure it
+        psutil.cpu_percent(interval=None)
+
+    def ldap_stats(self):
+        """Returns LDAP operation counters, the connection is kept open
+        between ticks.
+        """
+        if self.ldap_conn is None:
+            if time.time() < self.ldap_retry_at:
+                return None
+            try:
+                server = Server("localhost:1636", use_ssl=True)
+                conn = Connection(server, user='cn=directory manager',
+                                  password=get_ldap_admin_password())
+                if not conn.bind():
+                    raise ValueError(conn.result.get('description'))
+            except Exception as e:
+                print("Can't connect to ldap server: {0}".format(e))
+                self.ldap_retry_at = time.time() + ldap_retry_interval
+                return None
+            self.ldap_conn = conn
+
+        try:
+            self.ldap_conn.search(
+                search_base="cn=LDAPS Connection Handler 0.0.0.0 port 1636 Statistics,cn=monitor",
+                search_filter='(objectClass=*)',
+                search_scope=BASE,
+                attributes=attr_list,
+                )
+            resp = self.ldap_conn.response
+        except Exception as e:
+            print("Can't query ldap server: {0}".format(e))
+            self.close()
+            return None
+
+        if resp:
+            return [ int(resp[0]['raw_attributes'][a][0]) for a in attr_list ]
+
+    def sample(self):
+        """Returns map of table to values of its columns"""
+        cpu_times = psutil.cpu_times()
+        rows = {
+            'cpu_info': [float(cpu_times.system), float(cpu_times.user),
+                         float(cpu_times.nice), float(cpu_times.idle),
+                         float(cpu_times.iowait), float(cpu_times.irq),
+                         float(cpu_times.softirq), float(cpu_times.steal),
+                         float(cpu_times.guest)],
+            'cpu_percent': [float(psutil.cpu_percent(interval=None))],
+            'load_average': [os.getloadavg()[0]],
+            'mem_usage': [psutil.virtual_memory().percent],
+            }
+
+        mountpoints = {}
+        for di in psutil.disk_partitions():
+            mountpoints.setdefault(di.device, di.mountpoint)
+        rows['disk_usage'] = []
+        for d in self.columns['disk_usage']:
+            mp = mountpoints.get(d.replace('_', '/'))
+            rows['disk_usage'].append(
+                        float(psutil.disk_usage(mp).percent) if mp else 0.0)
+
+        net = psutil.net_io_counters(pernic=True)
+        rows['net_io'] = []
+        for c in self.columns['net_io']:
+            nif, counter = c.rsplit('_bytes_', 1)
+            rows['net_io'].append(
+                    getattr(net[nif], 'bytes_' + counter) if nif in net else 0)
+
+        ldap_stats = self.ldap_stats()
+        if ldap_stats:
+            rows['ldap_mon'] = ldap_stats
+
+        return rows
+
+    def rates(self, now, rows):
+        """Returns rows of rate tables, the per second increase of counters
+        since the previous tick. A counter that decreased was reset, its rate
+        is NULL for the tick.
+        """
+        rate_rows = {}
+        for table, counter_table in rate_tables.items():
+            if counter_table not in rows:
+                # counters were not sampled, e.g. ldap is down, the next
+                # rate is computed from the tick after the next sample
+                self.last_counters.pop(counter_table, None)
+                continue
+            counters = dict(zip(self.columns[counter_table], rows[counter_table]))
+            last = self.last_counters.get(counter_table)
+            self.last_counters[counter_table] = (now, counters)
+            if last is None or now <= last[0]:
+                continue
+
+            last_time, last_values = last
+            values = []
+            for c in self.columns[table]:
+                current, previous = counters.get(c), last_values.get(c)
+                if current is None or previous is None or current < previous:
+                    values.append(None)
+                else:
+                    values.append((current - previous) / float(now - last_time))
+            rate_rows[table] = values
+        return rate_rows
+
+    def insert(self, now, rows):
+        """Writes rows of a tick in one transaction"""
+        with self.con:
+            for table, values in rows.items():
+                columns = self.columns[table]
+                # statements are prepared once and cached by sqlite3
+                self.con.execute(
+                    'INSERT INTO `{0}` (time, {1}) VALUES ({2})'.format(
+                        table,
+                        ', '.join('`{0}`'.format(c) for c in columns),
+                        ', '.join('?' * (len(columns) + 1))),
+                    [now] + values)
+
+    def tick(self):
+        now = int(time.time())
+        rows = self.sample()
+        rows.update(self.rates(now, rows))
+        self.insert(now, rows)
+        update_rollups(self.con)
+        if now - self.last_expire >= expire_interval:
+            expire(self.con, now, self.settings['retention'])
+            self.last_expire = now
+
+    def run(self):
+        """Ticks every interval seconds until the process is terminated"""
+        interval = self.settings['interval']
+        next_tick = time.time()
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                # the sample of this tick is lost, the service keeps running
+                print("Can't collect monitoring data: {0}".format(e))
+            # ticks stay on schedule however long sampling took
+            next_tick += interval
+            delay = next_tick - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.time()
+
+    def close(self):
+        if self.ldap_conn is not None:
+            try:
+                self.ldap_conn.unbind()
+            except Exception:
+                pass
+            self.ldap_conn = None
+
+
+def stop(signum, frame):
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    sql_con = sqlite3.connect(sql_db_file)
+    # tables, indexes and rollups are created on nodes installed by earlier
+    # versions too
+    create_tables(sql_con)
+    sql_con.execute('PRAGMA synchronous=NORMAL')
+
+    collector = Collector(sql_con, load_settings())
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        collector.run()
+    finally:
+        collector.close()
+        sql_con.close()
@@ -6,10 +6,15 @@ import os
 import re
 import json
 import sys
+import zlib
+import base64
 import sqlite3
 
 data_dir = '/var/monitoring'
 
+# rollup tables of sqlite_monitoring_tables.py, coarsest first
+rollups = ('1h', '1m')
+
 def get_sqlite_stats(measurement):
     start=0
     if len(sys.argv) > 3:
@@ -29,9 +34,71 @@ def get_age():
     uptime = int(time.time() - psutil.boot_time())
     print(json.dumps({'data':{'uptime': uptime}}))
 
+
+def get_rows(cur, tables, measurement, start):
+    """Returns fields and rows of a measurement newer than start. Periods
+    older than the raw rows kept are filled from rollup tables, coarsest
+    first.
+    """
+    cur.execute('SELECT * FROM `{0}` WHERE time > ? ORDER BY time'.format(
+                                            measurement), (start,))
+    rows = cur.fetchall()
+    fields = [ d[0] for d in cur.description ]
+
+    # rollups are used only for periods raw rows were expired for
+    end = cur.execute('SELECT MIN(time) FROM `{0}`'.format(
+                                            measurement)).fetchone()[0]
+    backfill = []
+    for suffix in reversed(rollups):
+        rollup = '{0}_{1}'.format(measurement, suffix)
+        if not rollup in tables:
+            continue
+        if end is None:
+            cur.execute('SELECT * FROM `{0}` WHERE time > ? ORDER BY time'.format(
+                                            rollup), (start,))
+        else:
+            cur.execute('SELECT * FROM `{0}` WHERE time > ? AND time < ? '
+                        'ORDER BY time'.format(rollup), (start, end))
+        result = cur.fetchall()
+        if result:
+            backfill = result + backfill
+            end = result[0][0]
+
+    return fields, backfill + rows
+
+
+def export_stats():
+    """Reads a map of measurement to high watermark as json from stdin and
+    prints rows newer than the watermark of all measurements, and uptime, as
+    one line of base64 encoded zlib compressed json. Rows are columnar:
+    {'uptime': <uptime>,
+     'stats': {<measurement>: {'fields': [..], 'columns': [[..], ..]}}}
+    """
+    watermarks = json.loads(sys.stdin.read() or '{}')
+    stats = {}
+    db_file = os.path.join(data_dir, 'gluu_monitoring.sqlite3')
+    with sqlite3.connect(db_file) as con:
+        cur = con.cursor()
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        tables = [ t[0] for t in cur.fetchall() ]
+        for measurement, start in watermarks.items():
+            if not measurement in tables:
+                continue
+            fields, rows = get_rows(cur, tables, measurement, float(start or 0))
+            stats[measurement] = {
+                    'fields': fields,
+                    'columns': [ list(c) for c in zip(*rows) ],
+                    }
+
+    data = {'uptime': int(time.time() - psutil.boot_time()), 'stats': stats}
+    payload = zlib.compress(json.dumps(data, separators=(',', ':')).encode(), 9)
+    print(base64.b64encode(payload).decode())
+
 if len(sys.argv) > 1:
     if sys.argv[1]=='age':
         get_age()
+    if sys.argv[1]=='export':
+        export_stats()
     if sys.argv[1]=='stats':
         if len(sys.argv) > 2:
             measurement = sys.argv[2]
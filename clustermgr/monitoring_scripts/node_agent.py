@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+# This script is started by cluster manager on a single SSH channel. It reads
+# requests from standart input and writes responses to standart output, one
+# json document per line:
+#
+#   {"id": 1, "op": "port", "params": {"host": "localhost", "port": 1636}}
+#   {"id": 1, "ok": true, "result": 0}
+#
+# Only standart library is used, so that the script can also be started
+# inline when it was not deployed to the server.
+
+import os
+import sys
+import ssl
+import json
+import socket
+import sqlite3
+import hashlib
+import subprocess
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+
+data_dir = '/var/monitoring'
+
+
+def op_ping():
+    return 'pong'
+
+
+def op_port(host, port, timeout=2.0):
+    # result is the same as connect_ex(), 0 means port is open
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        return sock.connect_ex((host, int(port)))
+    except socket.error as e:
+        return e.errno or -1
+    finally:
+        sock.close()
+
+
+def op_http(url, timeout=10.0, max_body=65536):
+    context = ssl._create_unverified_context()
+    try:
+        response = urllib.request.urlopen(url, timeout=timeout, context=context)
+        status = response.getcode()
+    except urllib.request.HTTPError as e:
+        response = e
+        status = e.code
+
+    body = response.read(max_body)
+    return {'status': status, 'body': body.decode('utf-8', 'replace')}
+
+
+def op_stat(paths):
+    result = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+            result[path] = {
+                'exists': True,
+                'size': st.st_size,
+                'mtime': st.st_mtime,
+                'mode': st.st_mode,
+                'isdir': os.path.isdir(path),
+            }
+        except OSError:
+            result[path] = {'exists': False}
+    return result
+
+
+def op_hash(path, algorithm='sha256'):
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1048576), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def op_metrics(measurement, start=0):
+    db_file = os.path.join(data_dir, 'gluu_monitoring.sqlite3')
+    with sqlite3.connect(db_file) as con:
+        cur = con.cursor()
+        cur.execute('SELECT * FROM `{0}` WHERE time > ?'.format(measurement),
+                    (start,))
+        data = cur.fetchall()
+        fields = [d[0] for d in cur.description]
+    return {'fields': fields, 'data': data}
+
+
+def op_uptime():
+    with open('/proc/uptime') as f:
+        return int(float(f.read().split()[0]))
+
+
+def op_service(name):
+    p = subprocess.Popen(['systemctl', 'is-active', name],
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    return out.decode().strip()
+
+
+def op_batch(requests):
+    # requests of a batch are run concurrently, e.g. all health checks of
+    # a server are answered in the time of the slowest one
+    if not requests:
+        return []
+    workers = min(len(requests), 16)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(handle_request, requests))
+
+
+operations = {
+    'ping': op_ping,
+    'batch': op_batch,
+    'port': op_port,
+    'http': op_http,
+    'stat': op_stat,
+    'hash': op_hash,
+    'metrics': op_metrics,
+    'uptime': op_uptime,
+    'service': op_service,
+}
+
+
+def handle_request(request):
+    response = {'id': request.get('id')}
+    operation = operations.get(request.get('op'))
+
+    if not operation:
+        response['ok'] = False
+        response['error'] = 'unknown operation {}'.format(request.get('op'))
+        return response
+
+    try:
+        response['result'] = operation(**request.get('params', {}))
+        response['ok'] = True
+    except Exception as e:
+        response['ok'] = False
+        response['error'] = '{}: {}'.format(e.__class__.__name__, e)
+
+    return response
+
+
+def handle(line):
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        return {'id': None, 'ok': False, 'error': 'bad request: {}'.format(e)}
+
+    return handle_request(request)
+
+
+def main():
+    # agent exits when manager closes the channel
+    for line in iter(sys.stdin.readline, ''):
+        if not line.strip():
+            continue
+        sys.stdout.write(json.dumps(handle(line)) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
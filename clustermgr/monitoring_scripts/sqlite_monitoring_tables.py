@@ -4,9 +4,22 @@
 data_dir = '/var/monitoring'
 import sqlite3
 import os
+import json
 import psutil
 import time
 
+# settings written by the manager when monitoring is installed
+settings_file = os.path.join(data_dir, 'settings.json')
+
+# seconds rows of raw and rollup tables are kept, unless set in settings_file
+default_retention = {'raw': 7 * 86400, '1m': 30 * 86400, '1h': 400 * 86400}
+
+# seconds between samples of collector.py, unless set in settings_file
+default_interval = 15
+
+# rollup tables, <table>_<suffix>, hold one row per period of raw rows
+rollups = (('1m', 60), ('1h', 3600))
+
 disks = psutil.disk_partitions()
 disk_parts = []
 for d in disks:
@@ -42,10 +55,21 @@ monitoring_tables = {
     'net_io': net_fields,
 
     'gluu_auth': ['success', 'failure'],
-    
+
+    'ldap_mon_rate': ['addRequests', 'modifyRequests', 'deleteRequests', 'searchRequests'],
+
+    'net_io_rate': net_fields,
 
     }
 
+# tables of ever increasing counters, their rollups keep the last value of a
+# period instead of the average
+counter_tables = ['cpu_info', 'ldap_mon', 'net_io', 'gluu_auth']
+
+# tables of per second rates of counter tables, computed by collector.py from
+# the counters of consecutive samples
+rate_tables = {'ldap_mon_rate': 'ldap_mon', 'net_io_rate': 'net_io'}
+
 text_fields = []
 real_fields = ['cpu_percent', 'load_avg', 'mem_usage', 'system', 'user', 'nice', 'idle',
                  'iowait', 'irq', 'softirq', 'steal',
@@ -53,6 +77,98 @@ real_fields = ['cpu_percent', 'load_avg', 'mem_usage', 'system', 'user', 'nice',
 for d in disks:
     real_fields.append(d.device.replace('/','_'))
 
+def load_settings():
+    """Returns settings of the monitoring store, defaults are used for
+    settings missing in settings_file
+    """
+    settings = {}
+    if os.path.exists(settings_file):
+        with open(settings_file) as f:
+            settings = json.load(f)
+    retention = dict(default_retention)
+    retention.update(settings.get('retention', {}))
+    # an hour of raw rows is needed to roll up the current hour
+    retention['raw'] = max(int(retention['raw']), 3600)
+    interval = max(float(settings.get('interval') or default_interval), 1)
+    return {'retention': retention, 'interval': interval}
+
+
+def table_columns(con, table):
+    """Returns columns of a table other than time, with their types"""
+    return [ (c[1], c[2]) for c in con.execute(
+                        'PRAGMA table_info(`{0}`)'.format(table)).fetchall()
+                        if c[1] != 'time' ]
+
+
+def create_tables(con):
+    """Creates tables, their time indexes and rollup tables if they don't
+    exist, and switches the database to write-ahead logging so that reads of
+    get_data.py don't block the collector
+    """
+    con.execute('PRAGMA journal_mode=WAL')
+    cur = con.cursor()
+    for t in monitoring_tables:
+        columns_l=['`time` INTEGER ']
+        for c in monitoring_tables[t]:
+            if c in text_fields:
+                f_type = 'TEXT'
+            elif c in real_fields or t in rate_tables:
+                f_type = 'REAL'
+            else:
+                f_type = 'INTEGER'
+            tmp = '`{0}` {1}'.format(c, f_type)
+            columns_l.append(tmp)
+        columns = ', '.join(columns_l)
+        cmd = 'CREATE TABLE IF NOT EXISTS `{0}` ({1})'.format(t, columns)
+        cur.execute(cmd)
+        cur.execute('CREATE INDEX IF NOT EXISTS `{0}_time` ON `{0}` (time)'.format(t))
+
+        # rollups have columns of the existing table, which may be created
+        # by an earlier version of this script
+        columns = ', '.join(['`time` INTEGER PRIMARY KEY'] + [
+                    '`{0}` {1}'.format(c, f_type)
+                    for c, f_type in table_columns(con, t)])
+        for suffix, seconds in rollups:
+            cur.execute('CREATE TABLE IF NOT EXISTS `{0}_{1}` ({2})'.format(
+                                                        t, suffix, columns))
+    con.commit()
+
+
+def update_rollups(con):
+    """Rolls up raw rows written since the last update. The last period of
+    each rollup may have been partial, so it is computed again.
+    """
+    for t in monitoring_tables:
+        columns = [ c for c, f_type in table_columns(con, t) ]
+        aggr = 'MAX' if t in counter_tables else 'AVG'
+        for suffix, seconds in rollups:
+            rollup = '{0}_{1}'.format(t, suffix)
+            last = con.execute(
+                        'SELECT MAX(time) FROM `{0}`'.format(rollup)).fetchone()[0]
+            con.execute(
+                'INSERT OR REPLACE INTO `{0}` (time, {1}) '
+                'SELECT time / {2} * {2} AS period, {3} FROM `{4}` '
+                'WHERE time >= ? GROUP BY period'.format(
+                    rollup,
+                    ', '.join('`{0}`'.format(c) for c in columns),
+                    seconds,
+                    ', '.join('{0}(`{1}`)'.format(aggr, c) for c in columns),
+                    t),
+                (last or 0,))
+    con.commit()
+
+
+def expire(con, now, retention):
+    """Deletes rows of raw and rollup tables older than their retention"""
+    for t in monitoring_tables:
+        con.execute('DELETE FROM `{0}` WHERE time < ?'.format(t),
+                    (now - retention['raw'],))
+        for suffix, seconds in rollups:
+            con.execute('DELETE FROM `{0}_{1}` WHERE time < ?'.format(t, suffix),
+                        (now - retention[suffix],))
+    con.commit()
+
+
 if __name__ == '__main__':
 
     if not os.path.exists(data_dir):
@@ -61,18 +177,4 @@ if __name__ == '__main__':
     db_file = os.path.join(data_dir, 'gluu_monitoring.sqlite3')
 
     with sqlite3.connect(db_file) as con:
-        cur = con.cursor()
-        for t in monitoring_tables:
-            columns_l=['`time` INTEGER ']
-            for c in monitoring_tables[t]:
-                if c in text_fields:
-                    f_type = 'TEXT'
-                elif c in real_fields:
-                    f_type = 'REAL'
-                else:
-                    f_type = 'INTEGER'
-                tmp = '`{0}` {1}'.format(c, f_type)
-                columns_l.append(tmp)
-            columns = ', '.join(columns_l)
-            cmd = 'CREATE TABLE IF NOT EXISTS `{0}` ({1})'.format(t, columns)
-            cur.execute(cmd)
+        create_tables(con)
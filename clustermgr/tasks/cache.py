@@ -11,6 +11,8 @@ from clustermgr.core.utils import parse_setup_properties, \
         get_redis_config, get_cache_servers
 
 from clustermgr.core.clustermgr_installer import Installer
+from clustermgr.core.desired_config import ConfigFile, CHANGED
+from clustermgr.core import desired_config
 
 from ldap3.core.exceptions import LDAPSocketOpenError
 from flask import current_app as app
@@ -51,8 +53,12 @@ def install_stunnel(installer, app_conf, is_cache):
         remote_service_file = '/lib/systemd/system/stunnel.service'
         wlogger.log(installer.logger_task_id, "Uploading systemd file", "info",
                 server_id=installer.server_id)
-        installer.upload_file(local_service_file, remote_service_file)
+        with open(local_service_file) as f:
+            service_file = ConfigFile(remote_service_file, content=f.read())
+        status = desired_config.apply(installer, [service_file])
         installer.run("mkdir -p /var/log/stunnel4", inside=False)
+        if status[remote_service_file] == CHANGED:
+            installer.run("systemctl daemon-reload", inside=False)
 
     if installer.clone_type == 'deb':
         wlogger.log(installer.logger_task_id, "Enabling stunnel", "debug", server_id=installer.server_id)
@@ -61,6 +67,10 @@ def install_stunnel(installer, app_conf, is_cache):
     stunnel_pem_fn = '/etc/stunnel/redis-server.pem'
     stunnel_pem_local_fn = '/tmp/{}.pem'.format(primary_cache_server.ip.replace('.','_'))
 
+    # stunnel is restarted only if its certificate or configuration changed
+    config_files = []
+    pem_created = False
+
     if installer.ip == primary_cache_server.ip:
         if not installer.conn.exists(stunnel_pem_fn):
             r = installer.run('which openssl', inside=False)
@@ -82,6 +92,7 @@ def install_stunnel(installer, app_conf, is_cache):
             installer.run('cat /etc/stunnel/redis-server.key /etc/stunnel/redis-server.crt > {}'.format(stunnel_pem_fn), inside=False)
             installer.run('chmod 600 /etc/stunnel/redis-server.key',inside=False)
             installer.run('chmod 600 '+stunnel_pem_fn, inside=False)
+            pem_created = True
         
         # retreive stunnel certificate
         wlogger.log(installer.logger_task_id, "Retreiving server certificate", "info",
@@ -91,8 +102,9 @@ def install_stunnel(installer, app_conf, is_cache):
     else:
         wlogger.log(installer.logger_task_id, "Uploading server certificate", "info",
                             server_id=installer.server_id)
-        installer.upload_file(stunnel_pem_local_fn, stunnel_pem_fn)
-        installer.run('chmod 600 '+stunnel_pem_fn, inside=False)
+        with open(stunnel_pem_local_fn) as f:
+            config_files.append(ConfigFile(stunnel_pem_fn, content=f.read(),
+                                           mode='600'))
  
     if is_cache:
         stunnel_redis_conf = (
@@ -115,20 +127,16 @@ def install_stunnel(installer, app_conf, is_cache):
     wlogger.log(installer.logger_task_id, "Writing redis stunnel configurations", "info",
                         server_id=installer.server_id)
 
-    installer.put_file('/etc/stunnel/stunnel.conf', stunnel_redis_conf)
-    
-    if installer.clone_type == 'rpm':
-        local = os.path.join(app.root_path, 'templates', 'stunnel',
-                             'stunnel.service')
-        remote = '/lib/systemd/system/stunnel.service'
-        wlogger.log(installer.logger_task_id, "Uploading systemd file", "info",
-                    server_id=installer.server_id)
-        installer.upload_file(local, remote)
-        installer.run("mkdir -p /var/log/stunnel4", inside=False)
-        installer.run("systemctl daemon-reload", inside=False)        
+    config_files.append(ConfigFile('/etc/stunnel/stunnel.conf',
+                                   content=stunnel_redis_conf))
+    status = desired_config.apply(installer, config_files, restart=False)
 
     installer.enable_service(stunnel_package, inside=False)
-    installer.restart_service(stunnel_package, inside=False)
+
+    if pem_created or CHANGED in status.values():
+        installer.restart_service(stunnel_package, inside=False)
+    else:
+        installer.start_service(stunnel_package, inside=False)
 
     return True
 
@@ -197,9 +205,8 @@ def install_cache_cluster(self, servers_id_list, cache_servers_id_list):
                     )
 
         redis_config_file = '/etc/redis/redis.conf' if installer.clone_type == 'deb' else '/etc/redis.conf'
-        redis_config = installer.get_file(redis_config_file)
 
-        if redis_config:
+        def set_requirepass(redis_config):
             redis_config = redis_config.split('\n')
             for i, l in enumerate(redis_config[:]):
                 if l.startswith('requirepass'):
@@ -215,12 +222,15 @@ def install_cache_cluster(self, servers_id_list, cache_servers_id_list):
             else:
                 if server.redis_password:
                     redis_config.append('requirepass ' + server.redis_password)
-            filecontent = '\n'.join(redis_config)
-
-            installer.put_file(redis_config_file, filecontent)
+            return '\n'.join(redis_config)
 
+        # redis is restarted only if the password changed
         installer.enable_service(redis_package, inside=False)
-        installer.restart_service(redis_package, inside=False)
+        status = desired_config.apply(installer, [
+                    ConfigFile(redis_config_file, edit=set_requirepass,
+                               services=[redis_package])])
+        if status[redis_config_file] != CHANGED:
+            installer.start_service(redis_package, inside=False)
 
         si_result = install_stunnel(installer, app_conf, is_cache=True)
 
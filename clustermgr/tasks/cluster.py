@@ -18,6 +18,10 @@ from clustermgr.core.remote import RemoteClient
 from clustermgr.core.ldap_functions import LdapOLC, getLdapConn
 from clustermgr.core.utils import modify_etc_hosts, make_nginx_proxy_conf    
 from clustermgr.core.clustermgr_installer import Installer
+from clustermgr.core import host_facts
+from clustermgr.core import desired_config
+from clustermgr.core.desired_config import ConfigFile, CHANGED, UNCHANGED, \
+    FAILED
 from clustermgr.config import Config
 from clustermgr.version import __version__
 
@@ -34,73 +38,58 @@ def modifyOxLdapProperties(server, installer, task_id, pDict):
         chroot (string): root of container
     """
 
-    # get ox-ldap.properties file from server
-    remote_file = os.path.join(installer.container, 'etc/gluu/conf/gluu-ldap.properties')
-    result = installer.get_file(remote_file)
-
-    state = True
-
     # iterate ox-ldap.properties file and modify "servers" entry
-    if result:
-        file_content = ''
-        for line in result.split('\n'):
+    def set_servers(content):
+        lines = content.split('\n')
+        for i, line in enumerate(lines):
             if line.startswith('servers:'):
-                line = 'servers: {0}'.format( pDict[server.hostname] )
-            file_content += line+'\n'
+                lines[i] = 'servers: {0}'.format( pDict[server.hostname] )
+        return '\n'.join(lines)
+
+    ldap_server_list = [ 'ldaps://'+ldap_server for ldap_server in pDict[server.hostname].split(',') ]
+    server_list_string = ' '.join(ldap_server_list)
+
+    # iterate ldap.properties file and modify idp.authn.LDAP.ldapURL entry
+    def set_ldap_url(content):
+        fc = ''
+        for l in content.splitlines(True):
+            if l.startswith('idp.authn.LDAP.ldapURL'):
+                l = 'idp.authn.LDAP.ldapURL                          = {}\n'.format( server_list_string )
+            fc += l
+        return fc
+
+    # both files are checked in one round trip and written only if they
+    # differ
+    remote_file = os.path.join(installer.container, 'etc/gluu/conf/gluu-ldap.properties')
+    shib_remote_file = os.path.join(installer.container, 'opt/shibboleth-idp/conf/ldap.properties')
 
-        result = installer.put_file(remote_file,file_content)
+    status = desired_config.apply(installer, [
+                ConfigFile(remote_file, edit=set_servers),
+                ConfigFile(shib_remote_file, edit=set_ldap_url),
+                ])
 
-        if result:
-            wlogger.log(task_id,
-                'ox-ldap.properties file on {0} modified to include '
-                'all replicating servers'.format(server.hostname),
-                'success')
-        else:
-            state = False
+    if status[remote_file] in (CHANGED, UNCHANGED):
+        wlogger.log(task_id,
+            'ox-ldap.properties file on {0} modified to include '
+            'all replicating servers'.format(server.hostname),
+            'success')
     else:
-        state = False
-
-    if not state:
         wlogger.log(task_id,
                 'ox-ldap.properties file on {0} was not modified to '
                 'include all replicating servers.'.format(server.hostname),
                 'warning')
 
-    # Modify Shib ldap.properties to include all ldap properties
-    remote_file = os.path.join(installer.container, 'opt/shibboleth-idp/conf/ldap.properties')
-    
-    if installer.conn.exists(remote_file):
-    
-        shib_ldap = installer.get_file(remote_file)
-
-        temp = None
-
-        if shib_ldap:
-             
-            ldap_server_list = [ 'ldaps://'+ldap_server for ldap_server in pDict[server.hostname].split(',') ]
-            server_list_string = ' '.join(ldap_server_list)
-
-            # iterate ldap.properties file and modify idp.authn.LDAP.ldapURL entry
-
-            fc = ''
-            for l in shib_ldap:
-                if l.startswith('idp.authn.LDAP.ldapURL'):
-                    l = 'idp.authn.LDAP.ldapURL                          = {}\n'.format( server_list_string )
-                fc += l
-
-            r = installer.put_file(remote_file,fc)
-
-            if r:
-                wlogger.log(task_id,
-                    '/opt/shibboleth-idp/conf/ldap.properties file on {0} modified to include '
-                    'all replicating servers'.format(server.hostname),
-                    'success')
-            else:
-
-                wlogger.log(task_id,
-                    '/opt/shibboleth-idp/conf/ldap.propertiess file on {0} was not modified to '
-                    'include all replicating servers: {1}'.format(server.hostname, r[1]),
-                    'warning')
+    # Shib ldap.properties exists only if Shibboleth is installed
+    if status[shib_remote_file] in (CHANGED, UNCHANGED):
+        wlogger.log(task_id,
+            '/opt/shibboleth-idp/conf/ldap.properties file on {0} modified to include '
+            'all replicating servers'.format(server.hostname),
+            'success')
+    elif status[shib_remote_file] == FAILED:
+        wlogger.log(task_id,
+            '/opt/shibboleth-idp/conf/ldap.propertiess file on {0} was not modified to '
+            'include all replicating servers'.format(server.hostname),
+            'warning')
 
 
 
@@ -437,15 +426,16 @@ def modify_hosts(installer, hosts, inside=True, server_host=None):
     wlogger.log(installer.logger_task_id, "Modifying /etc/hosts", server_id=installer.server_id)
     chroot = installer.container if inside else '/'
     hosts_file = os.path.join(chroot,'etc/hosts')
-    
-    old_hosts = installer.get_file(hosts_file)
-    
-    print("OLD hosts", old_hosts)
-    
-    if old_hosts:
-        new_hosts = modify_etc_hosts(hosts, old_hosts)
-        installer.put_file(hosts_file, new_hosts)
+
+    status = desired_config.apply(installer, [
+                ConfigFile(hosts_file,
+                           edit=lambda old_hosts: modify_etc_hosts(hosts, old_hosts))
+                ])
+
+    if status[hosts_file] == CHANGED:
         wlogger.log(installer.logger_task_id, "{} was modified".format(hosts_file), 'success', server_id=installer.server_id)
+    elif status[hosts_file] == UNCHANGED:
+        wlogger.log(installer.logger_task_id, "{} is up to date".format(hosts_file), 'success', server_id=installer.server_id)
 
 
 
@@ -469,15 +459,11 @@ def do_disable_replication(task_id, server, primary_server, app_conf):
 
     cmd = ( 'OPENDJ_JAVA_HOME=/opt/jre '
             '/opt/opendj/bin/dsreplication disable --disableAll --port 4444 '
-            '--hostname {} --adminUID admin --adminPassword $\'{}\' '
-            '--trustAll --no-prompt').format(
-                            server.hostname,
-                            app_conf.replication_pw)
+            '--hostname {} --adminUID admin --adminPasswordFile "$admin_pw" '
+            '--trustAll --no-prompt').format(server.hostname)
 
-    cmd_fn = os.path.join(installer.container, 'root/.cmd')
-    installer.put_file(cmd_fn, cmd)
-    installer.run('bash /root/.cmd', error_exception='no base DNs replicated')
-    installer.run('rm -f /root/.cmd')
+    installer.run_script(cmd, error_exception='no base DNs replicated',
+                         secrets={'admin_pw': app_conf.replication_pw})
 
     server.mmr = False
     db.session.commit()
@@ -488,14 +474,11 @@ def do_disable_replication(task_id, server, primary_server, app_conf):
 
     cmd = ( 'OPENDJ_JAVA_HOME=/opt/jre '
             '/opt/opendj/bin/dsreplication status -n -X -h {} '
-            '-p 4444 -I admin -w $\'{}\'').format(
-                    primary_server.hostname,
-                    app_conf.replication_pw)
+            '-p 4444 -I admin --adminPasswordFile "$admin_pw"').format(
+                    primary_server.hostname)
 
-    cmd_fn = os.path.join(installer.container, 'root/.cmd')
-    installer.put_file(cmd_fn, cmd)
-    installer.run('bash /root/.cmd', error_exception='no base DNs replicated')
-    installer.run('rm -f /root/.cmd')
+    installer.run_script(cmd, error_exception='no base DNs replicated',
+                         secrets={'admin_pw': app_conf.replication_pw})
 
     return True
 
@@ -519,6 +502,7 @@ def remove_server_from_cluster(self, server_id, remove_server=False,
     task_id = self.request.id
 
     removed_server_hostname = server.hostname
+    host_facts.invalidate(removed_server_hostname)
 
     remove_filesystem_replication_do(server, app_conf, task_id)
 
@@ -689,29 +673,28 @@ def opendjenablereplication(self, server_id):
             
             for base in ['gluu', 'site']:
 
+                # passwords are passed as files, the logged command has
+                # only their paths
                 cmd = ( "OPENDJ_JAVA_HOME=/opt/jre "
                         "/opt/opendj/bin/dsreplication enable --host1 {} --port1 4444 "
-                        "--bindDN1 'cn=directory manager' --bindPassword1 $'{}' "
+                        "--bindDN1 'cn=directory manager' --bindPasswordFile1 \"$bind_pw1\" "
                         "--replicationPort1 8989 --host2 {} --port2 4444 --bindDN2 "
-                        "'cn=directory manager' --bindPassword2 $'{}' "
-                        "--replicationPort2 8989 --adminUID admin --adminPassword $'{}' "
+                        "'cn=directory manager' --bindPasswordFile2 \"$bind_pw2\" "
+                        "--replicationPort2 8989 --adminUID admin --adminPasswordFile \"$admin_pw\" "
                         "--baseDN 'o={}' --trustAll -X -n").format(
                             primary_server.hostname,
-                            primary_server.ldap_password,
                             server.hostname,
-                            server.ldap_password,
-                            app_conf.replication_pw,
                             base,
                             )
             
                 wlogger.log(task_id, "Enabling replication on server {} for {}".format(
                                                             server.hostname, base))
 
-                cmd_fn = os.path.join(installer.container, 'root/.cmd')
-                installer.put_file(cmd_fn, cmd)
                 wlogger.log(task_id, "Executing command: " + cmd)
-                installer.run('bash /root/.cmd', error_exception='no base DNs available to enable replication')
-                installer.run('rm -f /root/.cmd')
+                installer.run_script(cmd, error_exception='no base DNs available to enable replication',
+                                     secrets={'bind_pw1': primary_server.ldap_password,
+                                              'bind_pw2': server.ldap_password,
+                                              'admin_pw': app_conf.replication_pw})
 
 
             if not primary_server_secured:
@@ -721,15 +704,13 @@ def opendjenablereplication(self, server_id):
 
                 cmd = ( "OPENDJ_JAVA_HOME=/opt/jre "
                         "/opt/opendj/bin/dsconfig -h {} -p 4444 "
-                        " -D  'cn=Directory Manager' -w $'{}' --trustAll "
+                        " -D  'cn=Directory Manager' --bindPasswordFile \"$bind_pw\" --trustAll "
                         "-n set-crypto-manager-prop --set ssl-encryption:true"
-                        ).format(primary_server.ip, primary_server.ldap_password)
+                        ).format(primary_server.ip)
 
-                cmd_fn = os.path.join(installer.container, 'root/.cmd')
-                installer.put_file(cmd_fn, cmd)
                 wlogger.log(task_id, "Executing command: " + cmd)
-                installer.run('bash /root/.cmd', error_exception='no base DNs available to enable replication')
-                installer.run('rm -f /root/.cmd')
+                installer.run_script(cmd, error_exception='no base DNs available to enable replication',
+                                     secrets={'bind_pw': primary_server.ldap_password})
                 
                 primary_server_secured = True
                 primary_server.mmr = True
@@ -738,15 +719,13 @@ def opendjenablereplication(self, server_id):
                                                             server.hostname))
             cmd = ( "OPENDJ_JAVA_HOME=/opt/jre "
                     "/opt/opendj/bin/dsconfig -h {} -p 4444 "
-                    " -D  'cn=Directory Manager' -w $'{}' --trustAll "
+                    " -D  'cn=Directory Manager' --bindPasswordFile \"$bind_pw\" --trustAll "
                     "-n set-crypto-manager-prop --set ssl-encryption:true"
-                    ).format(server.ip, primary_server.ldap_password)
+                    ).format(server.ip)
 
-            cmd_fn = os.path.join(installer.container, 'root/.cmd')
-            installer.put_file(cmd_fn, cmd)
             wlogger.log(task_id, "Executing command: " + cmd)
-            installer.run('bash /root/.cmd', error_exception='no base DNs available to enable replication')
-            installer.run('rm -f /root/.cmd')
+            installer.run_script(cmd, error_exception='no base DNs available to enable replication',
+                                 secrets={'bind_pw': primary_server.ldap_password})
 
             server.mmr = True
 
@@ -792,19 +771,16 @@ def opendjenablereplication(self, server_id):
     for base in ['gluu', 'site']:
         cmd = ( "OPENDJ_JAVA_HOME=/opt/jre /opt/opendj/bin/dsreplication "
                 "initialize-all --adminUID admin "
-                "--adminPassword $'{}' --baseDN o={} --hostname {} "
+                "--adminPasswordFile \"$admin_pw\" --baseDN o={} --hostname {} "
                 "--port 4444 --trustAll --no-prompt"
                 ).format(
-                        app_conf.replication_pw,
                         base,
                         primary_server.hostname,
                         )
         
-        cmd_fn = os.path.join(installer.container, 'root/.cmd')
-        installer.put_file(cmd_fn, cmd)
         wlogger.log(task_id, "Executing command: " + cmd)
-        installer.run('bash /root/.cmd', error_exception='no base DNs available to enable replication')
-        installer.run('rm -f /root/.cmd')
+        installer.run_script(cmd, error_exception='no base DNs available to enable replication',
+                             secrets={'admin_pw': app_conf.replication_pw})
 
 
     wlogger.log(task_id, "Restarting Cluster Nodes")
@@ -821,16 +797,13 @@ def opendjenablereplication(self, server_id):
 
     cmd = ( "OPENDJ_JAVA_HOME=/opt/jre "
             "/opt/opendj/bin/dsreplication status -n -X -h {} "
-            "-p 4444 -I admin -w $'{}'").format(
-                    primary_server.hostname,
-                    app_conf.replication_pw)
+            "-p 4444 -I admin --adminPasswordFile \"$admin_pw\"").format(
+                    primary_server.hostname)
 
     
-    cmd_fn = os.path.join(installer.container, 'root/.cmd')
-    installer.put_file(cmd_fn, cmd)
     wlogger.log(task_id, "Executing command: " + cmd)
-    installer.run('bash /root/.cmd', error_exception='no base DNs available to enable replication')
-    installer.run('rm -f /root/.cmd')
+    installer.run_script(cmd, error_exception='no base DNs available to enable replication',
+                         secrets={'admin_pw': app_conf.replication_pw})
 
     return True
 
@@ -2,10 +2,17 @@ import json
 import os
 import time
 import sys
+import zlib
+import base64
+import hashlib
 
 from clustermgr.extensions import celery
 from influxdb import InfluxDBClient
 from clustermgr.core.remote import RemoteClient
+from clustermgr.core.fanout import run_on_all
+from clustermgr.core import monitoring_state
+from clustermgr.core.influx_writer import InfluxWriter
+from clustermgr.config import Config
 from clustermgr.monitoring_scripts import sqlite_monitoring_tables
 from clustermgr.models import Server, AppConfiguration
 
@@ -16,53 +23,83 @@ client = InfluxDBClient(
                     database='gluu_monitoring'
                     )
 
-def write_influx(host, measurement, data):
+def write_influx(host, measurement, data, writer=None):
     """Writes data to influxdb
 
     Args:
         host (string): hostname of server
         measurement (string): we use measuremet name to determine table
         data (compund): data to be written to influxdb
+        writer (:object:`clustermgr.core.influx_writer.InfluxWriter`,
+            optional): writer the points are added to, they are written when
+            the writer is flushed. By default points are written at once.
 
     Returns:
-        tuple: True/False, file like object / error
+        bool: whether data was written
     """
     measurement_suffix = host.replace('.','_')
 
+    own_writer = writer is None
+    if own_writer:
+        writer = InfluxWriter('gluu_monitoring')
+
     #Data is written to influxdb table host_name_measurement_name
-    json_body =[]
+    field_names = data['fields'][1:]
     for d in data['data']:
+        writer.add(measurement_suffix+'_'+measurement,
+                   dict(zip(field_names, d[1:])),
+                   time=d[0])
 
-        fields = {}
-        for i,f in enumerate(data['fields'][1:]):
-            fields[f] = d[i+1]
-            json_body.append({"measurement": measurement_suffix+'_'+measurement,
-                            "time": d[0],
-                            "fields": fields,
-                            })
-    print("Writing data to InfluxDB")
-    client.write_points(json_body, time_precision='s')
+    if own_writer:
+        print("Writing data to InfluxDB")
+        return writer.close()
+    return True
 
 
-def get_last_update_time(host, measurement):
+def get_last_update_time(host, measurement, cached=True):
 
     """Returns last update time of measurement of the host
 
     Args:
         host (string): hostname of server
         measurement (string): measuremet
+        cached (bool): use the time stored after the last write, InfluxDB is
+            queried only if it is not known
 
     Returns:
         string: last update time in unix time stamp
     """
 
+    if cached:
+        watermark = monitoring_state.get_watermarks(host, [measurement])[measurement]
+        if watermark is not None:
+            return watermark
+
     measurement_suffix = host.replace('.','_')
 
     result = client.query('SELECT * FROM {} order by time desc limit 1'.format(measurement_suffix+'_'+measurement), epoch='s')
 
+    last_update = 0
     if result.raw.get('series'):
-        return result.raw['series'][0]['values'][0][0]
-    return 0
+        last_update = result.raw['series'][0]['values'][0][0]
+    monitoring_state.set_watermark(host, measurement, last_update)
+    return last_update
+
+
+def update_watermark(host, measurement, data):
+
+    """Stores time of the latest row of data written to influxdb
+
+    Args:
+        host (string): hostname of server
+        measurement (string): measuremet
+        data (dict): fields and rows written
+    """
+
+    if data['data']:
+        time_index = data['fields'].index('time')
+        monitoring_state.set_watermark(host, measurement,
+                                max(row[time_index] for row in data['data']))
 
 def get_remote_data(host, measurement, c):
 
@@ -99,7 +136,8 @@ def get_remote_data(host, measurement, c):
     print("Monitoring: {} records received for measurement {} from host {}".format(len(data['data']['data']), measurement, host))
     
     #wrtite fetched data to imnfluxdb
-    write_influx(host, measurement, data['data'])
+    if write_influx(host, measurement, data['data']):
+        update_watermark(host, measurement, data['data'])
 
 
 def get_age(host, c):
@@ -128,6 +166,181 @@ def get_age(host, c):
     print("Monitoring: uptime {}".format(data['data']))
     write_influx(host, 'uptime', arg_d)
 
+class ExportUnsupported(Exception):
+    """Raised when monitoring scripts on the server predate the export mode
+    of get_data.py"""
+    pass
+
+
+def export_remote_data(c, watermarks):
+
+    """Fetches new rows of all measurements and uptime of the host with a
+    single invocation of get_data.py
+
+    Args:
+        c (:object:`clustermgr.core.remote.RemoteClient`): client to be used
+            for the SSH communication
+        watermarks (dict): measurement to last update time, rows after it
+            are fetched
+
+    Returns:
+        dict: uptime and, for each measurement, fields and columns of the
+            rows
+
+    Raises:
+        ExportUnsupported: get_data.py of the server has no export mode
+        IOError: the command timed out or failed
+    """
+
+    cmd = 'python3 /var/monitoring/scripts/get_data.py export'
+    result = c.run(cmd, input=json.dumps(watermarks))
+    s_in, s_out, s_err = result
+
+    if getattr(result, 'timed_out', False):
+        raise IOError("Exporting monitoring data timed out")
+    if getattr(result, 'exit_status', 0) not in (0, None):
+        raise IOError("Exporting monitoring data failed: {}".format(
+                                                            s_err.strip()))
+
+    try:
+        payload = zlib.decompress(base64.b64decode(s_out.strip()))
+    except (ValueError, TypeError, zlib.error) as e:
+        # earlier versions of get_data.py print nothing for unknown modes
+        raise ExportUnsupported(str(e))
+
+    return json.loads(payload.decode())
+
+
+def collect_host_stats(server, c):
+
+    """Fetches all monitoring data of a single server and writes to influxdb
+
+    Args:
+        server (:object:`clustermgr.models.Server`): server to collect
+        c (:object:`clustermgr.core.remote.RemoteClient`): client to be used
+            for the SSH communication
+    """
+
+    print("Monitoring: getting data for derver {}".format(server.hostname))
+
+    #Last update times are known from previous cycles, influxdb is queried
+    #for the measurements that are not
+    tables = list(sqlite_monitoring_tables.monitoring_tables)
+    watermarks = monitoring_state.get_watermarks(server.hostname, tables)
+    for t in tables:
+        if watermarks[t] is None:
+            watermarks[t] = get_last_update_time(server.hostname, t,
+                                                 cached=False)
+
+    try:
+        data = export_remote_data(c, watermarks)
+    except ExportUnsupported as e:
+        # monitoring scripts on the server predate the export mode, other
+        # errors are raised so that a slow or broken server is not queried
+        # once more per measurement
+        print("Monitoring: server {} could not export data, querying each measurement. Error {}".format(server.hostname, e))
+        collect_host_stats_legacy(server, c)
+        return
+
+    #All measurements of the host are written in batches by one writer
+    writer = InfluxWriter('gluu_monitoring')
+    write_influx(server.hostname, 'uptime',
+                 {'fields': ['time', 'uptime'],
+                  'data': [[int(time.time()), data['uptime']]]},
+                 writer)
+
+    received = {}
+    for t, table in data['stats'].items():
+        rows = [list(row) for row in zip(*table['columns'])]
+        print("Monitoring: {} records received for measurement {} from host {}".format(len(rows), t, server.hostname))
+        received[t] = {'fields': table['fields'], 'data': rows}
+        write_influx(server.hostname, t, received[t], writer)
+
+    print("Writing data to InfluxDB")
+    if not writer.close():
+        #Watermarks are not moved, data is fetched again in the next cycle
+        raise IOError("Monitoring data of server {} could not be written to InfluxDB".format(server.hostname))
+
+    for t, points in received.items():
+        update_watermark(server.hostname, t, points)
+
+
+def collect_host_stats_legacy(server, c):
+
+    """Fetches monitoring data of a single server with one get_data.py
+    invocation per measurement and writes to influxdb
+
+    Args:
+        server (:object:`clustermgr.models.Server`): server to collect
+        c (:object:`clustermgr.core.remote.RemoteClient`): client to be used
+            for the SSH communication
+    """
+
+    try:
+        get_age(server.hostname, c)
+    except Exception as e:
+        print("Monitoring: An error occurred while retreiveing monitoring data from server {}. Error {}".format(server.hostname, e))
+    for t in sqlite_monitoring_tables.monitoring_tables:
+        try:
+            get_remote_data(server.hostname, t, c)
+        except Exception as e:
+            print("Monitoring: An error occurred while retreiveing {} data from server {}. Error {}".format(t, server.hostname, e))
+
+
+def collect_offset(hostname):
+
+    """Returns offset of the host in a collection cycle. Offsets are stable
+    and spread over Config.MONITORING_STAGGER seconds, so that hosts are
+    not collected all at once.
+
+    Args:
+        hostname (string): hostname of server
+
+    Returns:
+        float: seconds collection of the host is delayed
+    """
+
+    digest = hashlib.md5(hostname.encode()).hexdigest()
+    return int(digest, 16) % 1000 / 1000.0 * Config.MONITORING_STAGGER
+
+
+def collect_host(server):
+
+    """Collection unit of a single server. The cycle of the server is skipped
+    if its previous collection is still running.
+
+    Args:
+        server (:object:`clustermgr.models.Server`): server to collect
+
+    Returns:
+        bool: False if the cycle was skipped
+    """
+
+    time.sleep(collect_offset(server.hostname))
+
+    token = monitoring_state.acquire(server.hostname)
+    if not token:
+        print("Monitoring: previous collection of server {} is still running, skipping".format(server.hostname))
+        monitoring_state.record_skipped(server.hostname)
+        return False
+
+    started = time.time()
+    c = RemoteClient(server.hostname, ip=server.ip, ssh_port=server.ssh_port)
+    c.command_timeout = Config.MONITORING_HOST_DEADLINE
+    try:
+        c.startup()
+        collect_host_stats(server, c)
+        monitoring_state.record(server.hostname, started)
+    except Exception as e:
+        monitoring_state.record(server.hostname, started, error=str(e))
+        raise
+    finally:
+        c.close()
+        monitoring_state.release(server.hostname, token)
+
+    return True
+
+
 @celery.task
 def get_remote_stats():
     print("Monitoring Statistics task")
@@ -136,21 +349,11 @@ def get_remote_stats():
         if app_conf.monitoring:
 
             servers = Server.get_all()
-            for server in servers:
-                c = RemoteClient(server.hostname, ip=server.ip)
-                try:
-                    print("Monitoring: making ssh connection to server {}".format(server.hostname))
-                    c.startup()
-                except Exception as e:
-                    print("Monitoring: An error occurred while making ssh connection {}".format(e))
-                else:
-                    print("Monitoring: getting data for derver {}".format(server.hostname))
-                    try:
-                        get_age(server.hostname, c)
-                    except Exception as e:
-                        print("Monitoring: An error occurred while retreiveing monitoring data from server {}. Error {}".format(server.hostname, e))
-                    for t in sqlite_monitoring_tables.monitoring_tables:
-                        try:
-                            get_remote_data(server.hostname, t, c)
-                        except Exception as e:
-                            print("Monitoring: An error occurred while retreiveing {} data from server {}. Error {}".format(t, server.hostname, e))
+            for result in run_on_all(servers, collect_host, connect=False,
+                                     deadline=Config.MONITORING_STAGGER +
+                                        Config.MONITORING_HOST_DEADLINE,
+                                     max_workers=Config.MONITORING_MAX_WORKERS):
+                if result.timed_out:
+                    print("Monitoring: collecting data from server {} timed out".format(result.server.hostname))
+                elif result.error:
+                    print("Monitoring: An error occurred while collecting data from server {}: {}".format(result.server.hostname, result.error))
@@ -13,6 +13,7 @@ from ldap3 import Server as Ldap3Server
 from ldap3.core.exceptions import LDAPSocketOpenError
 
 from ..core.clustermgr_installer import Installer
+from ..core.fanout import run_on_all
 from ..core.utils import random_chars
 from ..core.utils import exec_cmd
 from ..core.utils import parse_setup_properties
@@ -179,8 +180,7 @@ def _rotate_keys(kr, javalibs_dir, jks_path, task_id):
 
         app_conf = AppConfiguration.query.first()
 
-        for server in Server.query:
-
+        def upload_jks(server):
             installer = Installer(server, 
                                   app_conf.gluu_version,
                                   ssh_port=server.ssh_port, 
@@ -188,7 +188,13 @@ def _rotate_keys(kr, javalibs_dir, jks_path, task_id):
 
             remote_jks_path = os.path.join(installer.container, 
                                                 'etc/certs/oxauth-keys.jks')
-            installer.upload_file(jks_path, remote_jks_path)
+            return installer.upload_file(jks_path, remote_jks_path)
+
+        for result in run_on_all(Server.query.all(), upload_jks,
+                                 connect=False):
+            if not (result.ok and result.value):
+                task_logger.warn("Unable to upload keys to {}".format(
+                                                    result.server.hostname))
 
         mod_oxauth = modify_oxauth_config(kr, pub_keys, openid_jks_pass)
         if mod_oxauth:
@@ -7,6 +7,7 @@ from flask import render_template
 from influxdb import InfluxDBClient
 
 from ..core.clustermgr_installer import Installer
+from ..core.influx_writer import InfluxWriter
 from ..extensions import celery
 from ..extensions import wlogger
 from ..models import AppConfiguration
@@ -92,13 +93,12 @@ def collect_logs(self, server_id, path, influx_fmt=True):
     task_id = self.request.id
     app_conf = AppConfiguration.query.first()
     dbname = current_app.config["INFLUXDB_LOGGING_DB"]
-    logs = []
     server = Server.query.get(server_id)
 
     agent_time = ''
     agent_type = ''
 
-    influx = InfluxDBClient(database=dbname)
+    influx = InfluxDBClient(database=dbname, gzip=True)
     influx.create_database(dbname)
     influx_query = "SELECT * FROM logs WHERE hostname='{}' order by time desc limit 1".format(server.hostname)
     result = influx.query(influx_query)
@@ -119,22 +119,29 @@ def collect_logs(self, server_id, path, influx_fmt=True):
         server_id=server_id,
     )
 
+    writer = InfluxWriter(dbname, precision='n',
+                          batch_size=current_app.config["LOG_COLLECT_BATCH"],
+                          client=influx)
+
     try:
-        _, stdout, stderr = installer.run(cmd, inside=False)
-        if not stderr:
-            logs = list(filter(
-                None,
-                [parse_log(log, hostname=server.hostname) for log in stdout.splitlines()],
-            ))
-        else:
+        # logs are parsed and written while they are received, so that large
+        # log pulls don't have to fit in memory
+        installer.log_command(cmd)
+        with installer.conn.run_stream(cmd) as stream:
+            for log in stream:
+                log = parse_log(log, hostname=server.hostname) if log else None
+                if log:
+                    writer.add_point(log)
+
+        if stream.stderr:
             task_logger.warn("Unable to collect logs from remote server {}/{}; "
-                             "reason={}".format(server.hostname, server.ip, stderr))
+                             "reason={}".format(server.hostname, server.ip, stream.stderr))
     except Exception as exc:
         task_logger.warn("Unable to collect logs from remote server; "
                          "reason={}".format(exc))
 
 
-    return influx.write_points(logs)
+    return writer.close()
 
 
 def _install_filebeat(installer):
@@ -8,6 +8,10 @@ from clustermgr.extensions import db, wlogger, celery
 from clustermgr.core.ldap_functions import DBManager
 from clustermgr.core.clustermgr_installer import Installer
 from clustermgr.core.remote import FakeRemote
+from clustermgr.core.fanout import run_on_all
+from clustermgr.core import monitoring_state
+from clustermgr.core.desired_config import ConfigFile, CHANGED, FAILED
+from clustermgr.core import desired_config
 
 
 
@@ -195,6 +199,130 @@ def install_local(self):
     return True
 
 
+def install_server_monitoring(task_id, server, app_conf):
+    
+    """Installs monitoring components to a single remote server.
+
+    :param task_id: id of the task running the installation
+    :param server: the server to install monitoring components
+    :param app_conf: application configuration
+
+    :return: wether monitoring were installed successfully
+    """
+
+    # 1. Installer
+    installer = Installer(
+            server, 
+            app_conf.gluu_version,
+            ssh_port=server.ssh_port,
+            logger_task_id=task_id, 
+            server_os=server.os
+            )
+
+    if not installer.conn:
+        return False
+
+    # 2. create monitoring directory
+    installer.run('mkdir -p /var/monitoring/scripts', inside=False)
+
+    # 3. Upload scripts
+    
+    scripts = (
+                'collector.py', 
+                'get_data.py', 
+                'sqlite_monitoring_tables.py',
+                'node_agent.py',
+                )
+    
+    # only scripts changed since the last installation are sent
+    if not installer.sync_tree(
+                    os.path.join(app.root_path, 'monitoring_scripts'),
+                    '/var/monitoring/scripts', include=scripts):
+        return False
+            
+    # 4. Upload systemd unit of the collector, which replaces the crontab
+    # entry earlier versions collected data with in every 5 minutes
+    installer.run('rm -f /etc/cron.d/monitoring '
+                  '/var/monitoring/scripts/cron_data_sqtile.py', inside=False)
+
+    with open(os.path.join(app.root_path, 'templates', 'monitoring',
+                           'gluu-monitoring.service')) as f:
+        service_file = ConfigFile('/etc/systemd/system/gluu-monitoring.service',
+                                  content=f.read())
+
+    # 4a. Sampling interval, and retention of raw rows and rollups in the
+    # sqlite store of the node
+    settings = {
+                'interval': app.config['MONITORING_SAMPLE_INTERVAL'],
+                'retention': {
+                    'raw': app.config['MONITORING_RAW_RETENTION'],
+                    '1m': app.config['MONITORING_1M_RETENTION'],
+                    '1h': app.config['MONITORING_1H_RETENTION'],
+                    }}
+    settings_file = ConfigFile('/var/monitoring/settings.json',
+                               content=json.dumps(settings))
+
+    status = desired_config.apply(installer, [service_file, settings_file])
+    if FAILED in status.values():
+        return False
+
+
+    if app_conf.offline:
+        # check if psutil and ldap3 was installed on remote server
+        for py_mod in ('psutil', 'ldap3', 'pyDes'):
+            result = installer.run("python3 -c 'import {0}'".format(py_mod), inside=False)
+            if 'No module named' in result[2]:
+                wlogger.log(
+                            task_id, 
+                            "{0} module is not installed. Please "
+                            "install python3-{0} and retry.".format(py_mod),
+                            "error", server_id=server.id,
+                            )
+                return False
+
+    else:
+        installer.epel_release()
+
+        # 5. Installing packages. 
+        # 5a. First determine commands for each OS type
+        packages = ['gcc']
+        if installer.clone_type == 'rpm' and installer.os_version == '8':
+            packages += ['python3', 'python3-dev']
+        else:
+            packages += ['python3-dev']
+
+        for package in packages:
+            installer.install(package, inside=False, error_exception='warning:')
+
+        # 5b. These commands are common for all OS types 
+        commands = [
+                        'curl https://bootstrap.pypa.io/get-pip.py > /tmp/get-pip.py',
+                        'python3 /tmp/get-pip.py',
+                        'pip3 install --upgrade setuptools',
+                        'pip3 install psutil==5.7.1',
+                        'pip3 install ldap3', 
+                        'pip3 install pyDes',
+                        'python3 /var/monitoring/scripts/'
+                        'sqlite_monitoring_tables.py'
+                        ]
+
+        # 5c. Executing commands
+        wlogger.log(task_id, "Installing Packages and Running Commands", 
+                            "info", server_id=server.id)
+        
+        for cmd in commands:
+            
+            result = installer.run(cmd, inside=False, error_exception='__ALL__')
+
+    # 6. (Re)start the collector, scripts or settings may have changed
+    if status[service_file.path] == CHANGED:
+        installer.run('systemctl daemon-reload', inside=False)
+    installer.enable_service('gluu-monitoring', inside=False)
+    installer.restart_service('gluu-monitoring', inside=False)
+
+    return True
+
+
 @celery.task(bind=True)
 def install_monitoring(self):
     
@@ -206,106 +334,30 @@ def install_monitoring(self):
     """
     
     task_id = self.request.id
-    installed = 0
     servers = Server.get_all()
     app_conf = AppConfiguration.query.first()
-    
-    for server in servers:
-        # 1. Installer
-        installer = Installer(
-                server, 
-                app_conf.gluu_version,
-                ssh_port=server.ssh_port,
-                logger_task_id=task_id, 
-                server_os=server.os
-                )
-
-        # 2. create monitoring directory
-        installer.run('mkdir -p /var/monitoring/scripts', inside=False)
 
-        # 3. Upload scripts
-        
-        scripts = (
-                    'cron_data_sqtile.py', 
-                    'get_data.py', 
-                    'sqlite_monitoring_tables.py'
+    # Installation is done on all servers concurrently, without a deadline
+    # since package installations may take long
+    results = run_on_all(
+                    servers,
+                    lambda server: install_server_monitoring(task_id, server, app_conf),
+                    deadline=0,
+                    connect=False,
                     )
-        
-        for script in scripts:
-        
-            local_file = os.path.join(app.root_path, 'monitoring_scripts', script)
-                                        
-            remote_file = '/var/monitoring/scripts/'+script
-
-            if not installer.upload_file(local_file, remote_file):
-                return False
-                
-        # 4. Upload crontab entry to collect data in every 5 minutes
-        crontab_entry = (
-                        '*/5 * * * *    root    python3 '
-                        '/var/monitoring/scripts/cron_data_sqtile.py\n'
-                        )
-                        
-        if not installer.put_file('/etc/cron.d/monitoring', crontab_entry):
-            return False
-
-
-        if app_conf.offline:
-            # check if psutil and ldap3 was installed on remote server
-            for py_mod in ('psutil', 'ldap3', 'pyDes'):
-                result = installer.run("python3 -c 'import {0}'".format(py_mod), inside=False)
-                if 'No module named' in result[2]:
-                    wlogger.log(
-                                task_id, 
-                                "{0} module is not installed. Please "
-                                "install python3-{0} and retry.".format(py_mod),
-                                "error", server_id=server.id,
-                                )
-                    return False
 
+    installed = True
+    for result in results:
+        if result.ok and result.value:
+            result.server.monitoring = True
         else:
-            installer.epel_release()
-
-            # 5. Installing packages. 
-            # 5a. First determine commands for each OS type
-            packages = ['gcc']
-            if installer.clone_type == 'rpm' and installer.os_version == '8':
-                packages += ['python3', 'python3-dev']
-            else:
-                packages += ['python3-dev']
-
-            for package in packages:
-                installer.install(package, inside=False, error_exception='warning:')
-
-            # 5b. These commands are common for all OS types 
-            commands = [
-                            'curl https://bootstrap.pypa.io/get-pip.py > /tmp/get-pip.py',
-                            'python3 /tmp/get-pip.py',
-                            'pip3 install --upgrade setuptools',
-                            'pip3 install psutil==5.7.1',
-                            'pip3 install ldap3', 
-                            'pip3 install pyDes',
-                            'python3 /var/monitoring/scripts/'
-                            'sqlite_monitoring_tables.py'
-                            ]
-
-            if installer.clone_type == 'deb':
-                commands.append('service cron restart')
-            else:
-                commands.append('service crond restart')
-
-            # 5c. Executing commands
-            wlogger.log(task_id, "Installing Packages and Running Commands", 
-                                "info", server_id=server.id)
-            
-            for cmd in commands:
-                
-                result = installer.run(cmd, inside=False, error_exception='__ALL__')
-            
-        server.monitoring = True
+            installed = False
+            if result.error:
+                wlogger.log(task_id, "Installation failed: {}".format(result.error),
+                            "error", server_id=result.server.id)
 
     db.session.commit()
-    return True
+    return installed
 
 @celery.task(bind=True)
 def remove_monitoring(self):
@@ -330,11 +382,18 @@ def remove_monitoring(self):
                 server_os=server.os
                 )
         
-        # 2. remove monitoring directory
+        # 2. stop the collector and remove its systemd unit
+        installer.stop_service('gluu-monitoring', inside=False)
+        installer.enable_service('gluu-monitoring', inside=False, enable=False)
+        installer.run('rm -f /etc/systemd/system/gluu-monitoring.service',
+                      inside=False)
+        installer.run('systemctl daemon-reload', inside=False)
+
+        # 2a. remove monitoring directory
         installer.run('rm -r /var/monitoring/', inside=False)
 
-        # 3. remove crontab entry to collect data in every 5 minutes
-        installer.run('rm /etc/cron.d/monitoring', inside=False)
+        # 3. remove crontab entry earlier versions collected data with
+        installer.run('rm -f /etc/cron.d/monitoring', inside=False)
 
         # 4. Restarting crontab
         if installer.clone_type == 'rpm':
@@ -343,6 +402,7 @@ def remove_monitoring(self):
             installer.restart_service('cron', inside=False)
 
         server.monitoring = False
+        monitoring_state.clear_watermarks(server.hostname)
 
     # 5. Remove local settings
     
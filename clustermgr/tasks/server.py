@@ -10,7 +10,6 @@ import io
 import json
 import binascii
 
-from pathlib import Path
 
 from flask import current_app as app
 from ldap3 import SUBTREE, BASE, MODIFY_REPLACE
@@ -21,6 +20,9 @@ from clustermgr.core.remote import RemoteClient, get_connection
 from clustermgr.config import Config
 
 from clustermgr.core.clustermgr_installer import Installer
+from clustermgr.core import host_facts
+from clustermgr.core import desired_config
+from clustermgr.core.desired_config import ConfigFile
 from clustermgr.core.utils import get_setup_properties, \
     modify_etc_hosts, as_boolean, get_proplist, write_setup_properties_file, \
     parse_setup_properties
@@ -43,7 +45,9 @@ def collect_server_details(self, server_id):
         server = Server.query.get(server_id)
         hostname = server.hostname
         ip = server.ip
-    
+
+    host_facts.invalidate(server.hostname)
+
     installer = Installer(
                 server,
                 app_conf.gluu_version,
@@ -52,35 +56,20 @@ def collect_server_details(self, server_id):
                 ssh_port=server.ssh_port
                 )
 
-    os_type = installer.get_os_type()
+    # facts were dropped above, so they are gathered once in one round trip
+    facts = installer.facts
+    os_type = facts['os']
 
     if server_id == -1:
         app_conf.nginx_os = os_type
         db.session.commit()
         return
 
-
     # 0. Make sure it is a Gluu Server
-    server.gluu_server = installer.is_gluu_installed()
+    server.gluu_server = facts['gluu_installed']
 
     # 1. The components installed in the server
-    components = {
-        'oxAuth': 'opt/gluu/jetty/oxauth',
-        'oxTrust': 'opt/gluu/jetty/identity',
-        'Shibboleth': 'opt/shibboleth-idp',
-        'oxAuthRP': 'opt/gluu/jetty/oxauth-rp',
-        #'Asimba': 'opt/gluu/jetty/asimba',
-        'Passport': 'opt/gluu/node/passport',
-    }
-    installed = []
-    
-    if server.gluu_server:
-        for component, marker in components.items():
-            marker = os.path.join(installer.container, marker)
-            if installer.conn.exists(marker):
-                installed.append(component)
-
-    server.components = ",".join(installed)
+    server.components = ",".join(facts['components'])
 
     server.os = os_type
 
@@ -108,28 +97,27 @@ def modify_hosts(task_id, conn, hosts, chroot='/', server_host=None, server_id='
 
     hosts_file = os.path.join(chroot,'etc/hosts')
 
-    result, old_hosts = conn.get_file(hosts_file)
-
-    if result:
-        new_hosts = modify_etc_hosts(hosts, old_hosts.read())
+    # lines are parsed while the file is read
+    try:
+        new_hosts = modify_etc_hosts(hosts, conn.iter_file(hosts_file))
+    except Exception:
+        wlogger.log(task_id, "Can't receive {}".format(hosts_file), 'fail', server_id=server_id)
+    else:
         conn.put_file(hosts_file, new_hosts)
         wlogger.log(task_id, "{} was modified".format(hosts_file), 'success', server_id=server_id)
-    else:
-        wlogger.log(task_id, "Can't receive {}".format(hosts_file), 'fail', server_id=server_id)
 
 
     if chroot:
 
         hosts_file = os.path.join(chroot, 'etc/hosts')
-        
-        result, old_hosts = conn.get_file(hosts_file)
-        
-        if result:
-            new_hosts = modify_etc_hosts(hosts, old_hosts.read())
+
+        try:
+            new_hosts = modify_etc_hosts(hosts, conn.iter_file(hosts_file))
+        except Exception:
+            wlogger.log(task_id, "Can't receive {}".format(hosts_file), 'fail', server_id=server_id)
+        else:
             conn.put_file(hosts_file, new_hosts)
             wlogger.log(task_id, "{0} of server {1} was modified".format(hosts_file, server_host), 'success', server_id=server_id)
-        else:
-            wlogger.log(task_id, "Can't receive {}".format(hosts_file), 'fail', server_id=server_id)
 
 
 def download_and_upload_custom_schema(task_id, primary_conn, conn, ldap_type, gluu_server):
@@ -350,6 +338,9 @@ def install_gluu_server(task_id, server_id):
 
     app_conf = AppConfiguration.query.first()
 
+    # installation changes facts of the server
+    host_facts.invalidate(server.hostname)
+
     enable_command = None
     gluu_server = 'gluu-server'
 
@@ -554,7 +545,14 @@ def install_gluu_server(task_id, server_id):
         gluu_archive_fn = os.path.split(app_conf.gluu_archive)[1]
         wlogger.log(task_id, "Uploading {}".format(gluu_archive_fn))
 
-        installer.upload_file(app_conf.gluu_archive, os.path.join('/root', gluu_archive_fn))
+        # non primary servers get the archive from primary server, so that it
+        # is not sent from cluster manager to each. The relayed file is
+        # checked to have the sum of the local archive.
+        installer.upload_large_file(
+                    app_conf.gluu_archive,
+                    os.path.join('/root', gluu_archive_fn),
+                    relay_from=None if server.primary_server else primary_server_installer
+                    )
 
         if installer.clone_type == 'deb':
             install_command = 'dpkg -i /root/{}'.format(gluu_archive_fn)
@@ -583,11 +581,12 @@ def install_gluu_server(task_id, server_id):
 
         re_list = [ubuntu_re, ubuntu_re_2, centos_re]
 
-        all_cout = installer.run_channel_command(cmd, re_list)
+        all_cout, log_id, seen = installer.run_channel_command(cmd, re_list,
+                                                    watch=['half-installed'])
 
         #If previous installation was broken, make a re-installation. 
         #This sometimes occur on ubuntu installations
-        if 'half-installed' in all_cout:
+        if 'half-installed' in seen:
             if ('Ubuntu' in server.os) or ('Debian' in server.os):
                 cmd = 'DEBIAN_FRONTEND=noninteractive  apt-get install --reinstall -y '+ gluu_server
                 installer.run_channel_command(cmd, re_list)
@@ -633,12 +632,10 @@ def install_gluu_server(task_id, server_id):
             prop_io = result[1]
         else:
             remote_file += '.cm'
-            cmd_unenc = "openssl enc -d -aes-256-cbc -in /install/community-edition-setup/setup.properties.last.enc -k $'{}' -out /install/community-edition-setup/setup.properties.last.cm".format(server.ldap_password)
-            cmd_fn = os.path.join(installer.container, 'root/.cmd')
-            primary_server_installer.put_file(cmd_fn, cmd_unenc)
+            cmd_unenc = 'openssl enc -d -aes-256-cbc -in /install/community-edition-setup/setup.properties.last.enc -pass file:"$ldap_pw" -out /install/community-edition-setup/setup.properties.last.cm'
             wlogger.log(task_id, "Executing: " + cmd_unenc, 'debug')
-            primary_server_installer.run('bash /root/.cmd')
-            primary_server_installer.run('rm -f /root/.cmd')
+            primary_server_installer.run_script(
+                        cmd_unenc, secrets={'ldap_pw': server.ldap_password})
             result = primary_server_installer.conn.get_file(remote_file)
             prop_io = result[1]
             installer.run('rm -f ' + remote_file)
@@ -690,23 +687,19 @@ def install_gluu_server(task_id, server_id):
         remote_py = '/opt/gluu-server/install/community-edition-setup/setup.py'
         installer.upload_file(setup_py, remote_py)
 
-    # upload local setup files for >= 4.3.0
-    server_root_path = Path(os.path.join(installer.container, 'install/community-edition-setup'))
+    # upload local setup files for >= 4.3.0, only changed files are sent
+    server_root_path = os.path.join(installer.container, 'install/community-edition-setup')
     setup_dir = os.path.join(app.root_path, 'setups', 'setup_' + app_conf.gluu_version.replace('nochroot-', ''))
-    setup_path = Path(setup_dir)
 
-    for p in setup_path.glob('**/*'):
-        if p.is_file() and not p.name.endswith('.pyc'):
-            relative_path = p.relative_to(setup_path)
-            remote_path = server_root_path.joinpath(relative_path)
-            installer.upload_file(str(p), str(remote_path))
+    if os.path.isdir(setup_dir):
+        installer.sync_tree(setup_dir, server_root_path, exclude=['*.pyc'])
 
 
     # fix login.defs inside container
     login_defs_fn = os.path.join(installer.container, 'etc/login.defs')
-    result, login_defs = installer.conn.get_file(login_defs_fn)
-    if result:
-        login_defs_list = login_defs.read().splitlines()
+
+    def set_umask(login_defs):
+        login_defs_list = login_defs.splitlines()
         umask_line = 'UMASK    022'
         for i, l in enumerate(login_defs_list):
             ls = l.strip()
@@ -716,7 +709,9 @@ def install_gluu_server(task_id, server_id):
         else:
             login_defs_list.append(umask_line)
 
-        installer.put_file(login_defs_fn, '\n'.join(login_defs_list))
+        return '\n'.join(login_defs_list)
+
+    desired_config.apply(installer, [ConfigFile(login_defs_fn, edit=set_umask)])
 
     opendj_properties_fn = os.path.join(app.root_path, 'templates', 'opendj', 'opendj-setup.properties')
 
@@ -742,7 +737,7 @@ def install_gluu_server(task_id, server_id):
     else:
         re_list = []
 
-    all_cout = installer.run_channel_command(cmd, re_list)
+    installer.run_channel_command(cmd, re_list)
 
     wlogger.log(task_id, "4", "setstep")
     #JavaScript on logger duplicates next log if we don't add this
@@ -873,20 +868,14 @@ def install_gluu_server(task_id, server_id):
         custom_schemas = os.listdir(custom_schema_dir)
 
         if custom_schemas:
-            schema_folder = '/opt/gluu/schema/{}'.format(ldap_type)
-            if not installer.conn.exists(schema_folder):
-                installer.conn.run('mkdir -p {}'.format(schema_folder))
-
-            for schema_file in custom_schemas:
-                
-                local = os.path.join(custom_schema_dir, schema_file)
-                remote = '/opt/{0}/opt/gluu/schema/{2}/{1}'.format(
-                    gluu_server, schema_file, ldap_type)
-                result = installer.upload_file(local, remote)
+            schema_folder = '/opt/{0}/opt/gluu/schema/{1}'.format(
+                gluu_server, setup_prop['ldap_type'])
+            installer.sync_tree(custom_schema_dir, schema_folder)
 
 
     server.gluu_server = True
     db.session.commit()
+    host_facts.invalidate(server.hostname)
 
     #ntp is required for time sync, since ldap replication will be
     #done by time stamp. If not isntalled, install and configure crontab
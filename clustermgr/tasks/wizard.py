@@ -8,6 +8,7 @@ from clustermgr.extensions import db, wlogger, celery
 from clustermgr.core.remote import RemoteClient
 from clustermgr.core.utils import run_and_log
 from clustermgr.core.clustermgr_installer import Installer
+from clustermgr.core import host_facts
 from clustermgr.config import Config
 from clustermgr.core.utils import get_setup_properties, \
         write_setup_properties_file
@@ -36,6 +37,9 @@ def wizard_step1(self):
 
     app_conf = AppConfiguration.query.first()
 
+    # facts are gathered again while analyzing
+    host_facts.invalidate(server.hostname)
+
     installer = Installer(
                 server, 
                 '',
@@ -62,14 +66,17 @@ def wizard_step1(self):
     installer.gluu_version = gluu_version
     installer.settings()
 
-    ldap_prop_file = installer.get_file('/opt/gluu-server/etc/gluu/conf/gluu-ldap.properties')
-
-    for l in ldap_prop_file.splitlines():
-        ls = l.strip()
-        if ls.startswith('bindPassword'):
-            n = ls.find(':')
-            en_password = ls[n+1:].strip()
-            break
+    ldap_prop_fn = '/opt/gluu-server/etc/gluu/conf/gluu-ldap.properties'
+    try:
+        for l in installer.conn.iter_file(ldap_prop_fn):
+            ls = l.strip()
+            if ls.startswith('bindPassword'):
+                n = ls.find(':')
+                en_password = ls[n+1:].strip()
+                break
+    except IOError as e:
+        wlogger.log(task_id, "Can't read {}: {}".format(ldap_prop_fn, e), 'error')
+        return False
 
     pw_result = installer.run('/opt/gluu/bin/encode.py -D ' + en_password, inside=True, nolog=True)
     ldap_password = pw_result[1].strip()
@@ -14,7 +14,7 @@ from clustermgr.tasks.cache import install_cache_cluster, remove_cache_server_ta
 from ..core.license import license_reminder
 from ..core.license import prompt_license
 from ..core.license import license_required
-from clustermgr.core.remote import RemoteClient
+from clustermgr.core.fanout import run_on_all
 from clustermgr.core.utils import get_redis_config, get_cache_servers, random_chars
 from clustermgr.forms import CacheSettingsForm, cacheServerForm
 
@@ -198,51 +198,36 @@ def get_status():
     status={'redis':{}, 'stunnel':{}}
     servers = Server.get_all()
     
-    check_cmd = 'python -c "import socket;s=socket.socket(socket.AF_INET,socket.SOCK_STREAM);print s.connect_ex((\'{0}\', {1}))"'
-    
     cache_servers = get_cache_servers()
     
 
     stunnel_port = cache_servers[0].stunnel_port if cache_servers else None
         
     
-    for server in servers + cache_servers:
-        key = server.ip.replace('.','_')
+    def check_status(server, c):
+        redis_status = False
+        stunnel_status = False
+        
+        if server in cache_servers:
+            redis_status = c.agent.port_open('localhost', 6379)
+            stunnel_status = redis_status
+
+            if stunnel_port:
+                stunnel_status = c.agent.port_open(server.ip, stunnel_port)
 
-        c = RemoteClient(host=server.hostname, ip=server.ip, ssh_port=server.ssh_port)
-        try:
-            c.startup()
-        except:
-            status['stunnel'][key] = False
-            status['redis'][key] = False
         else:
+            if stunnel_port:
+                stunnel_status = c.agent.port_open('localhost', 6379)
 
-            status['stunnel'][key]=False
-            
-            if server in cache_servers:
-                r = c.run(check_cmd.format('localhost', 6379))
-                stat = r[1].strip()
-                
-                if stat == '0':
-                    status['redis'][key]=True
-                else:
-                    status['redis'][key]=False
-
-                if stunnel_port:
-                    r = c.run(check_cmd.format(server.ip, stunnel_port))
-                    stat = r[1].strip()
-
-                if stat == '0':
-                    status['stunnel'][key]=True
-
-            else:
-                if stunnel_port:
-                    r = c.run(check_cmd.format('localhost', '6379'))
-                    stat = r[1].strip()
-
-                    if stat == '0':
-                        status['stunnel'][key]=True
-
-        c.close()
+        return redis_status, stunnel_status
+
+    for result in run_on_all(servers + cache_servers, check_status):
+        key = result.server.ip.replace('.','_')
+
+        if result.ok:
+            status['redis'][key], status['stunnel'][key] = result.value
+        else:
+            status['stunnel'][key] = False
+            status['redis'][key] = False
     
     return jsonify(status)
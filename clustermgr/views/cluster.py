@@ -19,9 +19,9 @@ from clustermgr.tasks.cluster import installNGINX, \
     remove_server_from_cluster, remove_filesystem_replication, \
     opendj_disable_replication_task, uninstallNGINX
 
-from clustermgr.core.utils import port_status_cmd
 
 from clustermgr.core.remote import RemoteClient
+from clustermgr.core.fanout import run_on_all
 
 from clustermgr.forms import FSReplicationPathsForm
 
@@ -279,20 +279,22 @@ def chekFSR(server, gluu_version):
         return False, []
     
     csync_config = '/opt/gluu-server/etc/csync2.cfg'
-    result = c.get_file(csync_config)
-    
-    if result[0]:
-        
-        servers = []
+    servers = []
 
-        for l in result[1].readlines():
+    try:
+        for l in c.iter_file(csync_config):
             ls = l.strip()
             if ls.startswith('host') and ls.endswith(';'):
                 hostname = ls.split()[1][:-1]
                 servers.append(hostname)
-        
-        if servers:
-            return True, servers
+    except Exception as e:
+        print("Can't read {}: {}".format(csync_config, e))
+        return False, []
+    finally:
+        c.close()
+
+    if servers:
+        return True, servers
 
     return False, []
 
@@ -301,18 +303,18 @@ def chekFSR(server, gluu_version):
 def fsrep_health():
     servers = Server.get_all()
     status = {}
-    for server in servers:
-        status[server.id]= False
-        c = RemoteClient(server.hostname, ip=server.ip, ssh_port=server.ssh_port)
-        try:
-            c.startup()
-        except Exception as e:
-            print("Can't establish SSH connection to", server.hostname, "Reason:", e)
-    
-        csyncs2_cmd = port_status_cmd.format('localhost', 30865)
-        r = c.run(csyncs2_cmd)
-        if r[1].strip()=='0':
-            status[server.id]= True
+
+    def csync2_listening(server, c):
+        return c.agent.port_open('localhost', 30865)
+
+    for result in run_on_all(servers, csync2_listening):
+        status[result.server.id]= False
+        if not result.ok:
+            print("Can't get csync2 status of", result.server.hostname, "Reason:", 
+                    'timed out' if result.timed_out else result.error)
+        elif result.value:
+            status[result.server.id]= True
+
     return jsonify(status)
 
 @cluster.route('/fsrep', methods=['GET', 'POST'])
@@ -33,6 +33,7 @@ from clustermgr.core.license import prompt_license, license_required
 from clustermgr.core.remote import RemoteClient, FakeRemote, ClientNotSetupException
 
 from clustermgr.core.clustermgr_installer import Installer
+from clustermgr.core import log_archive
 
 from clustermgr.core.utils import get_setup_properties, \
     get_opendj_replication_status, as_boolean, get_enabled_services, encode
@@ -45,8 +46,6 @@ index.before_request(prompt_license)
 index.before_request(license_reminder)
 index.before_request(license_required)
 
-msg_text = ''
-
 @index.route('/')
 def home():
     
@@ -410,23 +409,29 @@ def app_configuration():
 
 
 
-@index.route('/log/<task_id>')
-@login_required
-def get_log(task_id):
-    
-    global msg_text
-    
-    msgs = wlogger.get_messages(task_id)
+def task_log(task_id, since=None):
+    """Returns state of a celery task and the log messages it pushed after
+    the cursor `since`. Logs of finished tasks are read from the archive.
+    """
     result = AsyncResult(id=task_id, app=celery)
+    # state is read before messages, buffered messages of a task are
+    # written and archived before its state, see application.init_celery()
+    state = result.state
+    archived = log_archive.find(task_id)
+    if archived:
+        entries = log_archive.read(task_id, since, archived) or []
+        if state not in ('SUCCESS', 'FAILURE'):
+            # result of the task expired
+            state = archived['status']
+    else:
+        entries = wlogger.read(task_id, since)
+    msgs = [msg for cursor, msg in entries]
     value = 0
-    
     error_message = ''
 
-    if result.result != None:
-        if getattr(result, 'traceback'):
+    if state in ('SUCCESS', 'FAILURE'):
+        if result.traceback:
             error_message = str(result.traceback)
-            
-    if result.state == 'SUCCESS' or result.state == 'FAILED':
         if result.result:
             if type(result.result) != type(True):
                 try:
@@ -434,32 +439,45 @@ def get_log(task_id):
                 except:
                     value = result.result
         wlogger.clean(task_id)
-    log = {'task_id': task_id, 'state': result.state, 'messages': msgs,
-           'result': value, 'error_message': error_message}
 
-    ts = strftime('[%Y-%b-%d %H:%M]')
-    
-    log_ = False
-    
-    if msgs:
-        if msgs[-1].get('msg','') != msg_text:
-            
-            msg_text = msgs[-1].get('msg','')
-            log_ = True
-    
-    if log_ or error_message:
-        
+    if msgs or error_message:
         logger.error('%s [Celery] %s %s %s %s',
-                          ts,
-                          result.state,
-                          msg_text,
+                          strftime('[%Y-%b-%d %H:%M]'),
+                          state,
+                          msgs[-1].get('msg', '') if msgs else '',
                           value,
                           error_message
                     )
 
+    return {'task_id': task_id, 'state': state, 'messages': msgs,
+            'cursors': [cursor for cursor, msg in entries],
+            'next': entries[-1][0] if entries else since or '0',
+            'result': value, 'error_message': error_message}
+
+
+@index.route('/log/<task_id>')
+@login_required
+def get_log(task_id):
+    """Returns log messages of a task. Only messages after the `since`
+    request argument are returned, the cursor to be used in the next request
+    is `next` of the response.
+    """
+    log = task_log(task_id, request.args.get('since'))
+    del log['cursors']
     return jsonify(log)
 
 
+@index.route('/log/archive')
+@login_required
+def archived_logs():
+    """Lists the latest archived task logs, of the server given with the
+    `server_id` request argument if any. Logs are read with get_log.
+    """
+    return jsonify({'tasks': log_archive.tasks(
+                        request.args.get('server_id', type=int),
+                        request.args.get('limit', 50, type=int))})
+
+
 @index.route('/mmr/')
 @login_required
 def multi_master_replication():
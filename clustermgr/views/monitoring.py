@@ -12,6 +12,8 @@ from flask_login import login_required
 # from flask import current_app as app
 from influxdb import InfluxDBClient
 from clustermgr.core.remote import RemoteClient
+from clustermgr.core.fanout import run_on_all
+from clustermgr.core import monitoring_state
 
 # from clustermgr.extensions import celery
 from clustermgr.core.license import license_reminder
@@ -26,7 +28,7 @@ from clustermgr.tasks.monitoring import install_monitoring, install_local, \
 from clustermgr.monitoring_defs import left_menu, items, periods
 
 from clustermgr.core.utils import get_setup_properties, \
-    get_opendj_replication_status, port_status_cmd, get_enabled_services
+    get_opendj_replication_status, get_enabled_services
 
 monitoring = Blueprint('monitoring', __name__)
 monitoring.before_request(prompt_license)
@@ -262,14 +264,12 @@ def get_uptime(host, ssh_port):
         flash("SSH Connection to host {} could not be established".format(host))
         return
     try:
-        #Execute script on the remote server, fetch output and convert json data
-        #to Python dictionary
-        cmd = 'python3 /var/monitoring/scripts/get_data.py age'
-        result = c.run(cmd)
-        data = json.loads(result[1])
-        return str(timedelta(seconds=data['data']['uptime']))
+        #Ask uptime to node agent of the remote server
+        return str(timedelta(seconds=c.agent.uptime()))
     except:
         flash("Uptime information could not be fethced from {}".format(host))
+    finally:
+        c.close()
 
 
 def check_data(hostname):
@@ -356,15 +356,32 @@ def home():
         data['mem'][host['name']]['last']="%0.1f" % l
         data['uptime'][host['name']] = get_uptime(host['name'], ssh_ports[host['id']])
 
+    #Show how old the collected data of each host is
+    freshness = monitoring_state.freshness([host['name'] for host in hosts])
+    for state in freshness.values():
+        if state['age'] is not None:
+            state['age'] = str(timedelta(seconds=int(state['age'])))
 
     return render_template('monitoring_home.html',
                             left_menu=left_menu,
                             items=items,
                             hosts=hosts,
                             data=data,
+                            freshness=freshness,
                             )
 
 
+@monitoring.route('/freshness')
+@login_required
+def freshness():
+
+    """Returns state of the last data collection of each server as json"""
+
+    servers = Server.query.all()
+    return jsonify(monitoring_state.freshness(
+                                [server.hostname for server in servers]))
+
+
 @monitoring.route('/setup')
 @login_required
 def setup_index():
@@ -627,50 +644,38 @@ def get_server_status():
                 'casa': 'casa/enrollment-api.yaml',
             }
 
-        cmd =  '''python3 -c "import urllib2,ssl; print urllib2.urlopen('https://localhost/{}', context= ssl._create_unverified_context()).getcode()"'''
-
-        for server in servers:
-            status[server.id] = {}
-
-            c = RemoteClient(server.hostname, ssh_port=server.ssh_port)
-            c.ok = False
-            try:
-                c.startup()
-                c.ok = True
-            except Exception as e:
-                pass
-
-            for service in active_services:
-                status[server.id][service] = False
-
-                if c.ok:
-                    if service == 'passport':
-                        passport_cmd = port_status_cmd.format('localhost', 8090)
-                        r = c.run(passport_cmd)
-                        if r[1].strip()=='0':
-                            status[server.id][service] = True
-                    elif service == 'oxd':
-                        passport_cmd = port_status_cmd.format('localhost', 8443)
-                        r = c.run(passport_cmd)
-                        if r[1].strip()=='0':
-                            status[server.id][service] = True
-                    else:
-                        if service in services:
-                            try:
-                                run_cmd = cmd.format(services[service])
-                                result = c.run(run_cmd)
-                                if result[1].strip() == '200':
-                                    status[server.id][service] = True
-                            except Exception as e:
-                                print("Error getting service status of {0} for {1}. ERROR: {2}".format(server.hostname,service, e))
+        port_services = {'passport': 8090, 'oxd': 8443}
+
+        def check_services(server, c):
+            server_status = dict((service, False) for service in active_services)
+
+            # probes are batched, one round trip for ports and one for urls
+            probed_ports = [s for s in active_services if s in port_services]
+            probed_urls = [s for s in active_services if s in services]
+
+            ports = c.agent.ports_open(
+                        [('localhost', port_services[s]) for s in probed_ports])
+            for service, is_open in zip(probed_ports, ports):
+                server_status[service] = is_open
+
+            responses = c.agent.http_get_many(
+                        ['https://localhost/' + services[s] for s in probed_urls])
+            for service, (status_code, body) in zip(probed_urls, responses):
+                server_status[service] = status_code == 200
+
+            return server_status
+
     else:
-        remote_cmd_raw = '''python3 -W ignore -c "import requests;r=requests.get('{}',verify=False);'''
-        remote_cmd = remote_cmd_raw + '''print( 1 if r.json()['status']=='running' else 0)"'''
-        remote_cmd = remote_cmd_raw + '''print( 1 if r.json()['status']=='running' else 0)"'''
-        remote_sml_cmd = remote_cmd_raw + '''print( 1 if '<ds:X509Certificate>' in r.text else 0)"'''
-        remote_casa_cmd = remote_cmd_raw + '''print( 1 if r.text.lower()=='ok' else 0)"'''
-        remote_passport_cmd = remote_cmd_raw + '''print( 1 if r.text.lower()=='ok' else 0)"'''
-        remote_passport_cmd = remote_cmd_raw + '''print( 1 if r.json().get('token_') else 0)"'''
+
+        def json_status(body):
+            return json.loads(body)['status'] == 'running'
+
+        # health of each service is decided from the body of its health check
+        health_checks = {
+                'saml': lambda body: '<ds:X509Certificate>' in body,
+                'casa': lambda body: body.lower() == 'ok',
+                'passport': lambda body: bool(json.loads(body).get('token_')),
+            }
 
         services = {
                 'oxauth': 'http://localhost:8081/oxauth/restv1/health-check',
@@ -682,36 +687,37 @@ def get_server_status():
                 'oxd': 'https://localhost:8443/health-check',
             }
 
-        for server in servers:
-            status[server.id] = {}
-            c = RemoteClient(server.hostname, ssh_port=server.ssh_port)
-            c.ok = False
-            try:
-                c.startup()
-                c.ok = True
-            except Exception as e:
-                print(e)
-                pass
-
-            for service in active_services:
-                    status[server.id][service] = False
-
-                    service_url = services[service]
-                    if c.ok:
-                        if service == 'saml':
-                            rcmd = remote_sml_cmd
-                        elif service == 'casa':
-                            rcmd = remote_casa_cmd
-                        elif service == 'passport':
-                            rcmd = remote_passport_cmd
-                        else:
-                            rcmd = remote_cmd
-                        rcmd = rcmd.format(service_url)
-                        print(service, rcmd)
+        def check_services(server, c):
+            server_status = {}
 
-                        r = c.run(rcmd)
-                        if r[1].strip()=='1':
-                            status[server.id][service] = True
+            # all health checks of the server are made in one round trip
+            responses = c.agent.http_get_many(
+                        [services[service] for service in active_services])
+
+            for service, (status_code, body) in zip(active_services, responses):
+                server_status[service] = False
+
+                if status_code is None:
+                    continue
+
+                try:
+                    check = health_checks.get(service, json_status)
+                    server_status[service] = check(body)
+                except (ValueError, KeyError, AttributeError):
+                    pass
+
+            return server_status
+
+    # Check all servers concurrently, hosts which can't be reached or don't
+    # answer in time are reported with all services down
+    for result in run_on_all(servers, check_services):
+        if result.ok:
+            status[result.server.id] = result.value
+        else:
+            print("Can't get service status of {0}: {1}".format(
+                result.server.hostname,
+                'timed out' if result.timed_out else result.error))
+            status[result.server.id] = dict(
+                        (service, False) for service in active_services)
 
-    
     return jsonify(status)
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 
 import os
-import time
 
 from flask import Blueprint, render_template, redirect, url_for, \
     flash, request, jsonify, current_app
@@ -20,13 +19,14 @@ from clustermgr.tasks.server import collect_server_details
 from clustermgr.tasks.server import task_install_gluu_server, task_test
 
 from clustermgr.core.remote import RemoteClient, ClientNotSetupException
+from clustermgr.core.preflight import probe_matrix
 from ..core.license import license_required
 from ..core.license import license_reminder
 from ..core.license import prompt_license
 
 from clustermgr.core.utils import parse_setup_properties, \
     write_setup_properties_file, get_setup_properties, \
-    port_status_cmd, as_boolean, get_proplist
+    as_boolean, get_proplist
 
 from clustermgr.core.ldap_functions import getLdapConn
 
@@ -451,38 +451,6 @@ def get_ldap_stat(server_id):
     return "0"
 
 
-def test_port(server, client, port, port_status_cmd):
-    
-    try:
-        channel = server.client.get_transport().open_session()
-        channel.get_pty()
-        cmd = '''python -c "import time, socket;sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM); sock.bind(('{}', {})); sock.listen(5); time.sleep(20)"'''.format(server.ip, port)
-
-        if server.use_py3:
-            cmd = cmd.replace('python', 'python3')
-
-        channel.exec_command(cmd)
-
-        i = 1
-        while True:
-            if channel.exit_status_ready():
-                break
-            time.sleep(0.1)
-            cmd2 = port_status_cmd.format(server.ip, port)
-            if client.use_py3:
-                cmd2 = cmd2.replace('python', 'python3')
-
-            r = client.run(cmd2)
-            if r[1].strip()=='0':
-                return True
-            i += 1
-            if i > 5:
-                break
-    except Exception as e:
-        print(e)
-        return False
-
-
 @server_view.route('/dryrun/<int:server_id>')
 def dry_run(server_id):
 
@@ -508,20 +476,7 @@ def dry_run(server_id):
         print(e)
         pass
 
-    c.use_py3 = False
-    if c.run('which python3')[1].strip():
-        c.use_py3 = True
-
     if result['server']['ssh']:
-        #Test is any process listening ports that will be used by gluu-server
-        for p in server_ports:
-            cmd = port_status_cmd.format(server.ip, p)
-            if c.use_py3:
-                cmd = cmd.replace('python', 'python3')
-            r = c.run(cmd)
-            if r[1].strip()=='0':
-                result['server']['port_status'][p] = True
-
         ssh_port = 22
         if appconf.external_load_balancer:
             c_host = appconf.cache_host
@@ -538,23 +493,21 @@ def dry_run(server_id):
         except Exception as e:
             print(e)
 
-        c_nginx.use_py3 = False
-        if c_nginx.run('which python3')[1].strip():
-            c_nginx.use_py3 = True
-
-        if result['nginx']['ssh']:
-            for p in server_ports:
-                if not result['server']['port_status'][p]:
-                    r = test_port(c, c_nginx, p, port_status_cmd=port_status_cmd)
-                    if r:
-                        result['nginx']['port_status'][p] = True
-                else:
-                    cmd = port_status_cmd.format(server.ip, p)
-                    if c_nginx.use_py3:
-                        cmd = cmd.replace('python', 'python3')
-                    r = c_nginx.run(cmd)
-                    if r[1].strip()=='0':
-                        result['nginx']['port_status'][p] = True
+        #Test if any process is listening ports that will be used by
+        #gluu-server and whether they are reachable from nginx. Ports not
+        #listened are bound temporarily, all ports are probed at once.
+        sources = [('nginx', c_nginx)] if result['nginx']['ssh'] else []
+        matrix = probe_matrix(sources, [('server', c, server.ip)],
+                              server_ports)
+
+        listening = matrix['listening'].get('server') or {}
+        reachable = (matrix['reachable'].get('nginx') or {}).get('server') or {}
+        for p in server_ports:
+            result['server']['port_status'][p] = listening.get(p, False)
+            result['nginx']['port_status'][p] = reachable.get(p, False)
+
+        c_nginx.close()
+        c.close()
 
     return jsonify(result)
 
@@ -1,11 +1,172 @@
 """weblogger.py - flask extension providing storage facility via Redis.
 """
 
+import os
+import re
 import json
+import time
+import uuid
+import threading
 
+from clustermgr.config import Config
 from clustermgr.core.clustermgr_logging import web_logger as logger
 
 
+def _str(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class ListStore(object):
+    """Stores messages of a task in a Redis list, cursors are the number of
+    messages read.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def key(self, taskid):
+        return "{0}:{1}".format(self.prefix, taskid)
+
+    def write(self, r, batches):
+        pipe = r.pipeline(transaction=False)
+        for taskid, items in batches.items():
+            pipe.rpush(self.key(taskid), *items)
+            pipe.expire(self.key(taskid), Config.WEBLOGGER_TTL)
+        pipe.execute()
+
+    def read(self, r, taskid, cursor=None):
+        start = int(cursor or 0)
+        messages = r.lrange(self.key(taskid), start, -1) or []
+        return [(str(start + i + 1), json.loads(msg))
+                for i, msg in enumerate(messages)]
+
+    def delete(self, r, taskid):
+        r.delete(self.key(taskid))
+
+    def expire(self, r, taskid, timeout):
+        r.expire(self.key(taskid), timeout)
+
+
+class StreamStore(ListStore):
+    """Stores messages of a task in a Redis Stream, cursors are entry ids.
+
+    Streams are trimmed to about Config.WEBLOGGER_STREAM_MAXLEN entries.
+    Size and number of the messages each stream holds are counted, when the
+    total size exceeds Config.WEBLOGGER_MEMORY_BUDGET bytes, logs of the
+    tasks least recently written are removed, so that logs do not take the
+    memory of the broker and results sharing the same redis.
+    """
+
+    def __init__(self, prefix):
+        super(StreamStore, self).__init__(prefix)
+        self.tasks_key = "{0}-store:tasks".format(prefix)
+        self.sizes_key = "{0}-store:sizes".format(prefix)
+        self.counts_key = "{0}-store:counts".format(prefix)
+        self.total_key = "{0}-store:total".format(prefix)
+
+    def write(self, r, batches):
+        pipe = r.pipeline(transaction=False)
+        now = time.time()
+        written = 0
+        queued = 0
+        # index of the XLEN reply of each task in the replies of the pipeline
+        xlen_replies = {}
+        for taskid, items in batches.items():
+            for item in items:
+                pipe.xadd(self.key(taskid), {'msg': item},
+                          maxlen=Config.WEBLOGGER_STREAM_MAXLEN,
+                          approximate=True)
+            pipe.expire(self.key(taskid), Config.WEBLOGGER_TTL)
+            size = sum(len(item) for item in items)
+            pipe.zadd(self.tasks_key, {taskid: now})
+            pipe.hincrby(self.sizes_key, taskid, size)
+            pipe.hincrby(self.counts_key, taskid, len(items))
+            pipe.xlen(self.key(taskid))
+            queued += len(items) + 5
+            xlen_replies[taskid] = queued - 1
+            written += size
+        pipe.incrby(self.total_key, written)
+        replies = pipe.execute()
+        total = replies[-1]
+
+        trimmed = {}
+        for taskid, i in xlen_replies.items():
+            size, count, length = replies[i - 2], replies[i - 1], replies[i]
+            if length < count:
+                trimmed[taskid] = (size, count, length)
+        if trimmed:
+            total = self.count_trimmed(r, trimmed)
+
+        if Config.WEBLOGGER_MEMORY_BUDGET and \
+                total > Config.WEBLOGGER_MEMORY_BUDGET:
+            self.evict(r, keep=batches.keys())
+
+    def count_trimmed(self, r, trimmed):
+        """Scales counted sizes of trimmed streams down to the number of
+        entries they still hold.
+
+        Args:
+            trimmed (dict): task id to counted size, counted number of
+                entries and length of its stream
+
+        Returns:
+            int: the total size after the change
+        """
+        pipe = r.pipeline(transaction=False)
+        removed = 0
+        for taskid, (size, count, length) in trimmed.items():
+            kept = size * length // count
+            pipe.hset(self.sizes_key, taskid, kept)
+            pipe.hset(self.counts_key, taskid, length)
+            removed += size - kept
+        pipe.decrby(self.total_key, removed)
+        return pipe.execute()[-1]
+
+    def evict(self, r, keep=()):
+        """Removes logs of expired tasks, then logs of the tasks least
+        recently written until the total size is below 90% of the budget.
+        Logs of tasks in keep are not removed.
+        """
+        expired = r.zrangebyscore(self.tasks_key, '-inf',
+                                  time.time() - Config.WEBLOGGER_TTL)
+        for taskid in expired:
+            self.delete(r, _str(taskid))
+
+        # the total is counted again from the sizes of the tasks, so that it
+        # does not drift from them
+        r.set(self.total_key,
+              sum(int(size) for size in r.hvals(self.sizes_key)))
+
+        limit = Config.WEBLOGGER_MEMORY_BUDGET * 0.9
+        while int(r.get(self.total_key) or 0) > limit:
+            oldest = r.zrange(self.tasks_key, 0, 0)
+            if not oldest or _str(oldest[0]) in keep:
+                break
+            logger.warning("Log of task %s removed, log memory budget is "
+                           "exceeded", _str(oldest[0]))
+            self.delete(r, _str(oldest[0]))
+
+    def read(self, r, taskid, cursor=None):
+        start = '-' if cursor in (None, '', '0') else '(' + cursor
+        entries = r.xrange(self.key(taskid), min=start, max='+')
+        return [(_str(entry_id), json.loads(_str(
+                                    fields.get(b'msg', fields.get('msg')))))
+                for entry_id, fields in entries]
+
+    def delete(self, r, taskid):
+        size = int(r.hget(self.sizes_key, taskid) or 0)
+        pipe = r.pipeline(transaction=False)
+        pipe.delete(self.key(taskid))
+        pipe.zrem(self.tasks_key, taskid)
+        pipe.hdel(self.sizes_key, taskid)
+        pipe.hdel(self.counts_key, taskid)
+        pipe.decrby(self.total_key, size)
+        pipe.execute()
+
+
+STORES = {'list': ListStore, 'stream': StreamStore}
+
+
 class WebLogger(object):
     r = None
     """WebLogger is a Redis wrapper to store task logs for flask view access.
@@ -47,16 +208,33 @@ class WebLogger(object):
     Logging:
         Refer log()
 
+    Buffering:
+        Tasks may log tens of thousands of messages. After
+        enable_buffering() messages are kept in memory per task id and
+        written with one pipelined RPUSH and EXPIRE per task when
+        Config.WEBLOGGER_BATCH_SIZE messages are buffered, when the oldest
+        one is Config.WEBLOGGER_FLUSH_INTERVAL seconds old, or when flush()
+        is called. Celery tasks buffer their logs and flush them when they
+        end, see extensions.py and application.init_celery().
+
     Retrival:
-        Refer get_messages()
+        Refer get_messages(), messages after a cursor can be fetched with
+        its since argument
 
     Cleanup:
         Refer clean()
+
+    Storage:
+        Messages are stored by ListStore or StreamStore, selected by
+        Config.WEBLOGGER_STORE. Metadata of a task is kept in a hash.
     """
 
     def __init__(self, app=None):
         self.app = app
         self.prefix = 'weblogger'
+        self.buffering = False
+        self._pid = None
+        self._reset_buffer()
         if app is not None:
             self.init_app(app)
             self.r = app.config["CLUSTERMGR_REDIS"]
@@ -65,29 +243,117 @@ class WebLogger(object):
         if not self.r:
             self.r = app.config["CLUSTERMGR_REDIS"]
 
+    @property
+    def store(self):
+        store = getattr(self, '_store', None)
+        if type(store) is not STORES[Config.WEBLOGGER_STORE]:
+            store = self._store = STORES[Config.WEBLOGGER_STORE](self.prefix)
+        return store
+
 
     def __key(self, taskid):
         return "{0}:{1}".format(self.prefix, taskid)
 
+    def _reset_buffer(self):
+        self._lock = threading.RLock()
+        self._buffer = {}
+        self._buffered_since = {}
+
+    def enable_buffering(self):
+        """Buffers messages logged by this process from now on, and starts
+        a thread flushing them periodically.
+        """
+        self.buffering = True
+        if self._pid != os.getpid():
+            # buffer and lock of a parent process are not ours
+            self._pid = os.getpid()
+            self._reset_buffer()
+            flusher = threading.Thread(target=self._run_flusher,
+                                       name='weblogger-flush')
+            flusher.daemon = True
+            flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(Config.WEBLOGGER_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Flushing web logs failed: %s", e)
+
+    def flush(self, taskid=None):
+        """Writes buffered messages to Redis.
+
+        Args:
+            taskid (string, optional) - flush messages of this task only,
+                all tasks by default
+        """
+        with self._lock:
+            if taskid is None:
+                batches = self._buffer
+                self._buffer = {}
+                self._buffered_since = {}
+            elif taskid in self._buffer:
+                batches = {taskid: self._buffer.pop(taskid)}
+                self._buffered_since.pop(taskid, None)
+            else:
+                return
+            if batches:
+                self.store.write(self.r, batches)
+
+    def _spill(self, taskid, message):
+        """Stores messages longer than Config.WEBLOGGER_MAX_MESSAGE_BYTES
+        in a file and returns the truncated message and path of the file.
+        """
+        limit = Config.WEBLOGGER_MAX_MESSAGE_BYTES
+        encoded = message.encode('utf-8')
+        if not limit or len(encoded) <= limit:
+            return message, None
+
+        path = os.path.join(Config.WEBLOGGER_SPILL_DIR,
+                            re.sub(r'[^\w.-]', '_', str(taskid)),
+                            '{0}-{1}.log'.format(int(time.time()),
+                                                 uuid.uuid4().hex[:8]))
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(encoded)
+            note = '\n... {0} more bytes in {1}'.format(
+                                                len(encoded) - limit, path)
+        except (IOError, OSError) as e:
+            logger.error("Could not store long message: %s", e)
+            path = None
+            note = '\n... {0} more bytes'.format(len(encoded) - limit)
+
+        return encoded[:limit].decode('utf-8', 'ignore') + note, path
+
     def log(self, taskid, message, level=None, **kwargs):
         logger.debug(message.strip())
-        """R Pushes the message into REDIS as a list for that task id with the key
-        <app.name>:<taskid>.
+        """Pushes the message into REDIS to the log of that task id with the
+        key <app.name>:<taskid>.
 
         The message passed on would be converted to a dictionary with the
         structure:
         { 'msg : <your_message>, 'level': <your_level>,
           'other_keys_from_kwargs': <kwarg_value>
         }
-        This dictionary would be json dumped into a string and Rpushed into the
-        redis with the key `<app.name>:<task_id>`
+        This dictionary would be json dumped into a string and added to the
+        log in redis with the key `<app.name>:<task_id>`
 
         Args:
             taskid (string) - a unique id to identify the task
             message (string) - the log message to be stored
             level (string)  - levels like 'info', 'debug'. Defaults to info
+
+        Messages longer than Config.WEBLOGGER_MAX_MESSAGE_BYTES are
+        truncated, the whole message is stored in a file under
+        Config.WEBLOGGER_SPILL_DIR whose path is added as `spill`.
         """
-        logitem = {'msg': message.strip()}
+        logitem = {}
+        logitem['msg'], spill = self._spill(taskid, message.strip())
+        if spill:
+            logitem['spill'] = spill
         if level:
             logitem['level'] = level
         else:
@@ -96,24 +362,47 @@ class WebLogger(object):
         for k, v in kwargs.items():
             logitem[k] = v
 
-        self.r.rpush(self.__key(taskid), json.dumps(logitem))
-        self.r.expire(self.__key(taskid), 86400)  # TODO make this configurable
+        if not self.buffering:
+            self.store.write(self.r, {taskid: [json.dumps(logitem)]})
+            return
+
+        with self._lock:
+            items = self._buffer.setdefault(taskid, [])
+            items.append(json.dumps(logitem))
+            since = self._buffered_since.setdefault(taskid, time.time())
+            if len(items) >= Config.WEBLOGGER_BATCH_SIZE or \
+                    time.time() - since >= Config.WEBLOGGER_FLUSH_INTERVAL:
+                self.flush(taskid)
+
+
+    def read(self, taskid, cursor=None):
+        """Returns the messages pushed by a task after a cursor.
 
+        Args:
+            taskid (string) - The unique id of the task
+            cursor (string) - cursor of the last message read, all messages
+                are returned by default
+
+        Returns:
+            list of (cursor, message) tuples, the cursor of a message is
+            used to read the messages after it
+        """
+        self.flush(taskid)
+        return self.store.read(self.r, taskid, cursor)
 
-    def get_messages(self, taskid):
-        """Returns all the messages pushed by a task.
+    def get_messages(self, taskid, since=None):
+        """Returns the messages pushed by a task.
 
         Args:
             taskid (string) - The unique id of the task
+            since (string) - cursor of the last message read, only the
+                messages after it are returned, see read()
 
         Returns:
-            list of dicts containing all the messages posted with the given
+            list of dicts containing the messages posted with the given
             task id
         """
-        messages = self.r.lrange(self.__key(taskid), 0, -1)
-        if not messages:
-            return []
-        return [json.loads(msg) for msg in messages]
+        return [msg for cursor, msg in self.read(taskid, since)]
 
     def clean(self, taskid):
         """Removes the log for the particular task id
@@ -121,7 +410,11 @@ class WebLogger(object):
         Args:
             taskid (string) - the unique id of the task
         """
-        self.r.delete(self.__key(taskid))
+        with self._lock:
+            self._buffer.pop(taskid, None)
+            self._buffered_since.pop(taskid, None)
+        self.store.delete(self.r, taskid)
+        self.r.delete(self.__key(taskid) + ":meta")
 
     def set_meta(self, taskid, **kwargs):
         """Adds metadata for a task
@@ -129,9 +422,13 @@ class WebLogger(object):
         :param taskid: the unique id of the task
         :param kwargs: keyword arguments for the metadata key and value
         """
+        # metadata must not get ahead of the messages
+        self.flush(taskid)
         key = self.__key(taskid) + ":meta"
-        for (k, v) in kwargs.items():
-            self.r.set(key + ":" + k, v)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.hset(key, mapping=kwargs)
+        pipe.expire(key, Config.WEBLOGGER_TTL)
+        pipe.execute()
 
     def get_meta(self, taskid, key):
         """Retrieves a particular metadata for a task
@@ -140,8 +437,7 @@ class WebLogger(object):
         :param key: the key of the metadata
         :return: the metadata value
         """
-        key = self.__key(taskid) + ":meta:" + key
-        return self.r.get(key)
+        return self.r.hget(self.__key(taskid) + ":meta", key)
 
     def get_all_meta(self, taskid):
         """Retrieves all the metadata stored under a task id
@@ -149,12 +445,8 @@ class WebLogger(object):
         :param taskid: the unique id of the task
         :return: a dict of the metadata keys and their values
         """
-        keys = self.r.keys(self.__key(taskid) + ":meta:*")
-        data = dict()
-        for k in keys:
-            meta_key = k.replace(self.__key(taskid) + ":meta:", "")
-            data[meta_key] = self.r.get(k)
-        return data
+        meta = self.r.hgetall(self.__key(taskid) + ":meta")
+        return dict((_str(k), v) for k, v in meta.items())
 
     def clean_later(self, taskid, timeout):
         """Cleans the given key after the given timeout. Equivalent ot EXPIRE
@@ -164,5 +456,7 @@ class WebLogger(object):
         :param timeout: the number of seconds after which the task's logs have
             to be cleaned up
         """
-        self.r.expire(self.__key(taskid), timeout)
+        self.flush(taskid)
+        self.store.expire(self.r, taskid, timeout)
+        self.r.expire(self.__key(taskid) + ":meta", timeout)
 
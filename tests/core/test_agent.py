@@ -0,0 +1,124 @@
+import os
+import select
+import hashlib
+import subprocess
+import unittest
+
+from mock import patch, MagicMock
+
+from clustermgr.core.agent import NodeAgent, AgentError
+from clustermgr.core.remote import CommandResult
+
+
+class LocalChannel(object):
+    """Channel stub running the command as a local process."""
+
+    def __init__(self):
+        self.proc = None
+        self.closed = False
+
+    def exec_command(self, command):
+        self.proc = subprocess.Popen(command, shell=True,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+
+    def fileno(self):
+        return self.proc.stdout.fileno()
+
+    def _ready(self, stream):
+        return bool(select.select([stream], [], [], 0)[0])
+
+    def recv_ready(self):
+        return self._ready(self.proc.stdout)
+
+    def recv(self, size):
+        return os.read(self.proc.stdout.fileno(), size)
+
+    def recv_stderr_ready(self):
+        return self._ready(self.proc.stderr)
+
+    def recv_stderr(self, size):
+        return os.read(self.proc.stderr.fileno(), size)
+
+    def sendall(self, data):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def exit_status_ready(self):
+        return self.proc.poll() is not None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.proc.kill()
+            self.proc.wait()
+            for stream in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
+                stream.close()
+
+
+class NodeAgentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = MagicMock()
+        self.conn.host = 'server'
+        self.conn.client.get_transport.return_value.open_session.side_effect = \
+            lambda **kwargs: LocalChannel()
+        self.agent = NodeAgent(self.conn)
+
+    def tearDown(self):
+        self.agent.close()
+
+    def test_inline_agent_answers_typed_requests(self):
+        assert self.agent.start()
+        assert self.agent.uptime() > 0
+        assert self.agent.file_hash(__file__) == hashlib.sha256(
+                                        open(__file__, 'rb').read()).hexdigest()
+        stat = self.agent.stat([__file__, '/nonexistent'])
+        assert stat[__file__]['exists']
+        assert not stat['/nonexistent']['exists']
+        self.conn.run.assert_not_called()
+
+    def test_port_probe(self):
+        assert not self.agent.port_open('127.0.0.1', 1, timeout=1)
+
+    def test_failed_operation_raises_error_and_agent_keeps_running(self):
+        self.agent.start()
+        with self.assertRaises(AgentError):
+            self.agent.file_hash('/nonexistent')
+        assert self.agent.active
+        assert self.agent.call('ping') == 'pong'
+
+    def test_batched_port_probes(self):
+        assert self.agent.ports_open([('127.0.0.1', 1), ('127.0.0.1', 2)],
+                                     timeout=1) == [False, False]
+        assert self.agent.ports_open([]) == []
+
+    @patch('clustermgr.core.agent.NodeAgent._start_command',
+           return_value='exit 127')
+    def test_falls_back_to_shell_when_agent_cannot_start(self, start_command):
+        self.conn.run.return_value = ('', '12345.67 100.00\n', '')
+        assert self.agent.uptime() == 12345
+        assert self.agent.available is False
+        self.conn.run.assert_called_with('cat /proc/uptime')
+
+    def test_port_probes_fall_back_to_shell_when_agent_fails(self):
+        self.agent.start()
+        self.conn.run.return_value = ('', '0\n', '')
+        self.conn.run_batch.return_value = [CommandResult('0\n', '', 0),
+                                            CommandResult('1\n', '', 0)]
+        with patch.object(self.agent, 'call',
+                          side_effect=AgentError('Node agent exited')):
+            assert self.agent.port_open('10.0.0.2', 22)
+            assert self.agent.ports_open([('10.0.0.2', 22),
+                                          ('10.0.0.2', 23)]) == [True, False]
+
+    @patch('clustermgr.core.agent.NodeAgent._start_command',
+           return_value='exit 127')
+    def test_shell_fallback_quotes_paths(self, start_command):
+        self.conn.run.return_value = ('', 'abc  /tmp/it\'s\n', '')
+        assert self.agent.file_hash("/tmp/it's") == 'abc'
+        self.conn.run.assert_called_with("sha256sum '/tmp/it'\"'\"'s'")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import os
+import re
+import subprocess
+import unittest
+
+from mock import patch, MagicMock
+
+from clustermgr.core.remote import RemoteClient, CommandResult
+from clustermgr.core.shell_session import ShellSessionError, ShellSessionExited
+from clustermgr.core.clustermgr_installer import Installer, close_shells
+
+
+class PtyChannel(object):
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.closed = False
+        self.rfd, self.wfd = os.pipe()
+
+    def fileno(self):
+        return self.rfd
+
+    def get_pty(self):
+        pass
+
+    def exec_command(self, command):
+        pass
+
+    def recv_ready(self):
+        return bool(self.chunks)
+
+    def recv(self, size):
+        return self.chunks.pop(0)
+
+    def exit_status_ready(self):
+        return not self.chunks
+
+    def close(self):
+        self.closed = True
+
+
+class RunChannelCommandTestCase(unittest.TestCase):
+    def setUp(self):
+        conn = RemoteClient('server', passphrase='pw', pooled=False)
+        conn.client = MagicMock()
+        self.transport = conn.client.get_transport.return_value
+        self.installer = Installer(conn, '4.2.0', server_os='Ubuntu 20',
+                                   logger_task_id='task', server_id=1)
+
+    @patch('clustermgr.core.clustermgr_installer.wlogger')
+    def test_progress_lines_are_collapsed(self, wlogger):
+        self.transport.open_session.return_value = PtyChannel([
+            b'Unpacking gluu\n[ 10%]\n[ 50',
+            b'%]\n[100%]\nSetting up gluu\n',
+        ])
+        tail, log_id, seen = self.installer.run_channel_command(
+            'apt-get install gluu', [re.compile(r'\[(\s|\w|%)*\]')],
+            watch=['half-installed'])
+
+        levels = [c[0][2] for c in wlogger.log.call_args_list]
+        messages = [c[0][1] for c in wlogger.log.call_args_list]
+        assert levels == ['debug', 'debug', 'debug', 'debugc', 'debug']
+        assert messages[3] == '[100%]'
+        assert messages[4] == 'Setting up gluu'
+        assert tail.splitlines()[-1] == 'Setting up gluu'
+        assert log_id == 1
+        assert not seen
+
+    @patch('clustermgr.core.clustermgr_installer.wlogger')
+    def test_watched_strings_are_reported(self, wlogger):
+        self.transport.open_session.return_value = PtyChannel([
+            b'dpkg: package is in a very bad inconsistent state; '
+            b'half-installed\n',
+        ])
+        tail, log_id, seen = self.installer.run_channel_command(
+            'apt-get install gluu', [], watch=['half-installed'])
+        assert seen == set(['half-installed'])
+
+
+class RunScriptTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = RemoteClient('server', passphrase='pw', pooled=False)
+        self.conn.client = MagicMock()
+        self.conn.run = MagicMock(side_effect=self.run_locally)
+        self.installer = Installer(self.conn, 'nochroot-4.2.0',
+                                   server_os='Ubuntu 20')
+
+    def run_locally(self, command, timeout=None, input=None):
+        p = subprocess.Popen(['sh', '-c', command], stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate(input.encode() if input else None)
+        return CommandResult(out.decode(), err.decode(), p.returncode)
+
+    def test_script_is_sent_over_stdin(self):
+        result = self.installer.run_script(
+            "secret=$'s3cr3t'\ncat\necho \"$secret\"\nexit 4")
+        self.conn.run.assert_called_once()
+        command = self.conn.run.call_args[0][0]
+        assert command == 'bash -s'
+        assert result.stdout == 's3cr3t\n'
+        assert result.exit_status == 4
+
+    def test_secrets_are_passed_as_files(self):
+        result = self.installer.run_script(
+            'cat "$pw_file"; echo; stat -c %a "$pw_file"; echo "$pw_file"',
+            secrets={'pw_file': "pa$s 'w\"d"})
+        password, mode, path = result.stdout.splitlines()
+        assert password == "pa$s 'w\"d"
+        assert mode == '600'
+        assert not os.path.exists(path)
+
+
+class ShellSessionFallbackTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = RemoteClient('server', passphrase='pw', pooled=False)
+        self.conn.client = MagicMock()
+        self.conn.run = MagicMock(return_value=CommandResult('nested', '', 0))
+        self.installer = Installer(self.conn, '4.2.0', server_os='Ubuntu 20')
+        patcher = patch('clustermgr.core.clustermgr_installer.ShellSession')
+        self.session_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.session = self.session_class.return_value
+
+    def test_failed_session_is_dropped_and_command_rerun(self):
+        self.session.run.side_effect = ShellSessionError('channel closed')
+        result = self.installer.run('ls /opt', nolog=True)
+
+        assert result.stdout == 'nested'
+        self.conn.run.assert_called_once()
+        self.session.close.assert_called_once()
+        assert self.installer.shell is None
+
+        # a new session is started for the next command
+        self.session.run.side_effect = None
+        self.session.run.return_value = CommandResult('shell', '', 0)
+        assert self.installer.run('ls /opt', nolog=True).stdout == 'shell'
+        assert self.session_class.call_count == 2
+
+    def test_installer_commands_have_no_deadline(self):
+        self.session.run.return_value = CommandResult('shell', '', 0)
+        self.installer.run('ls /opt', nolog=True)
+        self.session.run.assert_called_with('ls /opt', timeout=0)
+        self.installer.run('ls /opt', inside=False, nolog=True)
+        self.conn.run.assert_called_with('ls /opt', timeout=0)
+
+    def test_command_is_not_rerun_when_shell_exits_while_running_it(self):
+        self.session.run.side_effect = ShellSessionExited(
+                                'Shell session exited: ', 'partial', '')
+        result = self.installer.run('ls /opt', nolog=True)
+
+        assert result.stdout == 'partial'
+        assert result.exit_status is None
+        self.conn.run.assert_not_called()
+        assert self.installer.shell is None
+
+    def test_sessions_are_closed_when_task_ends(self):
+        self.session.run.return_value = CommandResult('shell', '', 0)
+        self.installer.run('ls /opt', nolog=True)
+        assert self.installer.shell is not None
+
+        close_shells()
+        self.session.close.assert_called_once()
+        assert self.installer.shell is None
+
+
+if __name__ == '__main__':
+    unittest.main()
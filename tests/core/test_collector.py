@@ -0,0 +1,112 @@
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from mock import MagicMock, patch
+
+# scripts are run from their directory on the nodes
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'clustermgr', 'monitoring_scripts'))
+
+import collector
+import sqlite_monitoring_tables
+
+
+class CollectorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.con = sqlite3.connect(os.path.join(self.dir, 'monitoring.sqlite3'))
+        self.addCleanup(self.con.close)
+        sqlite_monitoring_tables.create_tables(self.con)
+        self.collector = collector.Collector(self.con, {
+                    'interval': 15,
+                    'retention': sqlite_monitoring_tables.default_retention})
+        patcher = patch.object(collector, 'get_ldap_admin_password',
+                               return_value='secret')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ldap_connection(self):
+        conn = MagicMock()
+        conn.bind.return_value = True
+        conn.response = [{'raw_attributes': dict(
+                    (a, [b'7']) for a in collector.attr_list)}]
+        return conn
+
+    def test_tick_writes_all_tables_at_one_time(self):
+        with patch.object(collector, 'Connection',
+                          return_value=self.ldap_connection()):
+            self.collector.tick()
+
+        times = set()
+        for table in ('cpu_info', 'cpu_percent', 'load_average', 'mem_usage',
+                      'disk_usage', 'net_io', 'ldap_mon'):
+            rows = self.con.execute(
+                        'SELECT * FROM `{0}`'.format(table)).fetchall()
+            assert len(rows) == 1, table
+            times.add(rows[0][0])
+        assert len(times) == 1
+        assert self.con.execute('SELECT * FROM ldap_mon').fetchone()[1:] == \
+            (7, 7, 7, 7)
+        assert self.con.execute(
+                    'SELECT COUNT(*) FROM cpu_percent_1m').fetchone()[0] == 1
+
+    def test_ldap_connection_is_kept_between_ticks(self):
+        conn = self.ldap_connection()
+        with patch.object(collector, 'Connection',
+                          return_value=conn) as connection:
+            self.collector.tick()
+            self.collector.tick()
+        assert connection.call_count == 1
+        assert conn.search.call_count == 2
+
+    def test_failed_ldap_connection_is_retried_later(self):
+        conn = self.ldap_connection()
+        conn.bind.return_value = False
+        with patch.object(collector, 'Connection',
+                          return_value=conn) as connection:
+            self.collector.tick()
+            self.collector.tick()
+        assert connection.call_count == 1
+        assert self.con.execute(
+                    'SELECT COUNT(*) FROM ldap_mon').fetchone()[0] == 0
+        assert self.con.execute(
+                    'SELECT COUNT(*) FROM cpu_info').fetchone()[0] == 2
+
+    def test_rates_are_computed_from_previous_tick(self):
+        interfaces = self.collector.columns['net_io']
+        samples = [
+            {'ldap_mon': [10, 10, 10, 10],
+             'net_io': [1000] * len(interfaces)},
+            {'ldap_mon': [40, 10, 5, 160],
+             'net_io': [1300] * len(interfaces)},
+            ]
+        with patch.object(self.collector, 'sample', side_effect=samples), \
+                patch.object(collector, 'time') as clock:
+            clock.time.side_effect = [1000, 1015]
+            self.collector.tick()
+            self.collector.tick()
+
+        assert self.con.execute(
+                    'SELECT * FROM ldap_mon_rate').fetchall() == \
+            [(1015, 2.0, 0.0, None, 10.0)]
+        rows = self.con.execute('SELECT * FROM net_io_rate').fetchall()
+        assert rows == [tuple([1015] + [20.0] * len(interfaces))]
+        # cumulative counters are kept
+        assert self.con.execute(
+                    'SELECT COUNT(*) FROM ldap_mon').fetchone()[0] == 2
+
+    def test_failed_tick_does_not_stop_collector(self):
+        with patch.object(self.collector, 'tick',
+                          side_effect=[OSError('stale mount'), SystemExit]) \
+                as tick, patch.object(collector.time, 'sleep'):
+            self.assertRaises(SystemExit, self.collector.run)
+        assert tick.call_count == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
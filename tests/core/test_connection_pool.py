@@ -0,0 +1,89 @@
+import unittest
+
+from mock import MagicMock, patch
+
+from clustermgr.core.connection_pool import ConnectionPool, \
+    PoolExhaustedException
+
+
+def make_connect():
+    def connect():
+        client = MagicMock(name="client")
+        client.get_transport.return_value.is_active.return_value = True
+        return client, MagicMock(name="sftp")
+    return MagicMock(side_effect=connect)
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_per_host=2, max_idle=60, keepalive=15,
+                                   lease_timeout=0)
+        self.key = ('server', '0.0.0.0', 22, 'root')
+
+    def test_lease_makes_new_connection_with_keepalive(self):
+        connect = make_connect()
+        conn = self.pool.lease(self.key, connect)
+        connect.assert_called_once_with()
+        conn.client.get_transport.return_value.set_keepalive.assert_called_with(15)
+
+    def test_released_connection_is_reused(self):
+        connect = make_connect()
+        conn = self.pool.lease(self.key, connect)
+        self.pool.release(conn)
+        again = self.pool.lease(self.key, connect)
+        assert again is conn
+        assert connect.call_count == 1
+        assert again.leases == 2
+
+    def test_dead_connection_is_not_reused(self):
+        connect = make_connect()
+        conn = self.pool.lease(self.key, connect)
+        self.pool.release(conn)
+        conn.client.get_transport.return_value.is_active.return_value = False
+        again = self.pool.lease(self.key, connect)
+        assert again is not conn
+        conn.client.close.assert_called_once_with()
+        assert self.pool.stats()[self.key] == (1, 0)
+
+    def test_per_host_cap_raises_when_exhausted(self):
+        connect = make_connect()
+        self.pool.lease(self.key, connect)
+        self.pool.lease(self.key, connect)
+        with self.assertRaises(PoolExhaustedException):
+            self.pool.lease(self.key, connect)
+        # other hosts are not affected by the cap
+        self.pool.lease(('other', None, 22, 'root'), connect)
+
+    def test_failed_connect_frees_slot(self):
+        connect = MagicMock(side_effect=IOError)
+        for _ in range(3):
+            with self.assertRaises(IOError):
+                self.pool.lease(self.key, connect)
+        assert self.pool.stats()[self.key] == (0, 0)
+
+    @patch('clustermgr.core.connection_pool.time.time')
+    def test_idle_connections_are_evicted(self, mocktime):
+        mocktime.return_value = 1000
+        connect = make_connect()
+        conn = self.pool.lease(self.key, connect)
+        self.pool.release(conn)
+        mocktime.return_value = 1061
+        self.pool.prune()
+        conn.client.close.assert_called_once_with()
+        assert self.pool.stats()[self.key] == (0, 0)
+
+    @patch('clustermgr.core.connection_pool.os.getpid')
+    def test_connections_are_not_shared_after_fork(self, mockpid):
+        mockpid.return_value = 1
+        pool = ConnectionPool()
+        connect = make_connect()
+        conn = pool.lease(self.key, connect)
+        pool.release(conn)
+        mockpid.return_value = 2
+        again = pool.lease(self.key, connect)
+        assert again is not conn
+        conn.client.close.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
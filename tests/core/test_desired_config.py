@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+from mock import MagicMock, patch
+
+from clustermgr.core.remote import RemoteClient, CommandResult
+from clustermgr.core.desired_config import ConfigFile, apply, plan, \
+    fetch_state, scan, CHANGED, UNCHANGED, MISSING
+
+
+def run_locally(command, timeout=None, input=None):
+    p = subprocess.Popen(['sh', '-c', command], stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    return CommandResult(out.decode(), err.decode(), p.returncode)
+
+
+def put_file(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    return True
+
+
+class DesiredConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        conn = RemoteClient('server', passphrase='pw', pooled=False)
+        conn.run = MagicMock(side_effect=run_locally)
+        self.installer = MagicMock()
+        self.installer.conn = conn
+        self.installer.put_file.side_effect = put_file
+
+        self.conf = os.path.join(self.dir, 'stunnel.conf')
+        self.hosts = os.path.join(self.dir, 'hosts')
+        put_file(self.conf, 'accept = 6379\n')
+        put_file(self.hosts, '127.0.0.1 localhost\n')
+
+    def files(self, port):
+        add_host = lambda hosts: hosts if 'node' in hosts else \
+            hosts + '10.0.0.2 node\n'
+        return [
+            ConfigFile(self.conf, content='accept = {}\n'.format(port),
+                       services=['stunnel']),
+            ConfigFile(self.hosts, edit=add_host),
+            ConfigFile(os.path.join(self.dir, 'missing'), edit=add_host),
+            ]
+
+    def test_state_of_all_files_is_fetched_in_one_round_trip(self):
+        statuses = [status for f, status, content in plan(
+                                        self.installer.conn, self.files(6379))]
+        assert statuses == [UNCHANGED, CHANGED, MISSING]
+        self.installer.conn.run.assert_called_once()
+
+    def test_only_changed_files_are_written_and_restarted(self):
+        status = apply(self.installer, self.files(6380))
+        assert status[self.conf] == CHANGED
+        assert status[self.hosts] == CHANGED
+        assert open(self.conf).read() == 'accept = 6380\n'
+        assert open(self.hosts).read().endswith('10.0.0.2 node\n')
+        self.installer.restart_service.assert_called_once_with(
+                                                    'stunnel', inside=False)
+
+        self.installer.reset_mock()
+        status = apply(self.installer, self.files(6380))
+        assert status[self.conf] == UNCHANGED
+        assert status[self.hosts] == UNCHANGED
+        self.installer.put_file.assert_not_called()
+        self.installer.restart_service.assert_not_called()
+
+    def test_checksum_of_missing_file_is_none(self):
+        missing = ConfigFile(os.path.join(self.dir, 'missing'), content='')
+        state = fetch_state(self.installer.conn, [missing])
+        assert state[missing.path] is None
+
+    def test_scan_reports_drifted_files_without_writing(self):
+        servers = [MagicMock(id=1, hostname='server1'),
+                   MagicMock(id=2, hostname='server2')]
+        failing = RemoteClient('server2', passphrase='pw', pooled=False)
+        failing.startup = MagicMock(side_effect=IOError('unreachable'))
+        clients = {'server1': self.installer.conn, 'server2': failing}
+        self.installer.conn.startup = MagicMock()
+
+        with patch('clustermgr.core.fanout.RemoteClient',
+                   side_effect=lambda host, **kwargs: clients[host]):
+            drift = scan(servers, lambda server: self.files(6380))
+
+        assert drift == {1: [self.conf, self.hosts], 2: None}
+        assert open(self.conf).read() == 'accept = 6379\n'
+
+
+if __name__ == '__main__':
+    unittest.main()
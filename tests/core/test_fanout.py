@@ -0,0 +1,68 @@
+import time
+import unittest
+
+from mock import patch
+
+from clustermgr.core.fanout import run_on_all
+
+
+class FakeServer(object):
+    def __init__(self, id, hostname):
+        self.id = id
+        self.hostname = hostname
+        self.ip = None
+        self.ssh_port = 22
+
+
+class RunOnAllTestCase(unittest.TestCase):
+    def setUp(self):
+        self.servers = [FakeServer(i, 'server{}'.format(i)) for i in range(5)]
+
+    def test_results_are_in_server_order(self):
+        results = run_on_all(self.servers, lambda s: s.id * 2, connect=False)
+        assert [r.server for r in results] == self.servers
+        assert [r.value for r in results] == [0, 2, 4, 6, 8]
+        assert all(r.ok for r in results)
+
+    def test_hosts_run_concurrently(self):
+        start = time.time()
+        run_on_all(self.servers, lambda s: time.sleep(0.2), connect=False)
+        assert time.time() - start < 0.6
+
+    def test_errors_are_reported_per_host(self):
+        def unit(server):
+            if server.id == 3:
+                raise IOError("unreachable")
+            return True
+
+        results = run_on_all(self.servers, unit, connect=False)
+        assert not results[3].ok
+        assert isinstance(results[3].error, IOError)
+        assert all(r.ok for i, r in enumerate(results) if i != 3)
+
+    def test_slow_host_times_out_with_partial_results(self):
+        def unit(server):
+            if server.id == 1:
+                time.sleep(2)
+            return server.hostname
+
+        start = time.time()
+        results = run_on_all(self.servers, unit, deadline=0.3, connect=False)
+        assert time.time() - start < 1.5
+        assert results[1].timed_out
+        assert not results[1].ok
+        assert results[0].value == 'server0'
+
+    @patch('clustermgr.core.fanout.RemoteClient')
+    def test_command_is_run_with_remote_client(self, mockclient):
+        instance = mockclient.return_value
+        instance.run.return_value = ('', '0', '')
+        results = run_on_all(self.servers[:1], 'uptime')
+        mockclient.assert_called_with('server0', ip=None, ssh_port=22)
+        instance.run.assert_called_with('uptime')
+        instance.close.assert_called_with()
+        assert results[0].value == ('', '0', '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+
+from mock import patch, MagicMock
+
+from clustermgr.core import host_facts
+from clustermgr.core.remote import CommandResult
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.data = {}
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = value
+
+    def expire(self, key, ttl):
+        pass
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+def run_batch(commands):
+    results = [
+        CommandResult('/etc/os-release\nNAME="Ubuntu"\nVERSION="20.04 LTS"\n',
+                      '', 0),
+        CommandResult('Manifest-Version: 1.0\n'
+                      'Implementation-Version: 4.2.1.Final\n', '', 0),
+        CommandResult('', 'not found', 9),
+        ]
+    for cmd in commands[3:]:
+        marker = cmd.split()[2]
+        exists = marker.endswith(('.last', 'oxauth', 'identity'))
+        results.append(CommandResult('1\n' if exists else '', '',
+                                     0 if exists else 1))
+    return results
+
+
+class HostFactsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.conn = MagicMock()
+        self.conn.host = 'server'
+        self.conn.run_batch.side_effect = run_batch
+
+    def test_gather_collects_facts_in_one_round_trip(self):
+        facts = host_facts.gather(self.conn)
+        self.conn.run_batch.assert_called_once()
+        self.conn.run.assert_not_called()
+        assert facts['os'] == 'Ubuntu 20'
+        assert facts['gluu_installed']
+        assert facts['components'] == ['oxAuth', 'oxTrust']
+        assert facts['gluu_version'] == '4.2.1'
+        assert facts['dist_gluu_version'] is None
+
+    @patch('clustermgr.core.host_facts._redis')
+    def test_facts_are_cached_until_invalidated(self, redis):
+        redis.return_value = FakeRedis()
+        assert host_facts.peek('server') is None
+        host_facts.get(self.conn)
+        assert host_facts.get(self.conn)['os'] == 'Ubuntu 20'
+        assert host_facts.peek('server')['gluu_installed']
+        self.conn.run_batch.assert_called_once()
+
+        host_facts.invalidate('server')
+        host_facts.get(self.conn)
+        assert self.conn.run_batch.call_count == 2
+
+    @patch('clustermgr.core.host_facts._redis')
+    def test_facts_of_failed_gather_are_not_cached(self, redis):
+        redis.return_value = FakeRedis()
+        self.conn.run_batch.side_effect = lambda commands: [
+                    CommandResult('', 'Connection reset') for cmd in commands]
+
+        facts = host_facts.get(self.conn)
+        assert facts['os'] is None
+        assert not facts['complete']
+        assert host_facts.peek('server') is None
+
+        self.conn.run_batch.side_effect = run_batch
+        assert host_facts.get(self.conn)['os'] == 'Ubuntu 20'
+        assert host_facts.peek('server')['complete']
+
+
+if __name__ == '__main__':
+    unittest.main()
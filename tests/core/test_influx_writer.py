@@ -0,0 +1,81 @@
+import unittest
+
+from mock import MagicMock, patch
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+
+from clustermgr.config import Config
+from clustermgr.core.influx_writer import InfluxWriter
+
+
+class InfluxWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = MagicMock()
+        patcher = patch('clustermgr.core.influx_writer.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def written(self):
+        return [call[0][0] for call in self.client.write.call_args_list]
+
+    def test_points_are_written_as_line_protocol(self):
+        writer = InfluxWriter('gluu_monitoring', client=self.client)
+        writer.add('c1_cpu_percent', {'cpu_percent': 1.5, 'count': 2,
+                                      'missing': None}, time=1600000000)
+        writer.add('logs', {'message': 'say "hi", bye'},
+                   tags={'hostname': 'c 1', 'os': ''},
+                   time='2018-01-19T15:09:12.096Z')
+        assert writer.close()
+
+        assert self.written() == [[
+            'c1_cpu_percent count=2i,cpu_percent=1.5 1600000000',
+            'logs,hostname=c\\ 1 message="say \\"hi\\", bye" 1516374552',
+            ]]
+        self.client.write.assert_called_with(
+                    self.written()[0],
+                    params={'db': 'gluu_monitoring', 'precision': 's'},
+                    protocol='line')
+
+    def test_duplicate_points_are_written_once(self):
+        writer = InfluxWriter('gluu_monitoring', client=self.client)
+        for value in (1, 2, 3):
+            writer.add('c1_uptime', {'uptime': value}, time=1600000000)
+        writer.add('c1_uptime', {'uptime': 4}, time=1600000060)
+        assert writer.close()
+
+        assert self.written() == [['c1_uptime uptime=3i 1600000000',
+                                   'c1_uptime uptime=4i 1600000060']]
+        assert writer.points == 2
+
+    def test_points_are_written_in_batches(self):
+        writer = InfluxWriter('gluu_log', precision='n', batch_size=2,
+                              client=self.client)
+        for t in range(5):
+            writer.add_point({'measurement': 'logs', 'time': t,
+                              'fields': {'message': 'log'}})
+        assert len(self.written()) == 2
+        assert writer.close()
+        assert [len(lines) for lines in self.written()] == [2, 2, 1]
+
+    def test_failed_writes_are_retried_with_backoff(self):
+        self.client.write.side_effect = [InfluxDBServerError('timeout'),
+                                         IOError('reset'), None]
+        writer = InfluxWriter('gluu_monitoring', client=self.client)
+        writer.add('c1_uptime', {'uptime': 1}, time=1600000000)
+
+        with patch.object(Config, 'INFLUX_RETRY_BACKOFF', 2):
+            assert writer.close()
+        assert self.client.write.call_count == 3
+        assert [c[0][0] for c in self.sleep.call_args_list] == [2, 4]
+
+    def test_rejected_points_are_not_retried(self):
+        self.client.write.side_effect = InfluxDBClientError('bad', code=400)
+        writer = InfluxWriter('gluu_monitoring', client=self.client)
+        writer.add('c1_uptime', {'uptime': 1}, time=1600000000)
+
+        assert not writer.close()
+        assert self.client.write.call_count == 1
+        assert writer.failed == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from clustermgr.config import Config
+from clustermgr.core import log_archive
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+
+def task_entries(task_id):
+    return [(str(i), {'msg': '{0} message {1}'.format(task_id, i),
+                      'level': 'fail' if i == 2 else 'info',
+                      'server_id': i % 2 + 1})
+            for i in range(1, 4)]
+
+
+class LogArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.redis = FakeRedis()
+        for patcher in (
+                patch.object(Config, 'TASK_LOG_ARCHIVE_DIR', self.dir),
+                patch.object(Config, 'CLUSTERMGR_REDIS', self.redis, create=True),
+                patch('clustermgr.core.log_archive.wlogger')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        log_archive.wlogger.read.side_effect = task_entries
+
+    def test_logs_are_appended_as_gzip_members_and_indexed(self):
+        first = log_archive.archive('task1', 'SUCCESS', start=1.0)
+        second = log_archive.archive('task2', 'FAILURE')
+        log_archive.wlogger.clean.assert_called_with('task2')
+
+        assert first['servers'] == ['1', '2']
+        assert first['errors'] == 1
+        assert second['offset'] == first['offset'] + first['length']
+
+        # the archive is a valid gzip file having both logs
+        with gzip.open(os.path.join(self.dir, first['file'])) as f:
+            lines = f.read().decode().splitlines()
+        assert len(lines) == 6
+        assert json.loads(lines[3])[1]['msg'] == 'task2 message 1'
+
+    def test_log_is_read_by_seeking_from_cursor(self):
+        log_archive.archive('task1', 'SUCCESS')
+        log_archive.archive('task2', 'SUCCESS')
+        assert log_archive.read('task2') == task_entries('task2')
+        assert log_archive.read('task2', '2') == task_entries('task2')[2:]
+        assert log_archive.read('task3') is None
+
+        # entries not cached in redis are found in the index
+        self.redis.data.clear()
+        assert log_archive.find('task1')['status'] == 'SUCCESS'
+        assert [e['task_id'] for e in log_archive.tasks(server_id=1)] == [
+                                                            'task2', 'task1']
+
+    def test_index_is_scanned_from_its_end(self):
+        for i in range(5):
+            log_archive.archive('task{0}'.format(i), 'SUCCESS')
+        self.redis.data.clear()
+
+        with patch.object(Config, 'TASK_LOG_ARCHIVE_SCAN', 3):
+            assert [e['task_id'] for e in log_archive.recent_entries()] == [
+                                                'task4', 'task3', 'task2']
+            assert log_archive.find('task3')['task_id'] == 'task3'
+            assert log_archive.find('task0') is None
+
+        # a miss is remembered, the cached entry of an archived log wins
+        assert log_archive.find('task0') is None
+        log_archive.wlogger.read.side_effect = task_entries
+        log_archive.archive('task0', 'FAILURE')
+        assert log_archive.find('task0')['status'] == 'FAILURE'
+
+    def test_blocks_of_large_index_are_joined(self):
+        for i in range(400):
+            log_archive.archive('task{0}'.format(i), 'SUCCESS')
+        entries = list(log_archive.recent_entries(1000))
+        assert len(entries) == 400
+        assert entries[0]['task_id'] == 'task399'
+        assert entries[-1]['task_id'] == 'task0'
+
+
+if __name__ == '__main__':
+    unittest.main()
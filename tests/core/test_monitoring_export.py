@@ -0,0 +1,70 @@
+import io
+import os
+import json
+import zlib
+import base64
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from mock import patch
+
+from clustermgr.monitoring_scripts import get_data
+
+
+class MonitoringExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        with sqlite3.connect(os.path.join(
+                                self.dir, 'gluu_monitoring.sqlite3')) as con:
+            con.execute('CREATE TABLE cpu_percent (time INT, cpu_percent REAL)')
+            con.execute('CREATE TABLE load_average (time INT, load_avg REAL)')
+            con.executemany('INSERT INTO cpu_percent VALUES (?, ?)',
+                            [(100, 1.5), (200, 2.5), (300, 3.5)])
+
+    def export(self, watermarks):
+        stdout = io.StringIO()
+        with patch.object(get_data, 'data_dir', self.dir), \
+                patch('sys.stdin', io.StringIO(watermarks)), \
+                patch('sys.stdout', stdout):
+            get_data.export_stats()
+        return json.loads(zlib.decompress(base64.b64decode(
+                                                stdout.getvalue().strip())))
+
+    def test_new_rows_of_all_measurements_are_exported_at_once(self):
+        data = self.export(json.dumps(
+                    {'cpu_percent': 100, 'load_average': 0, 'missing': 0}))
+
+        assert data['uptime'] > 0
+        assert data['stats']['cpu_percent'] == {
+                        'fields': ['time', 'cpu_percent'],
+                        'columns': [[200, 300], [2.5, 3.5]]}
+        assert data['stats']['load_average']['columns'] == []
+        assert 'missing' not in data['stats']
+
+    def test_expired_periods_are_filled_from_rollups(self):
+        with sqlite3.connect(os.path.join(
+                                self.dir, 'gluu_monitoring.sqlite3')) as con:
+            con.execute('CREATE TABLE cpu_percent_1m (time INTEGER PRIMARY KEY,'
+                        ' cpu_percent REAL)')
+            con.execute('CREATE TABLE cpu_percent_1h (time INTEGER PRIMARY KEY,'
+                        ' cpu_percent REAL)')
+            con.executemany('INSERT INTO cpu_percent_1m VALUES (?, ?)',
+                            [(60, 1.0), (120, 2.0)])
+            con.executemany('INSERT INTO cpu_percent_1h VALUES (?, ?)',
+                            [(-3600, 0.5), (0, 1.5)])
+
+        data = self.export(json.dumps({'cpu_percent': -7200}))
+        assert data['stats']['cpu_percent']['columns'] == [
+                    [-3600, 0, 60, 100, 200, 300],
+                    [0.5, 1.5, 1.0, 1.5, 2.5, 3.5]]
+
+        data = self.export(json.dumps({'cpu_percent': 100}))
+        assert data['stats']['cpu_percent']['columns'] == [[200, 300],
+                                                          [2.5, 3.5]]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from clustermgr.config import Config
+from clustermgr.core import monitoring_state
+
+
+class MonitoringStateTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from redislite import Redis
+        cls.dir = tempfile.mkdtemp()
+        cls.redis = Redis(os.path.join(cls.dir, 'redis.db'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.redis.shutdown()
+        shutil.rmtree(cls.dir)
+
+    def setUp(self):
+        self.redis.flushdb()
+        patcher = patch.object(Config, 'CLUSTERMGR_REDIS', self.redis,
+                               create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_overrunning_host_is_skipped(self):
+        token = monitoring_state.acquire('server1')
+        assert token
+        assert monitoring_state.acquire('server1') is None
+        assert monitoring_state.acquire('server2')
+
+        # a stale token does not release the lock of a later collection
+        monitoring_state.release('server1', 'stale')
+        assert monitoring_state.acquire('server1') is None
+        monitoring_state.release('server1', token)
+        assert monitoring_state.acquire('server1')
+
+    def test_freshness_of_hosts(self):
+        started = time.time()
+        monitoring_state.record_skipped('server1')
+        monitoring_state.record('server1', started)
+        monitoring_state.record_skipped('server1')
+        monitoring_state.record('server2', started, error='timed out')
+
+        state = monitoring_state.freshness(['server1', 'server2', 'server3'])
+        assert state['server1']['age'] < 5
+        assert state['server1']['skipped'] == 1
+        assert state['server1']['error'] is None
+        assert state['server2']['error'] == 'timed out'
+        assert state['server2']['age'] is None
+        assert state['server3']['last_attempt'] is None
+
+    def test_watermarks_are_cached_per_host(self):
+        monitoring_state.set_watermark('server1', 'cpu_info', 1600000000)
+        assert monitoring_state.get_watermarks(
+                            'server1', ['cpu_info', 'mem_usage']) == {
+                                'cpu_info': 1600000000, 'mem_usage': None}
+        assert monitoring_state.get_watermarks(
+                            'server2', ['cpu_info'])['cpu_info'] is None
+
+        monitoring_state.clear_watermarks('server1')
+        assert monitoring_state.get_watermarks(
+                            'server1', ['cpu_info'])['cpu_info'] is None
+
+
+if __name__ == '__main__':
+    unittest.main()
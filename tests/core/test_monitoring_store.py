@@ -0,0 +1,84 @@
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from mock import patch
+
+from clustermgr.monitoring_scripts import sqlite_monitoring_tables as store
+
+
+class MonitoringStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.con = sqlite3.connect(os.path.join(self.dir, 'monitoring.sqlite3'))
+        self.addCleanup(self.con.close)
+        store.create_tables(self.con)
+
+    def rows(self, table):
+        return self.con.execute(
+                'SELECT * FROM `{0}` ORDER BY time'.format(table)).fetchall()
+
+    def test_tables_are_indexed_and_use_wal(self):
+        assert self.con.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        indexes = [ r[0] for r in self.con.execute(
+                        "SELECT name FROM sqlite_master WHERE type='index'") ]
+        assert 'cpu_percent_time' in indexes
+        plan = self.con.execute('EXPLAIN QUERY PLAN SELECT * FROM cpu_percent '
+                                'WHERE time > 100').fetchall()
+        assert 'cpu_percent_time' in plan[0][-1]
+
+        # creating again keeps the data
+        self.con.execute('INSERT INTO cpu_percent VALUES (100, 1.5)')
+        store.create_tables(self.con)
+        assert self.rows('cpu_percent') == [(100, 1.5)]
+
+    def test_rollups_are_updated_incrementally(self):
+        self.con.executemany('INSERT INTO cpu_percent VALUES (?, ?)',
+                             [(3600, 1.0), (3630, 3.0), (3660, 5.0)])
+        self.con.executemany('INSERT INTO net_io (time) VALUES (?)', [(3600,)])
+        store.update_rollups(self.con)
+        assert self.rows('cpu_percent_1m') == [(3600, 2.0), (3660, 5.0)]
+        assert self.rows('cpu_percent_1h') == [(3600, 3.0)]
+
+        # the last, partial, period is computed again
+        self.con.executemany('INSERT INTO cpu_percent VALUES (?, ?)',
+                             [(3690, 7.0), (7200, 9.0)])
+        store.update_rollups(self.con)
+        assert self.rows('cpu_percent_1m') == [(3600, 2.0), (3660, 6.0),
+                                               (7200, 9.0)]
+        assert self.rows('cpu_percent_1h') == [(3600, 4.0), (7200, 9.0)]
+
+    def test_counters_roll_up_to_last_value(self):
+        self.con.executemany('INSERT INTO ldap_mon (time, addRequests) '
+                             'VALUES (?, ?)', [(60, 10), (90, 15)])
+        store.update_rollups(self.con)
+        assert self.rows('ldap_mon_1m')[0][:2] == (60, 15)
+
+    def test_old_rows_are_expired(self):
+        self.con.executemany('INSERT INTO cpu_percent VALUES (?, ?)',
+                             [(0, 1.0), (7200, 2.0)])
+        store.update_rollups(self.con)
+        store.expire(self.con, 7200 + 3600,
+                     {'raw': 3600, '1m': 7200, '1h': 86400})
+        assert self.rows('cpu_percent') == [(7200, 2.0)]
+        assert self.rows('cpu_percent_1m') == [(7200, 2.0)]
+        assert len(self.rows('cpu_percent_1h')) == 2
+
+    def test_settings_override_default_retention(self):
+        settings_file = os.path.join(self.dir, 'settings.json')
+        with open(settings_file, 'w') as f:
+            json.dump({'retention': {'raw': 60, '1h': 86400},
+                       'interval': 5}, f)
+        with patch.object(store, 'settings_file', settings_file):
+            settings = store.load_settings()
+        assert settings['retention'] == {'raw': 3600, '1m': 30 * 86400,
+                                         '1h': 86400}
+        assert settings['interval'] == 5
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import socket
+import select
+import subprocess
+import unittest
+
+from mock import MagicMock
+
+from clustermgr.core.preflight import probe_matrix
+
+
+class LocalChannel(object):
+    """Channel stub running the command as a local process."""
+
+    def __init__(self):
+        self.proc = None
+
+    def exec_command(self, command):
+        self.proc = subprocess.Popen(command, shell=True,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE)
+
+    def fileno(self):
+        return self.proc.stdout.fileno()
+
+    def recv_ready(self):
+        return bool(select.select([self.proc.stdout], [], [], 0)[0])
+
+    def recv(self, size):
+        return os.read(self.proc.stdout.fileno(), size)
+
+    def exit_status_ready(self):
+        return self.proc.poll() is not None
+
+    def shutdown_write(self):
+        self.proc.stdin.close()
+
+    def close(self):
+        self.proc.wait()
+        self.proc.stdout.close()
+
+
+def ports_open(targets, timeout=2.0):
+    status = []
+    for host, port in targets:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        status.append(sock.connect_ex((host, port)) == 0)
+        sock.close()
+    return status
+
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class ProbeMatrixTestCase(unittest.TestCase):
+    def setUp(self):
+        self.busy = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.busy.bind(('127.0.0.1', 0))
+        self.busy.listen(1)
+        self.addCleanup(self.busy.close)
+
+        self.server = MagicMock()
+        self.server.host = 'server'
+        self.server.agent.ports_open.side_effect = ports_open
+        self.server.client.get_transport.return_value.open_session.\
+            side_effect = LocalChannel
+
+        self.nginx = MagicMock()
+        self.nginx.agent.ports_open.side_effect = ports_open
+
+    def test_free_ports_are_bound_and_probed_at_once(self):
+        busy_port = self.busy.getsockname()[1]
+        ports = [busy_port, free_port(), free_port()]
+        matrix = probe_matrix([('nginx', self.nginx)],
+                              [('server', self.server, '127.0.0.1')], ports)
+
+        assert matrix['listening']['server'] == {
+                            ports[0]: True, ports[1]: False, ports[2]: False}
+        assert matrix['bound']['server'] == {ports[1]: True, ports[2]: True}
+        assert matrix['reachable']['nginx']['server'] == dict(
+                                                (p, True) for p in ports)
+        self.nginx.agent.ports_open.assert_called_once()
+
+        # listeners are gone after the probe
+        assert ports_open([('127.0.0.1', ports[1])], timeout=0.5) == [False]
+
+    def test_failed_source_is_none(self):
+        self.nginx.agent.ports_open.side_effect = IOError('no agent')
+        matrix = probe_matrix([('nginx', self.nginx)],
+                              [('server', self.server, '127.0.0.1')],
+                              [free_port()])
+        assert matrix['reachable']['nginx'] is None
+
+
+if __name__ == '__main__':
+    unittest.main()
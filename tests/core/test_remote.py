@@ -1,25 +1,292 @@
+import io
+import os
+import time
+import shutil
+import tempfile
+import subprocess
 import unittest
 
 from mock import patch, MagicMock
 from paramiko import SSHException
 
-from clustermgr.core.remote import RemoteClient, ClientNotSetupException
+from clustermgr.config import Config
+from clustermgr.core.remote import RemoteClient, ClientNotSetupException, \
+    CommandTimeout, CommandResult
+
+
+class FakeChannel(object):
+    """Channel stub whose file descriptor never gets readable."""
+
+    def __init__(self, stdout=b'', exits=True):
+        self.stdout = [stdout] if stdout else []
+        self.exits = exits
+        self.closed = False
+        self.eof_received = exits
+        self.rfd, self.wfd = os.pipe()
+
+    def fileno(self):
+        return self.rfd
+
+    def exec_command(self, command):
+        pass
+
+    def recv_ready(self):
+        return bool(self.stdout)
+
+    def recv(self, size):
+        return self.stdout.pop(0)
+
+    def recv_stderr_ready(self):
+        return False
+
+    def exit_status_ready(self):
+        return self.exits
+
+    def recv_exit_status(self):
+        return 0
+
+    def close(self):
+        self.closed = True
+
+
+class LocalProcessChannel(FakeChannel):
+    """Channel stub running the command as a local process, its output is
+    available after stdin is closed."""
+
+    def __init__(self):
+        FakeChannel.__init__(self, exits=False)
+        self.stderr = []
+        self.input = io.BytesIO()
+
+    def exec_command(self, command):
+        self.command = command
+
+    def makefile(self, mode):
+        # closing the file must not discard what was written
+        self.input.close = lambda: None
+        return self.input
+
+    def shutdown_write(self):
+        p = subprocess.Popen(['sh', '-c', self.command], stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate(self.input.getvalue())
+        self.stdout = [out] if out else []
+        self.stderr = [err] if err else []
+        self.returncode = p.returncode
+        self.exits = self.eof_received = True
+
+    def recv_stderr_ready(self):
+        return bool(self.stderr)
+
+    def recv_stderr(self, size):
+        return self.stderr.pop(0)
+
+    def recv_exit_status(self):
+        return self.returncode
+
+
+class LocalSFTPFile(io.FileIO):
+    """SFTP file stub reading a local file."""
+
+    def prefetch(self):
+        pass
+
+    def stat(self):
+        return os.stat(self.name)
 
 
 class RemoteClientTestCase(unittest.TestCase):
     def setUp(self):
-        with patch("clustermgr.core.remote.SSHClient") as mock_client:
+        with patch("clustermgr.core.remote.mySSHClient") as mock_client:
             self.sshclient = mock_client.return_value
             # self.sshclient.open_sftp.return_value = MagicMock(name="sftp")
-            self.rc = RemoteClient('server')
+            self.rc = RemoteClient('server', passphrase='pw', pooled=False)
             self.rc.startup()
 
-    @patch('clustermgr.core.remote.SSHClient')
+    @patch('clustermgr.core.remote.mySSHClient')
     def test_starup_falls_back_to_ip(self, mock_client):
         instance = mock_client.return_value
         instance.connect = MagicMock(side_effect=[SSHException, None])
-        RemoteClient('server', ip='0.0.0.0').startup()
-        instance.connect.assert_called_with('0.0.0.0', port=22, username='root')
+        RemoteClient('server', ip='0.0.0.0', passphrase='pw', ssh_port=2222,
+                     pooled=False).startup()
+        instance.connect.assert_called_with(
+            '0.0.0.0', port=2222, username='root', passphrase='pw',
+            timeout=10, banner_timeout=10, auth_timeout=10)
+
+    @patch('clustermgr.core.remote.mySSHClient')
+    def test_startup_races_slow_hostname_with_ip(self, mock_client):
+        def connect(address, **kwargs):
+            if address == 'server':
+                time.sleep(2)
+
+        mock_client.return_value.connect = MagicMock(side_effect=connect)
+        start = time.time()
+        RemoteClient('server', ip='0.0.0.0', passphrase='pw',
+                     pooled=False).startup()
+        assert time.time() - start < 1
+
+    def test_run_returns_output_and_exit_status(self):
+        channel = FakeChannel(stdout=b'hello\n')
+        self.rc.client.get_transport.return_value.open_session.return_value = \
+            channel
+        cin, cout, cerr = result = self.rc.run('echo hello')
+        assert cout == 'hello\n'
+        assert result.exit_status == 0
+        assert not result.timed_out
+        assert channel.closed
+
+    def test_run_stream_yields_lines_across_chunks(self):
+        channel = FakeChannel()
+        channel.stdout = [b'first\nsec', b'ond\nthi', b'rd']
+        self.rc.client.get_transport.return_value.open_session.return_value = \
+            channel
+        with self.rc.run_stream('cat log') as stream:
+            lines = list(stream)
+        assert lines == ['first', 'second', 'third']
+        assert stream.exit_status == 0
+        assert channel.closed
+
+    def run_locally(self, command, timeout=None, input=None):
+        p = subprocess.Popen(['sh', '-c', command], stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate(input.encode() if input else None)
+        return CommandResult(out.decode(), err.decode(), p.returncode)
+
+    def test_run_batch_returns_results_per_command(self):
+        self.rc.run = MagicMock(side_effect=self.run_locally)
+        results = self.rc.run_batch(['echo out; echo err >&2; exit 2',
+                                     'printf "it\'s"'], parallel=True)
+        self.rc.run.assert_called_once()
+        assert results[0] == ('', 'out\n', 'err\n')
+        assert results[0].exit_status == 2
+        assert results[1].stdout == "it's"
+        assert results[1].exit_status == 0
+
+    def test_stat_many(self):
+        self.rc.run = MagicMock(side_effect=self.run_locally)
+        stats = self.rc.stat_many([__file__, '/nonexistent dir'])
+        assert stats[__file__]['size'] == os.path.getsize(__file__)
+        assert not stats[__file__]['isdir']
+        assert stats['/nonexistent dir'] is None
+
+    def test_sync_tree_sends_only_changed_files(self):
+        local = tempfile.mkdtemp()
+        remote = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, local)
+        self.addCleanup(shutil.rmtree, remote)
+        for name, content in (('same.txt', 'same'), ('sub/new.txt', 'new'),
+                              ('changed.txt', 'local'), ('skip.pyc', '')):
+            path = os.path.join(local, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(content)
+        for name, content in (('same.txt', 'same'), ('changed.txt', 'remote'),
+                              ('other.txt', 'other')):
+            with open(os.path.join(remote, name), 'w') as f:
+                f.write(content)
+
+        self.rc.run = MagicMock(side_effect=self.run_locally)
+        self.rc.client.get_transport.return_value.open_session.side_effect = \
+            lambda **kwargs: LocalProcessChannel()
+
+        result = self.rc.sync_tree(local, remote, exclude=['*.pyc'])
+        assert result == (True, ['changed.txt', 'sub/new.txt'])
+        assert open(os.path.join(remote, 'changed.txt')).read() == 'local'
+        assert open(os.path.join(remote, 'sub', 'new.txt')).read() == 'new'
+        assert sorted(os.listdir(remote)) == [
+            'changed.txt', 'other.txt', 'same.txt', 'sub']
+
+        assert self.rc.sync_tree(local, remote, exclude=['*.pyc']) == (True, [])
+
+    @patch('clustermgr.core.remote.SFTPClient')
+    def test_upload_large_resumes_and_verifies_checksum(self, sftp_client):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        local = os.path.join(tmp, 'archive.deb')
+        remote = os.path.join(tmp, 'remote.deb')
+        data = os.urandom(10000)
+        with open(local, 'wb') as f:
+            f.write(data)
+        # previous attempt sent the first chunk only
+        with open(remote + '.part', 'wb') as f:
+            f.write(data[:4096])
+
+        written = []
+
+        class LocalFile(io.FileIO):
+            def set_pipelined(self, pipelined):
+                pass
+
+            def write(self, b):
+                written.append(self.tell())
+                return io.FileIO.write(self, b)
+
+        sftp_client.from_transport.return_value.open.side_effect = \
+            lambda path, mode: LocalFile(path, 'r+')
+        self.rc.run = MagicMock(side_effect=self.run_locally)
+
+        assert self.rc.upload_large(local, remote, chunk_size=4096) == \
+            (True, remote)
+        assert sorted(written) == [4096, 8192]
+        assert open(remote, 'rb').read() == data
+        assert not os.path.exists(remote + '.part')
+
+    def test_upload_large_rejects_corrupted_transfer(self):
+        self.rc.run = MagicMock(side_effect=self.run_locally)
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        remote = os.path.join(tmp, 'remote.deb')
+        with open(remote + '.part', 'w') as f:
+            f.write('corrupted')
+        assert not self.rc._finish_transfer(remote, '0' * 64)[0]
+        assert not os.path.exists(remote)
+
+    def local_file(self, content):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        self.rc.sftpclient.open.side_effect = \
+            lambda filename, mode: LocalSFTPFile(filename, 'r')
+        self.rc.sftpclient.stat.side_effect = os.stat
+        return path
+
+    def test_iter_file_yields_lines_across_chunks(self):
+        path = self.local_file(u'first\nsecond \u00e7\nlast'.encode())
+        assert list(self.rc.iter_file(path, chunk_size=4)) == \
+            ['first\n', u'second \u00e7\n', 'last']
+        assert b''.join(self.rc.iter_file(path, lines=False)) == \
+            u'first\nsecond \u00e7\nlast'.encode()
+
+    def test_read_range_and_tail(self):
+        path = self.local_file(b'line 1\nline 2\nline 3\n')
+        assert self.rc.read_range(path, 7, 6) == (True, b'line 2')
+        assert self.rc.read_range(path, 100, 6) == (True, b'')
+        assert self.rc.tail(path, 10) == (True, 'line 3\n')
+        assert self.rc.tail(path, 1000) == (True, 'line 1\nline 2\nline 3\n')
+        assert self.rc.get_file(path)[1].read() == 'line 1\nline 2\nline 3\n'
+
+    def test_run_cancels_command_at_deadline(self):
+        channel = FakeChannel(stdout=b'partial', exits=False)
+        self.rc.client.get_transport.return_value.open_session.return_value = \
+            channel
+        start = time.time()
+        result = self.rc.run('sleep 100', timeout=0.2)
+        assert time.time() - start < 1
+        assert isinstance(result, CommandTimeout)
+        assert result.timed_out
+        assert result.stdout == 'partial'
+        assert channel.closed
+
+    def test_run_has_configured_deadline_by_default(self):
+        with patch.object(Config, 'SSH_COMMAND_TIMEOUT', 0.2):
+            rc = RemoteClient('server', passphrase='pw', pooled=False)
+        rc.client = self.rc.client
+        channel = FakeChannel(stdout=b'partial', exits=False)
+        rc.client.get_transport.return_value.open_session.return_value = \
+            channel
+        assert rc.run('sleep 100').timed_out
 
     def test_download_calls_sftpclient_get(self):
         rv = self.rc.download('remote', 'local')
@@ -64,5 +331,54 @@ class RemoteClientTestCase(unittest.TestCase):
             self.rc.run('s')
 
 
+class RelayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        # ssh stub writing its arguments and the known hosts it was given
+        with open(os.path.join(self.dir, 'ssh'), 'w') as f:
+            f.write('#!/bin/sh\n'
+                    'for a in "$@"; do case $a in UserKnownHostsFile=*) '
+                    'cat "${a#UserKnownHostsFile=}";; esac; done\n'
+                    'echo "$@"\n'
+                    'cat > /dev/null\n')
+        os.chmod(os.path.join(self.dir, 'ssh'), 0o755)
+
+        self.rc = RemoteClient('primary', passphrase='pw', pooled=False)
+        self.rc.client = MagicMock()
+        self.rc.sha256 = MagicMock(return_value='sum')
+        self.peer = MagicMock(ssh_port=22, user='root', ip='10.0.0.2',
+                              host='peer')
+        key = self.peer.client.get_transport.return_value.\
+            get_remote_server_key.return_value
+        key.get_name.return_value = 'ssh-ed25519'
+        key.get_base64.return_value = 'AAAAkey'
+        self.peer._finish_transfer.return_value = (True, '/root/gluu.deb')
+
+    def run_locally(self, channel, command, host, timeout):
+        env = dict(os.environ, PATH=self.dir + ':' + os.environ['PATH'])
+        p = subprocess.run(['sh', '-c', command.replace('< /root/gluu.deb',
+                                                        '< /dev/null')],
+                           env=env, stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE)
+        self.output = p.stdout.decode()
+        stream = MagicMock(stderr=p.stderr.decode())
+        stream.wait.return_value = p.returncode
+        return stream
+
+    def test_peer_host_key_is_pinned_and_agent_not_forwarded(self):
+        with patch('clustermgr.core.remote.CommandStream',
+                   side_effect=self.run_locally):
+            result = self.rc.relay_to(self.peer, '/root/gluu.deb', 'sum')
+
+        assert result == (True, '/root/gluu.deb')
+        known_host, args = self.output.splitlines()
+        assert known_host == 'clustermgr-relay-peer ssh-ed25519 AAAAkey'
+        assert args.startswith('-a ')
+        assert 'StrictHostKeyChecking=yes' in args
+        assert 'HostKeyAlias=clustermgr-relay-peer' in args
+        assert 'root@10.0.0.2' in args
+
+
 if __name__ == '__main__':
     unittest.main()
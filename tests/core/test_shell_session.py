@@ -0,0 +1,105 @@
+import os
+import select
+import subprocess
+import unittest
+
+from mock import MagicMock
+
+from clustermgr.core.shell_session import ShellSession, ShellSessionError, \
+    ShellSessionExited
+
+
+class LocalShellChannel(object):
+    """Channel stub running the shell command as a local process."""
+
+    def __init__(self):
+        self.proc = None
+        self.closed = False
+
+    def exec_command(self, command):
+        self.proc = subprocess.Popen(command, shell=True,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+
+    def fileno(self):
+        return self.proc.stdout.fileno()
+
+    def _ready(self, stream):
+        return bool(select.select([stream], [], [], 0)[0])
+
+    def recv_ready(self):
+        return self._ready(self.proc.stdout)
+
+    def recv(self, size):
+        return os.read(self.proc.stdout.fileno(), size)
+
+    def recv_stderr_ready(self):
+        return self._ready(self.proc.stderr)
+
+    def recv_stderr(self, size):
+        return os.read(self.proc.stderr.fileno(), size)
+
+    def sendall(self, data):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def exit_status_ready(self):
+        return self.proc.poll() is not None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.proc.kill()
+            self.proc.wait()
+            for stream in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
+                stream.close()
+
+
+class ShellSessionTestCase(unittest.TestCase):
+    def setUp(self):
+        conn = MagicMock()
+        conn.host = 'server'
+        conn.command_timeout = None
+        self.channel = LocalShellChannel()
+        conn.client.get_transport.return_value.open_session.return_value = \
+            self.channel
+        self.session = ShellSession(conn, 'bash')
+        self.session.start()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_streams_and_exit_status_are_separated(self):
+        cin, cout, cerr = result = self.session.run(
+            'echo out; echo err >&2; exit 3')
+        assert cout == 'out\n'
+        assert cerr == 'err\n'
+        assert result.exit_status == 3
+
+    def test_commands_do_not_share_state(self):
+        self.session.run('cd /; export CM_TEST=1')
+        result = self.session.run('echo $PWD:$CM_TEST')
+        assert result.stdout.strip() == os.getcwd() + ':'
+
+    def test_command_is_processed_like_in_double_quotes(self):
+        result = self.session.run(
+            'python3 -c \\"import sys; print(sys.argv[1])\\" \'a b\'')
+        assert result.stdout == 'a b\n'
+
+    def test_timeout_closes_session(self):
+        result = self.session.run('sleep 5', timeout=0.3)
+        assert result.timed_out
+        assert not self.session.active
+        with self.assertRaises(ShellSessionError):
+            self.session.run('true')
+
+    def test_exit_of_shell_during_command_is_reported_with_output(self):
+        with self.assertRaises(ShellSessionExited) as cm:
+            self.session.run('echo partial; kill -9 $$')
+        assert cm.exception.stdout == 'partial\n'
+        assert not self.session.active
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,57 +1,212 @@
+import os
+import shutil
+import tempfile
 import unittest
 import json
 
 from mock import patch, MagicMock
 
+from clustermgr.config import Config
 from clustermgr.weblogger import WebLogger
 
 
 class WebLoggerTestCase(unittest.TestCase):
     def setUp(self):
-        with  patch('clustermgr.weblogger.redis.Redis') as mockredis:
-            self.r = mockredis.return_value
-            self.wlog = WebLogger()
+        patcher = patch.object(Config, 'WEBLOGGER_STORE', 'stream')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.r = MagicMock()
+        self.pipe = self.r.pipeline.return_value
+        # replies of the commands of a pipeline: nothing trimmed, total 0
+        self.pipe.execute.return_value = [0] * 100
+        self.wlog = WebLogger()
+        self.wlog.r = self.r
+        self.wlog.buffering = True
+
+    def added(self):
+        """Returns (key, entry) of the messages added to streams"""
+        return [(c[0][0], json.loads(c[0][1]['msg']))
+                for c in self.pipe.xadd.call_args_list]
 
     def test_log_adds_messages_in_info_level_by_default(self):
         self.wlog.log('id1', 'message 1')
-        assert json.loads(self.r.rpush.call_args[0][1])['level'] == 'info'
+        self.wlog.flush()
+        assert self.added()[0][1]['level'] == 'info'
 
     def test_log_adds_messages_with_supplied_level(self):
         self.wlog.log('id1', 'message', 'debug')
-        assert self.r.rpush.call_args[0][0] == 'weblogger:id1'
-        assert json.loads(self.r.rpush.call_args[0][1])['level'] == 'debug'
-        assert json.loads(self.r.rpush.call_args[0][1])['msg'] == 'message'
-
         self.wlog.log('id2', 'message 2', 'warning')
-        assert self.r.rpush.call_args[0][0] == 'weblogger:id2'
-        assert json.loads(self.r.rpush.call_args[0][1])['level'] == 'warning'
-
         self.wlog.log('id3', 'message 3', 'danger')
-        assert self.r.rpush.call_args[0][0] == 'weblogger:id3'
-        assert json.loads(self.r.rpush.call_args[0][1])['level'] == 'danger'
+        self.pipe.xadd.assert_not_called()
+        self.wlog.flush()
+
+        added = self.added()
+        assert [key for key, entry in added] == [
+                            'weblogger:id1', 'weblogger:id2', 'weblogger:id3']
+        assert [entry['level'] for key, entry in added] == [
+                            'debug', 'warning', 'danger']
+        assert added[0][1]['msg'] == 'message'
+        for c in self.pipe.xadd.call_args_list:
+            assert c[1] == {'maxlen': Config.WEBLOGGER_STREAM_MAXLEN,
+                            'approximate': True}
+        self.pipe.execute.assert_called_once()
 
     def test_log_adds_extra_keyword_args_to_entry(self):
         self.wlog.log('id', 'message', 'info', name="test", run=1)
-        assert json.loads(self.r.rpush.call_args[0][1])['name'] == 'test'
-        assert json.loads(self.r.rpush.call_args[0][1])['run'] == 1
+        self.wlog.flush()
+        assert self.added()[0][1]['name'] == 'test'
+        assert self.added()[0][1]['run'] == 1
 
     def test_get_message_returns_empty_list_for_no_messages(self):
-        self.r.lrange.return_value = None
+        self.r.xrange.return_value = []
         assert self.wlog.get_messages('non existent id') == []
 
     def test_get_message_returns_list_of_messages(self):
-        message = [json.dumps(dict(level="info", msg="test message"))]
-        self.r.lrange.return_value = message
-        assert len(self.wlog.get_messages('test id')) == 1
+        message = json.dumps(dict(level="info", msg="test message"))
+        self.r.xrange.return_value = [(b'1-0', {b'msg': message.encode()})]
         assert self.wlog.get_messages('test id') == [dict(level="info", msg="test message")]
+        self.r.xrange.assert_called_with('weblogger:test id', min='-', max='+')
 
     def test_clean_deletes_all_messages(self):
+        self.wlog.log('test-id', 'message')
         self.wlog.clean('test-id')
-        self.r.delete.assert_called_with('weblogger:test-id')
+        # buffered messages are dropped
+        self.pipe.xadd.assert_not_called()
+        self.pipe.delete.assert_called_with('weblogger:test-id')
+        self.r.delete.assert_called_with('weblogger:test-id:meta')
 
     def test_set_meta(self):
+        self.wlog.log('dummy_id', 'message')
         self.wlog.set_meta('dummy_id', total_tasks=10)
-        assert self.r.set.call_args[0][0] == 'weblogger:dummy_id:meta:total_tasks'
+        self.pipe.hset.assert_called_once_with('weblogger:dummy_id:meta',
+                                               mapping={'total_tasks': 10})
+        self.pipe.expire.assert_called_with('weblogger:dummy_id:meta',
+                                            Config.WEBLOGGER_TTL)
+        # buffered messages are written before the metadata
+        names = [name for name, args, kwargs in self.pipe.method_calls]
+        assert names.index('xadd') < names.index('hset')
+
+
+class BufferedWebLoggerTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(Config, 'WEBLOGGER_STORE', 'list')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.wlog = WebLogger()
+        self.wlog.r = MagicMock()
+        self.pipe = self.wlog.r.pipeline.return_value
+        self.wlog.buffering = True
+
+    def pushed(self):
+        return [json.loads(item)['msg'] for c in self.pipe.rpush.call_args_list
+                for item in c[0][1:]]
+
+    @patch.object(Config, 'WEBLOGGER_BATCH_SIZE', 3)
+    def test_messages_are_written_in_batches(self):
+        self.wlog.log('id1', 'message 1')
+        self.wlog.log('id1', 'message 2')
+        self.pipe.execute.assert_not_called()
+
+        self.wlog.log('id1', 'message 3')
+        self.pipe.execute.assert_called_once()
+        assert self.pushed() == ['message 1', 'message 2', 'message 3']
+        self.pipe.expire.assert_called_once_with('weblogger:id1',
+                                                 Config.WEBLOGGER_TTL)
+
+    def test_flush_writes_all_tasks_in_one_pipeline(self):
+        self.wlog.log('id1', 'message 1')
+        self.wlog.log('id2', 'message 2')
+        self.wlog.flush()
+        self.pipe.execute.assert_called_once()
+        assert sorted(self.pushed()) == ['message 1', 'message 2']
+
+        self.wlog.flush()
+        self.pipe.execute.assert_called_once()
+
+    def test_buffered_messages_are_returned(self):
+        self.wlog.log('id1', 'message 1')
+        self.wlog.r.lrange.return_value = [json.dumps({'msg': 'message 1'})]
+        assert self.wlog.get_messages('id1') == [{'msg': 'message 1'}]
+        assert self.pushed() == ['message 1']
+
+        self.wlog.get_messages('id1', since=5)
+        self.wlog.r.lrange.assert_called_with('weblogger:id1', 5, -1)
+
+    def test_long_message_is_spilled_to_disk(self):
+        spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spill_dir)
+        with patch.object(Config, 'WEBLOGGER_MAX_MESSAGE_BYTES', 10), \
+                patch.object(Config, 'WEBLOGGER_SPILL_DIR', spill_dir):
+            self.wlog.log('task/1', 'x' * 25)
+        self.wlog.flush()
+
+        item = json.loads(self.pipe.rpush.call_args[0][1])
+        assert item['msg'].startswith('x' * 10 + '\n... 15 more bytes')
+        assert os.path.dirname(item['spill']) == os.path.join(spill_dir,
+                                                              'task_1')
+        assert open(item['spill']).read() == 'x' * 25
+
+
+class StreamStoreTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from redislite import Redis
+        cls.dir = tempfile.mkdtemp()
+        cls.redis = Redis(os.path.join(cls.dir, 'redis.db'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.redis.shutdown()
+        shutil.rmtree(cls.dir)
+
+    def setUp(self):
+        self.redis.flushdb()
+        self.wlog = WebLogger()
+        self.wlog.r = self.redis
+
+    def test_messages_are_read_after_cursor(self):
+        for i in range(3):
+            self.wlog.log('id1', 'message {}'.format(i))
+        entries = self.wlog.read('id1')
+        assert [msg['msg'] for cursor, msg in entries] == [
+                                        'message 0', 'message 1', 'message 2']
+        assert [msg['msg'] for cursor, msg in self.wlog.read(
+                                'id1', entries[0][0])] == [
+                                        'message 1', 'message 2']
+        assert self.wlog.read('id1', entries[-1][0]) == []
+
+    def test_metadata_is_stored_in_one_hash(self):
+        self.wlog.set_meta('id1', total_tasks=10, step=2)
+        assert self.wlog.get_meta('id1', 'step') == b'2'
+        assert self.wlog.get_all_meta('id1') == {'total_tasks': b'10',
+                                                 'step': b'2'}
+        self.wlog.clean('id1')
+        assert self.wlog.get_all_meta('id1') == {}
+
+    @patch.object(Config, 'WEBLOGGER_MEMORY_BUDGET', 1000)
+    def test_least_recently_written_logs_are_removed_over_budget(self):
+        for taskid in ('id1', 'id2', 'id3'):
+            for i in range(5):
+                self.wlog.log(taskid, 'x' * 50)
+        assert self.wlog.read('id1') == []
+        assert len(self.wlog.read('id3')) == 5
+        assert int(self.wlog.r.get('weblogger-store:total')) <= 1000
+
+    @patch.object(Config, 'WEBLOGGER_MEMORY_BUDGET', 20000)
+    @patch.object(Config, 'WEBLOGGER_STREAM_MAXLEN', 10)
+    def test_trimmed_stream_is_counted_by_entries_it_holds(self):
+        self.wlog.log('id1', 'first task')
+        for i in range(1000):
+            self.wlog.log('id2', 'x' * 50)
+
+        length = self.wlog.r.xlen('weblogger:id2')
+        assert length < 1000
+        size = int(self.wlog.r.hget('weblogger-store:sizes', 'id2'))
+        assert size < 20000
+        assert size // length == len(self.wlog.r.xrange(
+                                'weblogger:id2', count=1)[0][1][b'msg'])
+        # the log of the other task is not evicted for trimmed messages
+        assert len(self.wlog.read('id1')) == 1
 
 
 if __name__ == "__main__":
@@ -81,8 +81,8 @@ class IndexViewTestCase(unittest.TestCase):
     def test_get_log_returns_the_messages_as_json(self, mockresult, mocklogger):
         instance = mockresult.return_value
         instance.state = 'PENDING'
-        mocklogger.get_messages.return_value = [{'level': 'info', 'msg': 'Message 1'},
-                                                {'level': 'debug', 'msg': 'Message 2'}]
+        mocklogger.read.return_value = [('1', {'level': 'info', 'msg': 'Message 1'}),
+                                        ('2', {'level': 'debug', 'msg': 'Message 2'})]
         rv = self.client.get('/log/dummy-id')
         self.assertIn("Message 1", rv.data)
         self.assertIn("Message 2", rv.data)
@@ -93,7 +93,7 @@ class IndexViewTestCase(unittest.TestCase):
         instance = mockresult.return_value
         instance.state = 'SUCCESS'
         instance.result = 5
-        mocklogger.get_messages.return_value = [{'level': 'info', 'msg': 'message 1'}]
+        mocklogger.read.return_value = [('1', {'level': 'info', 'msg': 'message 1'})]
         self.client.get('/log/test-id')
         mocklogger.clean.assert_called_once()
 
@@ -103,16 +103,26 @@ class IndexViewTestCase(unittest.TestCase):
     def test_get_log_returns_the_task_result_when_task_ends(self, mockresult, mocklogger):
         instance = mockresult.return_value
         instance.state = 'PENDING'
-        mocklogger.get_messages.return_value = [{'level': 'info', 'msg': 'message 1'}]
+        mocklogger.read.return_value = [('1', {'level': 'info', 'msg': 'message 1'})]
         rv = self.client.get('/log/test-id')
         assert json.loads(rv.data)['result'] == 0
 
         instance.state = 'SUCCESS'
         instance.result = 'TASK RESULT'
-        mocklogger.get_messages.return_value = [{'level': 'info', 'msg': 'message 1'}]
+        mocklogger.read.return_value = [('1', {'level': 'info', 'msg': 'message 1'})]
         rv = self.client.get('/log/test-id')
         self.assertEqual(json.loads(rv.data)['result'], 'TASK RESULT')
 
+    @patch('clustermgr.views.index.wlogger')
+    @patch('clustermgr.views.index.AsyncResult')
+    def test_get_log_returns_messages_after_the_cursor(self, mockresult, mocklogger):
+        instance = mockresult.return_value
+        instance.state = 'PENDING'
+        mocklogger.read.return_value = [('3', {'level': 'info', 'msg': 'message 3'})]
+        rv = self.client.get('/log/test-id?since=2')
+        mocklogger.read.assert_called_once_with('test-id', '2')
+        self.assertEqual(json.loads(rv.data)['next'], '3')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -67,20 +67,63 @@ const LogContainer = (props) => {
     );
 };
 
+/**
+ *  Converts a message pushed by the weblogger to a log_item.
+ */
+const toLogItem = (id, message) => ({
+    id: id,
+    action: message.msg,
+    state: message.level,
+    output: message.output || ''
+});
+
 class Logger extends Component {
     constructor (props) {
         super(props);
+        this.state = {items: [], taskState: 'PENDING'};
+        this.cursor = '0';
+        this.count = 0;
+        this.timer = null;
+    }
+
+    componentDidMount() {
+        this.timer = setInterval(() => this.poll(), 1000);
+    }
+
+    componentWillUnmount() {
+        this.stop();
+    }
+
+    stop() {
+        clearInterval(this.timer);
+    }
 
+    addMessages(messages) {
+        const items = messages.map(message => toLogItem(++this.count, message));
+        this.setState(prevState => ({items: prevState.items.concat(items)}));
+    }
+
+    // only messages after the cursor are fetched, cursors are opaque
+    poll() {
+        if (this.polling) {
+            return;
+        }
+        this.polling = true;
+        fetch(this.props.logUrl + '?since=' + encodeURIComponent(this.cursor), {credentials: 'same-origin'})
+            .then(response => response.json())
+            .then(data => {
+                this.cursor = data.next;
+                this.addMessages(data.messages);
+                this.setState({taskState: data.state});
+                if (data.state === 'SUCCESS' || data.state === 'FAILURE') {
+                    this.stop();
+                }
+            })
+            .finally(() => { this.polling = false; });
     }
 
     render() {
-        const logData = [
-            {id:1, action: 'apt-get update -y', state: "success", output: "update succeded"},
-            {id:2, action: 'service solserver restart', state: "fail", output: "Service restarted"},
-            {id:3, action: 'apt-get install stunnel', state: "success", output: "something \n that has \n a multi-line \n output"},
-            {id:4, action: 'apt-get install redis-server', state: "running", output: "some output being streamed"},
-        ];
-        const server = "example.com";
+        const {server} = this.props;
         return (
             <div className="logger">
                 <div className="row log-header">
@@ -88,16 +131,19 @@ class Logger extends Component {
                         <h5>{"Setting up server : " + server}</h5>
                     </div>
                     <div className="col-md-4">
+                        {this.state.taskState}
                     </div>
                 </div>
-                <LogContainer items={logData} server={server}/>;
+                <LogContainer items={this.state.items} server={server}/>
             </div>
         )
 
     }
 }
 
+const logRoot = document.getElementById('log_root');
+
 ReachDOM.render(
-    <Logger/>,
-    document.getElementById('log_root')
+    <Logger logUrl={logRoot.dataset.logUrl} server={logRoot.dataset.server}/>,
+    logRoot
 );